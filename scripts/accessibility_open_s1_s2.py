@@ -5,16 +5,17 @@
 # This scripts generates a report of open bugs in the product 'Core' with the
 # severity S2.
 
+import argparse
 import csv
 import datetime
 import json
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
-import pytz
 import urllib.request
 
-from utils.bugzilla import BUG_LIST_WEB_URL, get_component_to_team, get_relevant_bug_changes
+from utils.bugzilla import BUG_LIST_WEB_URL, BugTimeline, get_component_to_team, parse_bugzilla_date
+from utils.bugcache import CachedBugzillaSearches
 from utils.versions import get_release_versions_for_weeks
+from utils.bzdata import add_bzdata_arguments, init_bzdata, recorded_value
 
 import logging
 logging.basicConfig()
@@ -52,17 +53,18 @@ MEASURE_START = '2024-01-01'
 def get_bugs(time_intervals):
 
     def bug_handler(bug_data):
-        creation_time = datetime.datetime.strptime(bug_data['creation_time'], '%Y-%m-%dT%H:%M:%SZ')
-        creation_time = pytz.utc.localize(creation_time).date()
-        for time_interval in time_intervals:
+        creation_time = parse_bugzilla_date(bug_data['creation_time'])
+        bug_timeline = BugTimeline(bug_data)
+        # Time intervals ending after the bug got created, with the status
+        # flags of the releases of all of them
+        time_intervals_created = [time_interval for time_interval in time_intervals if creation_time < time_interval['to']]
+        bug_states_by_time_interval = bug_timeline.get_relevant_bug_changes_for_time_intervals(["product", "component", "cf_accessibility_severity", "status", "resolution", "op_sys", "keywords"] + status_firefox_latest_keys, time_intervals_created)
+        for time_interval, bug_states in zip(time_intervals_created, bug_states_by_time_interval):
             start_date = time_interval['from']
             end_date = time_interval['to']
             date_label = time_interval['label']
             release_version_end_of_interval = release_versions_for_weeks[(end_date - datetime.timedelta(1)).isoformat()]
             status_firefox_release_version = f"cf_status_firefox{release_version_end_of_interval}"
-            if creation_time >= end_date:
-                continue
-            bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "cf_accessibility_severity", "status", "resolution", "op_sys", "keywords", status_firefox_release_version], start_date, end_date)
             if bug_states["cf_accessibility_severity"]["new"] not in SEVERITIES:
                 continue
             if bug_states["product"]["new"] not in PRODUCTS_TO_CHECK:
@@ -106,7 +108,7 @@ def get_bugs(time_intervals):
 
     teams = set()
 
-    release_versions_for_weeks = get_release_versions_for_weeks(time_intervals)
+    release_versions_for_weeks = recorded_value('release_versions_for_weeks', lambda: get_release_versions_for_weeks(time_intervals))
     status_firefox_latest_keys = [f"cf_status_firefox{release_version}" for release_version in sorted(list(set(release_versions_for_weeks.values())))]
 
     bugs_by_date = {}
@@ -129,6 +131,8 @@ def get_bugs(time_intervals):
               'history',
              ] + status_firefox_latest_keys
 
+    bugzilla_searches = CachedBugzillaSearches(timeout=960)
+
     params = {
         'include_fields': fields,
         'f1': 'cf_accessibility_severity',
@@ -139,9 +143,7 @@ def get_bugs(time_intervals):
         'v2': STATUS_OPEN,
     }
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
 
     params = {
         'include_fields': fields,
@@ -153,9 +155,7 @@ def get_bugs(time_intervals):
         'v2': MEASURE_START,
     }
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
 
     for severity in SEVERITIES:
         params = {
@@ -169,9 +169,9 @@ def get_bugs(time_intervals):
             'v2': MEASURE_START,
         }
 
-        Bugzilla(params,
-                 bughandler=bug_handler,
-                 timeout=960).get_data().wait()
+        bugzilla_searches.add(params, bughandler=bug_handler)
+
+    bugzilla_searches.wait()
 
     teams = sorted(list(teams))
     open_bugs_by_day_and_team = []
@@ -316,9 +316,14 @@ start_day = datetime.datetime.strptime(MEASURE_START, '%Y-%m-%d')
 if start_day.weekday() < 6:
     start_day = start_day - datetime.timedelta(start_day.weekday() + 1 - 7)
 
+parser = argparse.ArgumentParser(description='Count open S1 and S2 accessibility bugs by week')
+add_bzdata_arguments(parser)
+args = parser.parse_args()
+init_bzdata(args, 'data/accessibility_open_s1_s2_bugzilla_data.json')
+
 time_intervals = []
 from_day = start_day - datetime.timedelta(7)
-day_max = datetime.datetime.now()
+day_max = recorded_value('now', datetime.datetime.now)
 while from_day < day_max:
     to_day = from_day + datetime.timedelta(7)
     time_intervals.append({
@@ -0,0 +1,88 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Compares the speed of parsing the timestamps of recorded Bugzilla data with
+# strptime and with the parser in utils/bugzilla.py.
+#
+# Usage: python benchmark_parse_time.py data/bugzilla_data_<version>.json
+# The data can be recorded with the '--bzdata-save' option of the reports, any
+# format '--bzdata-load' accepts can be read.
+
+import argparse
+import datetime
+import pytz
+import time
+
+from utils.bugzilla import BUGZILLA_DATETIME_FORMAT, parse_bugzilla_date, parse_bugzilla_time
+from utils.bzdata import get_recorded_bug, get_recorded_bug_ids, load_bzdata
+
+TIME_FIELDS = ['when', 'creation_time', 'last_change_time', 'cf_last_resolved']
+
+def get_timestamps(data, timestamps):
+    """Collect the timestamps of bugs, their history and comments, in order"""
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key in TIME_FIELDS and isinstance(value, str):
+                timestamps.append(value)
+            else:
+                get_timestamps(value, timestamps)
+    elif isinstance(data, list):
+        for item in data:
+            get_timestamps(item, timestamps)
+    return timestamps
+
+def parse_with_strptime(timestamps):
+    for timestamp in timestamps:
+        pytz.utc.localize(datetime.datetime.strptime(timestamp, BUGZILLA_DATETIME_FORMAT))
+
+def parse_date_with_strptime(timestamps):
+    for timestamp in timestamps:
+        pytz.utc.localize(datetime.datetime.strptime(timestamp, BUGZILLA_DATETIME_FORMAT)).date()
+
+def parse_with_parser(timestamps):
+    for timestamp in timestamps:
+        parse_bugzilla_time(timestamp)
+
+def parse_date_with_parser(timestamps):
+    for timestamp in timestamps:
+        parse_bugzilla_date(timestamp)
+
+def measure(function, timestamps, repeat):
+    """Best duration of 'repeat' runs. The parser caches get cleared before each run."""
+    durations = []
+    for run in range(repeat):
+        parse_bugzilla_time.cache_clear()
+        parse_bugzilla_date.cache_clear()
+        start = time.perf_counter()
+        function(timestamps)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+parser = argparse.ArgumentParser(description='Benchmark parsing of Bugzilla timestamps')
+parser.add_argument('path',
+                    help='File with recorded Bugzilla data')
+parser.add_argument('--passes', type=int, default=5,
+                    help='How often the timestamps get parsed per run, like reports do for multiple time intervals')
+parser.add_argument('--repeat', type=int, default=5,
+                    help='Number of runs, the fastest one gets reported')
+args = parser.parse_args()
+
+load_bzdata(args.path)
+timestamps = []
+for bug_id in get_recorded_bug_ids():
+    get_timestamps(get_recorded_bug(bug_id), timestamps)
+# Both parsers have to agree before their speed gets compared.
+for timestamp in timestamps:
+    assert parse_bugzilla_time(timestamp) == pytz.utc.localize(datetime.datetime.strptime(timestamp, BUGZILLA_DATETIME_FORMAT))
+timestamps_all_passes = timestamps * args.passes
+print(f"{len(timestamps)} timestamps, {len(set(timestamps))} unique, {args.passes} passes")
+
+benchmarks = [
+    {'label': 'datetime', 'old': parse_with_strptime, 'new': parse_with_parser},
+    {'label': 'date', 'old': parse_date_with_strptime, 'new': parse_date_with_parser},
+]
+for benchmark in benchmarks:
+    duration_old = measure(benchmark['old'], timestamps_all_passes, args.repeat)
+    duration_new = measure(benchmark['new'], timestamps_all_passes, args.repeat)
+    print(f"{benchmark['label']}: strptime {duration_old:.3f}s, parser {duration_new:.3f}s, {duration_old / duration_new:.1f}x faster")
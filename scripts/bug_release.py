@@ -26,12 +26,14 @@ import csv
 import datetime
 from dateutil.relativedelta import relativedelta
 import json
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
 import productdates
-import pytz
 import utils
 
+from utils.bugzilla import parse_bugzilla_time
+from utils.bugcache import CachedBugzillaSearches
+from utils.bzdata import add_bzdata_arguments, init_bzdata, recorded_value
+
 PRODUCTS_TO_CHECK = [
     'Core',
     'DevTools',
@@ -75,25 +77,6 @@ STATUS_RESOLVED = ['fixed', 'wontfix', 'verified', 'disabled']
 
 WFMT = '{}-{:02d}'
 
-# Bugzilla data can be loaded from file
-bugzilla_data_loaded = None
-
-# Bugzilla data can be saved froto file
-bugzilla_data_to_save = {}
-
-
-def add_bugzilla_data_to_save(node_path, data):
-    # node_path is an array of strings representing the nodes in the JSON to
-    # which the data shall be saved. The node has a child 'data' which holds the
-    # data.
-    node = bugzilla_data_to_save
-    for path_step in node_path:
-        if not path_step in node:
-            node[path_step] = {'data': []}
-        node = node[path_step]
-    node['data'].append(data)
-
-
 def get_weeks(start_date, end_date):
     res = []
     weeks_attrs = {}
@@ -139,9 +122,6 @@ def get_bugs(major):
 #        data_resolved = other_data['data_resolved']
         phase = other_data['phase']
 
-        if bzdata_save_path:
-            add_bugzilla_data_to_save(['opened', phase], bug_data)
-
         # If a status flag for a Gecko/Firefox version has been disabled in
         # Bugzilla, bug_data only contains it if its value is not the default
         # "---".
@@ -172,8 +152,7 @@ def get_bugs(major):
             for change in historyItem['changes']:
                 if change['field_name'] == 'priority':
                     change_time_str = historyItem['when']
-                    change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                    change_time = pytz.utc.localize(change_time)
+                    change_time = parse_bugzilla_time(change_time_str)
 
                     priority_old = str(change['removed'])
                     priority_new = str(change['added'])
@@ -277,8 +256,7 @@ def get_bugs(major):
             for change in historyItem['changes']:
                 if change['field_name'] == status_flag_version:
                     change_time_str = historyItem['when']
-                    change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                    change_time = pytz.utc.localize(change_time)
+                    change_time = parse_bugzilla_time(change_time_str)
 
                     status_flag_version_old = str(change['removed'])
                     status_flag_version_new = str(change['added'])
@@ -321,8 +299,7 @@ def get_bugs(major):
         if phase == 'nightly':
           if not bug_data['is_open'] and bug_data['cf_last_resolved']:
               last_resolved_str = bug_data['cf_last_resolved']
-              last_resolved = datetime.datetime.strptime(last_resolved_str, '%Y-%m-%dT%H:%M:%SZ')
-              last_resolved = pytz.utc.localize(last_resolved)
+              last_resolved = parse_bugzilla_time(last_resolved_str)
               # Don't try to handle bug closures after the next major relase. The
               # week might not be part of the date range anymore.
               if last_resolved > successor_release_date:
@@ -332,8 +309,7 @@ def get_bugs(major):
               for change in historyItem['changes']:
                   if change['field_name'] == status_flag_version:
                       change_time_str = historyItem['when']
-                      change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                      change_time = pytz.utc.localize(change_time)
+                      change_time = parse_bugzilla_time(change_time_str)
 
                       status_flag_version_new = str(change['added'])
 
@@ -366,8 +342,7 @@ def get_bugs(major):
                         tracking_for_version = True
                         break
                     change_time_str = historyItem['when']
-                    change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                    change_time = pytz.utc.localize(change_time)
+                    change_time = parse_bugzilla_time(change_time_str)
 
                     # Ignore changes which were made after the subsequent major release
                     if change_time > release_date:
@@ -394,164 +369,120 @@ def get_bugs(major):
     data_fixed = {prio: {w: 0 for w in weeks} for prio in set(PRIORITIES_MAP.values())}
     data_resolved = {prio: {w: 0 for w in weeks} for prio in set(PRIORITIES_MAP.values())}
 
-    # Load Bugzilla data from file
-    if bzdata_load_path:
-        for bug_data in bugzilla_data_loaded['opened']['nightly']['data']:
-            other_data = {
-                          'phase' : 'nightly',
-                          'data_opened' : data_opened,
-                          'data_fixed' : data_fixed,
-                          'data_resolved' : data_resolved,
-                          'prio_lowered_and_increased' : prio_lowered_and_increased,
-                          'prio_increased_after_release' : prio_increased_after_release,
-                          'fixed_in_dot_release_bugs': fixed_in_dot_release_bugs,
-                          'fixed_in_successor_release_priority_bugs': fixed_in_successor_release_priority_bugs,
-                          'tracked_fixed_in_dot_release_bugs': tracked_fixed_in_dot_release_bugs,
-                          'tracked_fixed_in_successor_release_bugs': tracked_fixed_in_successor_release_bugs,
-                         }
-            bug_handler(bug_data, other_data)
-        # No beta data if version is still on Nightly.
-        if 'opened' in bugzilla_data_loaded['opened']:
-          for bug_data in bugzilla_data_loaded['opened']['beta']['data']:
-              other_data = {
-                            'phase' : 'nightly',
-                            'data_opened' : data_opened,
-                            'data_fixed' : data_fixed,
-                            'data_resolved' : data_resolved,
-                            'prio_lowered_and_increased' : prio_lowered_and_increased,
-                            'prio_increased_after_release' : prio_increased_after_release,
-                            'fixed_in_dot_release_bugs': fixed_in_dot_release_bugs,
-                            'fixed_in_successor_release_priority_bugs': fixed_in_successor_release_priority_bugs,
-                            'tracked_fixed_in_dot_release_bugs': tracked_fixed_in_dot_release_bugs,
-                            'tracked_fixed_in_successor_release_bugs': tracked_fixed_in_successor_release_bugs,
-                            'tracked_not_fixed_in_this_or_successor_release_bugs': tracked_not_fixed_in_this_or_successor_release_bugs,
-                           }
-              bug_handler(bug_data, other_data)
-    # Load Bugzilla data from Bugzilla server
-    else:
-        queries = []
-        fields = [
-                  'id',
-                  'summary',
-                  'product',
-                  'component',
-                  'creation_time',
-                  'priority',
-                  'assigned_to',
-                  'is_open',
-                  'cf_last_resolved',
-                  status_flag_version,
-                  status_flag_successor_version,
-                  'history',
-                  'groups',
-                 ]
-
-        nightly_params = {
-            'include_fields': fields,
-            'product': PRODUCTS_TO_CHECK,
-            'f1': 'creation_ts',
-            'o1': 'greaterthaneq',
-            'v1': '',
-            'f2': 'creation_ts',
-            'o2': 'lessthan',
-            'v2': '',
-            'f3': 'keywords',
-            'o3': 'notsubstring',
-            'v3': 'meta',
-            # Ignore bugs created by the bot which creates one bug per
-            # web-platform-test to sync.
-            'f4': 'reporter',
-            'o4': 'notequals',
-            'v4': 'wptsync@mozilla.bugs',
-            # Exclude intermittent failures which have priority P5 (= not
-            # crashes). Imports of tests or issues affecting tests randomly
-            # can increase the count of new intermittent bugs.
-            'f5': 'OP',
-            'n5': '1',
-            'f6': 'keywords',
-            'o6': 'allwords',
-            'v6': 'intermittent-failure',
-            'f7': 'priority',
-            'o7': 'equals',
-            'v7': 'P5',
-            'f8': 'CP',
-            # End of exclusion of intermittent failures.
-        }
-
-        beta_params = {
-            'include_fields': fields,
-            'product': PRODUCTS_TO_CHECK,
-            'f1': 'creation_ts',
-            'o1': 'greaterthaneq',
-            'v1': '',
-            'f2': 'creation_ts',
-            'o2': 'lessthan',
-            'v2': '',
-            'f3': 'keywords',
-            'o3': 'notsubstring',
-            'v3': 'meta',
-            # Ignore bugs created by the bot which creates one bug per
-            # web-platform-test to sync.
-            'f4': 'reporter',
-            'o4': 'notequals',
-            'v4': 'wptsync@mozilla.bugs',
-            # Exclude intermittent failures which have priority P5 (= not
-            # crashes). Imports of tests or issues affecting tests randomly
-            # can increase the count of new intermittent bugs.
-            'f5': 'OP',
-            'n5': '1',
-            'f6': 'keywords',
-            'o6': 'allwords',
-            'v6': 'intermittent-failure',
-            'f7': 'priority',
-            'o7': 'equals',
-            'v7': 'P5',
-            'f8': 'CP',
-            # End of exclusion of intermittent failures.
-            'f9': status_flag_version,
-            'o9': 'anyexact',
-            'v9': 'affected, fix-optional, fixed, wontfix, verified, disabled',
-        }
-
-        phases = [
-            {
-                'name' : 'nightly',
-                'query_params' : nightly_params,
-                'start_date' : nightly_start,
-                'end_date' : beta_start,
-            },
-            {
-                'name' : 'beta',
-                'query_params' : beta_params,
-                'start_date' : beta_start,
-                'end_date' : release_date,
-            },
-        ]
-        for phase in phases:
-            query_start = phase['start_date']
-            while query_start <= phase['end_date']:
-                query_end = query_start + relativedelta(days=30)
-                params = phase['query_params'].copy()
-
-                # query_start <= creation_ts < query_end
-                params['v1'] = query_start
-                params['v2'] = min(query_end, phase['end_date'])
-                
-                logger.info('Bugzilla: From {} To {}'.format(query_start, query_end))
-
-                queries.append(Bugzilla(params,
-                                        bughandler=bug_handler,
-                                        bugdata={
-                                                 'phase' : phase['name'],
-#                                                 'data_opened' : data_opened,
-#                                                 'prio_lowered_and_increased' : prio_lowered_and_increased,
-#                                                 'prio_increased_after_release' : prio_increased_after_release,
-                                                },
-                                        timeout=960))
-                query_start = query_end
-
-        for q in queries:
-            q.get_data().wait()
+    # Load Bugzilla data from Bugzilla server (or the file given with
+    # --bzdata-load)
+    bugzilla_searches = CachedBugzillaSearches(timeout=960)
+    fields = [
+              'id',
+              'summary',
+              'product',
+              'component',
+              'creation_time',
+              'priority',
+              'assigned_to',
+              'is_open',
+              'cf_last_resolved',
+              status_flag_version,
+              status_flag_successor_version,
+              'history',
+              'groups',
+             ]
+
+    nightly_params = {
+        'include_fields': fields,
+        'product': PRODUCTS_TO_CHECK,
+        'f1': 'creation_ts',
+        'o1': 'greaterthaneq',
+        'v1': '',
+        'f2': 'creation_ts',
+        'o2': 'lessthan',
+        'v2': '',
+        'f3': 'keywords',
+        'o3': 'notsubstring',
+        'v3': 'meta',
+        # Ignore bugs created by the bot which creates one bug per
+        # web-platform-test to sync.
+        'f4': 'reporter',
+        'o4': 'notequals',
+        'v4': 'wptsync@mozilla.bugs',
+        # Exclude intermittent failures which have priority P5 (= not
+        # crashes). Imports of tests or issues affecting tests randomly
+        # can increase the count of new intermittent bugs.
+        'f5': 'OP',
+        'n5': '1',
+        'f6': 'keywords',
+        'o6': 'allwords',
+        'v6': 'intermittent-failure',
+        'f7': 'priority',
+        'o7': 'equals',
+        'v7': 'P5',
+        'f8': 'CP',
+        # End of exclusion of intermittent failures.
+    }
+
+    beta_params = {
+        'include_fields': fields,
+        'product': PRODUCTS_TO_CHECK,
+        'f1': 'creation_ts',
+        'o1': 'greaterthaneq',
+        'v1': '',
+        'f2': 'creation_ts',
+        'o2': 'lessthan',
+        'v2': '',
+        'f3': 'keywords',
+        'o3': 'notsubstring',
+        'v3': 'meta',
+        # Ignore bugs created by the bot which creates one bug per
+        # web-platform-test to sync.
+        'f4': 'reporter',
+        'o4': 'notequals',
+        'v4': 'wptsync@mozilla.bugs',
+        # Exclude intermittent failures which have priority P5 (= not
+        # crashes). Imports of tests or issues affecting tests randomly
+        # can increase the count of new intermittent bugs.
+        'f5': 'OP',
+        'n5': '1',
+        'f6': 'keywords',
+        'o6': 'allwords',
+        'v6': 'intermittent-failure',
+        'f7': 'priority',
+        'o7': 'equals',
+        'v7': 'P5',
+        'f8': 'CP',
+        # End of exclusion of intermittent failures.
+        'f9': status_flag_version,
+        'o9': 'anyexact',
+        'v9': 'affected, fix-optional, fixed, wontfix, verified, disabled',
+    }
+
+    phases = [
+        {
+            'name' : 'nightly',
+            'query_params' : nightly_params,
+            'start_date' : nightly_start,
+            'end_date' : beta_start,
+        },
+        {
+            'name' : 'beta',
+            'query_params' : beta_params,
+            'start_date' : beta_start,
+            'end_date' : release_date,
+        },
+    ]
+    for phase in phases:
+        # start_date <= creation_ts < end_date, searched in windows whose
+        # size adapts to the number of bugs filed.
+        bugzilla_searches.add_windowed(phase['query_params'],
+                                       date_keys=('v1', 'v2'),
+                                       start_date=phase['start_date'],
+                                       end_date=phase['end_date'],
+                                       name='bug_release ' + phase['name'],
+                                       bughandler=bug_handler,
+                                       bugdata={
+                                                'phase' : phase['name'],
+                                               })
+
+    bugzilla_searches.wait()
 
     return (
             data_opened,
@@ -729,21 +660,14 @@ def write_csv(major):
 parser = argparse.ArgumentParser(description='Count bugs created and fixed before release, by week')
 parser.add_argument('product_version', type=int,
                     help='Firefox version')
-parser.add_argument('--bzdata-load',
-                    nargs='?',
-                    default=argparse.SUPPRESS,
-                    help='Load the Bugzilla data from a local JSON file. If no path is provided '
-                         'the program will try to load "bugzilla_data_<versionnumber>.json" from the "data" folder.')
-parser.add_argument('--bzdata-save',
-                    nargs='?',
-                    default=argparse.SUPPRESS,
-                    help='Save the Bugzilla data to a local JSON file. If no path is provided '
-                         'the program will try to save as "bugzilla_data_<versionnumber>.json" into the "data" folder.')
+add_bzdata_arguments(parser)
 args = parser.parse_args()
 
 # Firefox version for which the report gets generated.
 product_version = args.product_version
 
+init_bzdata(args, 'data/bugzilla_data_{}.json'.format(product_version))
+
 # Bugzilla status flag for this version
 status_flag_version = 'cf_status_firefox' + str(product_version)
 status_flag_successor_version = 'cf_status_firefox' + str(product_version + 1)
@@ -751,38 +675,9 @@ status_flag_successor_version = 'cf_status_firefox' + str(product_version + 1)
 # nightly_start is the date for the first nightly
 # beta_start is the datetime the first beta build started (or now if no beta yet)
 nightly_start, beta_start, release_date, successor_release_date, \
-    nightly_started, beta_started, release_started, successor_started = productdates.get_product_dates(product_version)
+    nightly_started, beta_started, release_started, successor_started = recorded_value('product_dates', lambda: productdates.get_product_dates(product_version))
 
 weeks, weeks_attrs = get_weeks(nightly_start, successor_release_date)
 
-bzdata_load_path = None
-if 'bzdata_load' in args:
-    # Load Bugzilla data from file
-    if args.bzdata_load:
-        # File path provided as command line argument
-        bzdata_load_path = args.bzdata_load
-    else:
-        # No file path provided, use default location
-        bzdata_load_path = 'data/bugzilla_data_{}.json'.format(product_version)
-    with open(bzdata_load_path, 'r') as bugzilla_data_reader:
-        bugzilla_data_loaded = json.load(bugzilla_data_reader)
-    log('Loaded Bugzilla data from {}'.format(bzdata_load_path))
-
-bzdata_save_path = None
-if 'bzdata_save' in args:
-    # File path to which Bugzilla data shall be saved
-    if args.bzdata_save:
-        # File path provided as command line argument
-        bzdata_save_path = args.bzdata_save
-    else:
-        # No file path provided, use default location
-        bzdata_save_path = 'data/bugzilla_data_{}.json'.format(product_version)
-
 write_csv(product_version)
 
-if bzdata_save_path:
-    # Save Bugzilla data to file
-    with open('data/bugzilla_data_{}.json'.format(product_version), 'w') as bugzilla_data_writer:
-        bugzilla_data_writer.write(json.dumps(bugzilla_data_to_save))
-        log('Saved Bugzilla data to {}'.format(bzdata_save_path))
-
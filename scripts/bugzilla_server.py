@@ -0,0 +1,161 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Local stand-in for the Bugzilla REST API which serves the bugs of a recording
+# made with '--bzdata-save' (or a snapshot of it), for benchmarks and offline
+# runs. Supported are the parts the reports use:
+# * /rest/bug: searches with the params evaluated by utils/bugquery.py, bug ids,
+#   'include_fields', and the 'count_only', 'limit' and 'offset' params
+#   libmozdata uses to split searches
+# * /rest/configuration: the file passed with --configuration
+# * /rest/user: the users in the file passed with --users
+#
+# Usage: python bugzilla_server.py data/firefox_team_s1_s2_bugzilla_data.json
+# and run the reports with '--bugzilla-url http://localhost:8080'.
+#
+# Only the fields recorded for a bug can be searched and returned. Bugs lacking
+# a field a search checks don't match it.
+
+import argparse
+import http.server
+import json
+import urllib.parse
+
+from utils.bugquery import QueryDataError, QueryError, get_values, matches_query, parse_query
+from utils.bzdata import get_recorded_bug, get_recorded_bug_ids, load_bzdata
+
+# Field lists which return all fields of a bug.
+ALL_FIELDS = ['_all', '_custom', '_default', '_extra']
+
+BUGS = []
+CONFIGURATION = None
+USERS = {}
+
+
+def get_params(query_string):
+    params = {}
+    for key, values in urllib.parse.parse_qs(query_string, keep_blank_values=True).items():
+        params[key] = values[0] if len(values) == 1 else values
+    return params
+
+
+def filter_fields(bug_data, include_fields):
+    if include_fields is None or any(field in ALL_FIELDS for field in include_fields):
+        return bug_data
+    return {field: value for field, value in bug_data.items() if field in include_fields}
+
+
+def search_bugs(params):
+    """Bugs matching the params, ordered by id, and the number of bugs which lack searched fields"""
+    query = parse_query(params)
+    bugs = BUGS
+    if 'id' in params:
+        bug_ids = set([int(bug_id) for bug_id in get_values(params['id'])])
+        bugs = [bug_data for bug_data in bugs if bug_data['id'] in bug_ids]
+    bugs_found = []
+    bugs_incomplete = 0
+    for bug_data in bugs:
+        try:
+            if matches_query(query, bug_data):
+                bugs_found.append(bug_data)
+        except QueryDataError:
+            bugs_incomplete += 1
+    return bugs_found, bugs_incomplete
+
+
+def get_bugs_response(params):
+    bugs_found, bugs_incomplete = search_bugs(params)
+    if bugs_incomplete:
+        print(f"{bugs_incomplete} bugs lack fields searched by {params}")
+    if 'count_only' in params:
+        return {'bug_count': len(bugs_found)}
+    offset = int(params.get('offset', 0))
+    if 'limit' in params and int(params['limit']) > 0:
+        bugs_found = bugs_found[offset:offset + int(params['limit'])]
+    else:
+        bugs_found = bugs_found[offset:]
+    include_fields = get_values(params['include_fields']) if 'include_fields' in params else None
+    return {'bugs': [filter_fields(bug_data, include_fields) for bug_data in bugs_found]}
+
+
+def get_users_response(params):
+    include_fields = get_values(params['include_fields']) if 'include_fields' in params else None
+    users = []
+    faults = []
+    requested = [('name', name) for name in get_values(params.get('names', []))]
+    requested += [('id', user_id) for user_id in get_values(params.get('ids', []))]
+    for key, value in requested:
+        user_data = USERS.get(str(value))
+        if user_data is None:
+            faults.append({key: value, 'faultString': f"There is no user named '{value}'.", 'faultCode': 51})
+        else:
+            users.append(filter_fields(user_data, include_fields))
+    return {'users': users, 'faults': faults}
+
+
+class BugzillaRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, code, message):
+        self.send_json(status, {
+            'error': True,
+            'code': code,
+            'message': message,
+        })
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = get_params(url.query)
+        path = url.path.rstrip('/')
+        try:
+            if path == '/rest/bug':
+                self.send_json(200, get_bugs_response(params))
+            elif path == '/rest/configuration':
+                if CONFIGURATION is None:
+                    self.send_error_json(404, 32614, 'No configuration loaded, pass it with --configuration')
+                else:
+                    self.send_json(200, CONFIGURATION)
+            elif path == '/rest/user':
+                self.send_json(200, get_users_response(params))
+            else:
+                self.send_error_json(404, 32614, f"The path {path} is not supported")
+        except QueryError as error:
+            self.send_error_json(400, 32000, str(error))
+
+
+parser = argparse.ArgumentParser(description='Serve recorded Bugzilla data like the Bugzilla REST API')
+parser.add_argument('bzdata',
+                    help='Bugzilla data recorded with --bzdata-save or a snapshot of it')
+parser.add_argument('--port',
+                    type=int,
+                    default=8080,
+                    help='Port to listen on, default: 8080')
+parser.add_argument('--configuration',
+                    help='JSON file with the response of /rest/configuration')
+parser.add_argument('--users',
+                    help='JSON file with a list of users as returned by /rest/user')
+args = parser.parse_args()
+
+load_bzdata(args.bzdata)
+BUGS = [get_recorded_bug(bug_id) for bug_id in get_recorded_bug_ids()]
+if args.configuration:
+    with open(args.configuration, 'r') as configuration_reader:
+        CONFIGURATION = json.load(configuration_reader)
+if args.users:
+    with open(args.users, 'r') as users_reader:
+        for user_data in json.load(users_reader):
+            USERS[user_data['name']] = user_data
+            if 'id' in user_data:
+                USERS[str(user_data['id'])] = user_data
+
+server = http.server.ThreadingHTTPServer(('localhost', args.port), BugzillaRequestHandler)
+print(f"Serving {len(BUGS)} bugs at http://localhost:{args.port}")
+server.serve_forever()
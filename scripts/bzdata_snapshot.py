@@ -0,0 +1,32 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Converts Bugzilla data recorded with '--bzdata-save' to a compact snapshot
+# (see utils/bzsnapshot.py) which '--bzdata-load' of the reports can load.
+# Recordings of older versions of the reports can be converted too.
+#
+# Usage: python bzdata_snapshot.py data/bugzilla_data_<version>.json
+# The snapshot gets written next to the recording with the extension
+# '.bzsnapshot' unless another path is provided.
+
+import argparse
+import os
+
+from utils.bzdata import load_bzdata, save_bzdata_snapshot
+
+parser = argparse.ArgumentParser(description='Convert recorded Bugzilla data to a compact snapshot')
+parser.add_argument('recording',
+                    help='Bugzilla data recorded with --bzdata-save')
+parser.add_argument('snapshot',
+                    nargs='?',
+                    help='Path of the snapshot to write')
+args = parser.parse_args()
+
+snapshot_path = args.snapshot
+if not snapshot_path:
+    snapshot_path = os.path.splitext(args.recording)[0] + '.bzsnapshot'
+
+load_bzdata(args.recording)
+save_bzdata_snapshot(snapshot_path)
+print(f"Wrote {snapshot_path}: {os.path.getsize(args.recording)} bytes recorded, {os.path.getsize(snapshot_path)} bytes in the snapshot")
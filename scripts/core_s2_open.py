@@ -5,15 +5,16 @@
 # This scripts generates a report of open bugs in the product 'Core' with the
 # severity S2.
 
+import argparse
 import csv
 import datetime
 import json
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
-import pytz
 import urllib.request
 
-from utils.bugzilla import BUG_LIST_WEB_URL, get_component_to_team, get_relevant_bug_changes
+from utils.bugzilla import BUG_LIST_WEB_URL, BugTimeline, get_component_to_team, parse_bugzilla_date
+from utils.bugcache import CachedBugzillaSearches
+from utils.bzdata import add_bzdata_arguments, init_bzdata, recorded_value
 
 import logging
 logging.basicConfig()
@@ -52,15 +53,15 @@ BUG_CREATION_START = '2020-07-01'
 def get_bugs(time_intervals):
 
     def bug_handler(bug_data):
-        creation_time = datetime.datetime.strptime(bug_data['creation_time'], '%Y-%m-%dT%H:%M:%SZ')
-        creation_time = pytz.utc.localize(creation_time).date()
-        for time_interval in time_intervals:
+        creation_time = parse_bugzilla_date(bug_data['creation_time'])
+        bug_timeline = BugTimeline(bug_data)
+        # Time intervals ending after the bug got created
+        time_intervals_created = [time_interval for time_interval in time_intervals if creation_time < time_interval['to']]
+        bug_states_by_time_interval = bug_timeline.get_relevant_bug_changes_for_time_intervals(["product", "component", "severity", "status", "resolution"], time_intervals_created)
+        for time_interval, bug_states in zip(time_intervals_created, bug_states_by_time_interval):
             start_date = time_interval['from']
             end_date = time_interval['to']
             date_label = time_interval['label']
-            if creation_time >= end_date:
-                continue
-            bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "severity", "status", "resolution"], start_date, end_date)
             if bug_states["severity"]["new"] not in SEVERITIES:
                 continue
             if bug_states["product"]["new"] not in PRODUCTS_TO_CHECK:
@@ -97,6 +98,8 @@ def get_bugs(time_intervals):
               'history',
              ]
 
+    bugzilla_searches = CachedBugzillaSearches(timeout=960)
+
     params = {
         'include_fields': fields,
         'f1': 'bug_severity',
@@ -110,9 +113,7 @@ def get_bugs(time_intervals):
         # 'v3': BUG_CREATION_BEFORE,
     }
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
 
     params = {
         'include_fields': fields,
@@ -127,9 +128,9 @@ def get_bugs(time_intervals):
         # 'v3': BUG_CREATION_BEFORE,
     }
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
+
+    bugzilla_searches.wait()
 
     teams = sorted(list(teams))
     open_bugs_by_day_and_team = []
@@ -205,9 +206,14 @@ start_day = datetime.datetime.strptime(BUG_CREATION_START, '%Y-%m-%d')
 if start_day.weekday() < 6:
     start_day = start_day - datetime.timedelta(start_day.weekday() + 1 - 7)
 
+parser = argparse.ArgumentParser(description='Count open S2 bugs in Core by week')
+add_bzdata_arguments(parser)
+args = parser.parse_args()
+init_bzdata(args, 'data/core_s2_open_bugzilla_data.json')
+
 time_intervals = []
 from_day = start_day - datetime.timedelta(7)
-day_max = min(datetime.datetime(2023, 1, 1), datetime.datetime.now())
+day_max = min(datetime.datetime(2023, 1, 1), recorded_value('now', datetime.datetime.now))
 while from_day < day_max:
     to_day = from_day + datetime.timedelta(7)
     time_intervals.append({
@@ -6,14 +6,16 @@ import argparse
 import csv
 import datetime
 import json
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
 import productdates
 import pytz
 import urllib.request
 import sys
 
-from utils.bugzilla import BUG_LIST_WEB_URL, get_relevant_bug_changes
+from utils.bugzilla import BUG_LIST_WEB_URL, get_relevant_bug_changes_for_bugs_found, parse_bugzilla_date
+from utils.bugcache import CachedBugzillaSearches
+from utils.bugcollector import BugCollector
+from utils.bzdata import add_bzdata_arguments, init_bzdata, recorded_value
 
 import logging
 logging.basicConfig()
@@ -28,12 +30,12 @@ RESOLUTIONS_IGNORED = ['INVALID']
 STATUS_OPEN_CONFIRMED = ['NEW', 'ASSIGNED', 'REOPENED']
 
 
-def get_regressions_added(label, start_date, end_date):
+def get_regressions_added(time_intervals):
 
-    def bug_handler(bug_data):
-        if bug_data['id'] in [data['id'] for data in bugs_data]:
-            return
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "severity", "status", "resolution", "keywords"], start_date, end_date)
+    def bug_handler(bug_data, time_interval_pos):
+        bugs_found.append((time_interval_pos, bug_data))
+
+    def add_regression(label, start_date, bug_data, bug_states):
         if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
             return
         if bug_states["status"]["new"] == "UNCONFIRMED":
@@ -54,7 +56,7 @@ def get_regressions_added(label, start_date, end_date):
                         perfAlertAdded = True
                 if not perfAlertAdded:
                     return
-        if datetime.datetime.strptime(bug_data["creation_time"], '%Y-%m-%dT%H:%M:%SZ').date() < start_date:
+        if parse_bugzilla_date(bug_data["creation_time"]) < start_date:
             if [bug_states["product"]["old"], bug_states["component"]["old"]] in PRODUCTS_COMPONENTS_TO_CHECK and \
               bug_states["status"]["old"] != "UNCONFIRMED" and \
               "regression" in bug_states["keywords"]["old"]:
@@ -62,19 +64,19 @@ def get_regressions_added(label, start_date, end_date):
             if [bug_states["product"]["old"], bug_states["component"]["old"]] not in PRODUCTS_COMPONENTS_TO_CHECK or \
               bug_states["status"]["old"] == "UNCONFIRMED" or \
               "regression" not in bug_states["keywords"]["old"]:
-                bugs_data.append({
+                bug_collector.add(label, 'regressions_added', bug_data, {
                   'id': bug_data['id'],
                   'severity': bug_states["severity"]["new"],
                 })
         else:
-            bugs_data.append({
+            bug_collector.add(label, 'regressions_added', bug_data, {
               'id': bug_data['id'],
               'severity': bug_states["severity"]["new"],
             })
 
-    showDebug = False
-
-    bugs_data = []
+    # Bugs found by the searches of all time intervals, the history of each
+    # bug gets walked once.
+    bugs_found = []
 
     fields = [
               'id',
@@ -88,82 +90,85 @@ def get_regressions_added(label, start_date, end_date):
               'history',
              ]
 
-    params = {
-        'include_fields': fields,
-        'f1': 'OP',
-        'j1': 'AND_G',
-        'f2': 'keywords',
-        'o2': 'changedafter',
-        'v2': start_date,
-        'f3': 'keywords',
-        'o3': 'changedbefore',
-        'v3': end_date,
-        'f4': 'CP',
-    }
-
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
-
-    params = {
-        'include_fields': fields,
-        'f1': 'keywords',
-        'o1': 'allwords',
-        'v1': 'regression',
-        'f2': 'OP',
-        'j2': 'AND',
-        'f3': 'creation_ts',
-        'o3': 'greaterthan',
-        'v3': start_date,
-        'f4': 'creation_ts',
-        'o4': 'lessthan',
-        'v4': end_date,
-        'f5': 'CP',
-    }
-
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
-
-    params = {
-        'include_fields': fields,
-        'f1': 'OP',
-        'j1': 'AND_G',
-        'f2': 'bug_status',
-        'o2': 'changedfrom',
-        'v2': 'UNCONFIRMED',
-        'f3': 'bug_status',
-        'o3': 'changedafter',
-        'v3': start_date,
-        'f4': 'bug_status',
-        'o4': 'changedbefore',
-        'v4': end_date,
-        'f5': 'CP',
-    }
-
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
-
-    return bugs_data
-
-
-def get_bugs(time_interval):
-    start_date = time_interval['from']
-    end_date = time_interval['to']
-    label = time_interval['label']
-    data = {}
-    data['regressions_added'] = get_regressions_added(label, start_date, end_date)
-
-    return data
+    bugzilla_searches = CachedBugzillaSearches(timeout=960)
+
+    for time_interval_pos, time_interval in enumerate(time_intervals):
+        start_date = time_interval['from']
+        end_date = time_interval['to']
+
+        params = {
+            'include_fields': fields,
+            'f1': 'OP',
+            'j1': 'AND_G',
+            'f2': 'keywords',
+            'o2': 'changedafter',
+            'v2': start_date,
+            'f3': 'keywords',
+            'o3': 'changedbefore',
+            'v3': end_date,
+            'f4': 'CP',
+        }
+
+        bugzilla_searches.add(params, bughandler=bug_handler, bugdata=time_interval_pos)
+
+        params = {
+            'include_fields': fields,
+            'f1': 'keywords',
+            'o1': 'allwords',
+            'v1': 'regression',
+            'f2': 'OP',
+            'j2': 'AND',
+            'f3': 'creation_ts',
+            'o3': 'greaterthan',
+            'v3': start_date,
+            'f4': 'creation_ts',
+            'o4': 'lessthan',
+            'v4': end_date,
+            'f5': 'CP',
+        }
+
+        bugzilla_searches.add(params, bughandler=bug_handler, bugdata=time_interval_pos)
+
+        params = {
+            'include_fields': fields,
+            'f1': 'OP',
+            'j1': 'AND_G',
+            'f2': 'bug_status',
+            'o2': 'changedfrom',
+            'v2': 'UNCONFIRMED',
+            'f3': 'bug_status',
+            'o3': 'changedafter',
+            'v3': start_date,
+            'f4': 'bug_status',
+            'o4': 'changedbefore',
+            'v4': end_date,
+            'f5': 'CP',
+        }
+
+        bugzilla_searches.add(params, bughandler=bug_handler, bugdata=time_interval_pos)
+
+    bugzilla_searches.wait()
+
+    bug_collector = BugCollector()
+    bug_states_found = get_relevant_bug_changes_for_bugs_found(bugs_found, ["product", "component", "severity", "status", "resolution", "keywords"], time_intervals)
+    for (time_interval_pos, bug_data), bug_states in zip(bugs_found, bug_states_found):
+        time_interval = time_intervals[time_interval_pos]
+        if bug_collector.has(time_interval['label'], 'regressions_added', bug_data['id']):
+            continue
+        add_regression(time_interval['label'], time_interval['from'], bug_data, bug_states)
+
+    return [bug_collector.get_entries(time_interval['label'], 'regressions_added') for time_interval in time_intervals]
 
 
 def measure_data(time_intervals):
+    regressions_added_by_time_interval = get_regressions_added(time_intervals)
     data_by_time_intervals = []
-    for time_interval in time_intervals:
+    for time_interval, regressions_added in zip(time_intervals, regressions_added_by_time_interval):
         data_by_time_intervals.append({
             'label': time_interval['label'],
-            'data': get_bugs(time_interval)
+            'data': {
+                'regressions_added': regressions_added,
+            },
         })
     return data_by_time_intervals
 
@@ -237,7 +242,9 @@ parser.add_argument('--version-min', type=int,
                     help='Minimum Firefox version to check')
 parser.add_argument('--weeks', type=int,
                     help='Number of recent weeks to check')
+add_bzdata_arguments(parser)
 args = parser.parse_args()
+init_bzdata(args, 'data/firefox_team_reqressions_bugzilla_data.json')
 
 time_intervals = []
 if args.date_min:
@@ -249,7 +256,7 @@ if args.date_min:
         start_sunday = start_day - datetime.timedelta(start_day.weekday() + 1 - 7)
     else:
         start_sunday = start_day
-    now = datetime.datetime.utcnow()
+    now = recorded_value('now', datetime.datetime.utcnow)
     end_sunday = now.date() - datetime.timedelta(now.weekday())
     weeks_count = (end_sunday - start_sunday).days // 7
     for week_nr in range(weeks_count):
@@ -262,7 +269,7 @@ if args.date_min:
         })
 elif args.weeks:
     for week_nr in range(args.weeks):
-        now = datetime.datetime.utcnow()
+        now = recorded_value('now', datetime.datetime.utcnow)
         to_sunday = now.date() - datetime.timedelta(now.weekday() + 1 + 7 * week_nr)
         from_sunday = to_sunday - datetime.timedelta(7)
         time_intervals.append({
@@ -272,10 +279,10 @@ elif args.weeks:
         })
     time_intervals.reverse()
 elif args.version_min:
-    releases = productdates.get_latest_nightly_versions_by_min_version(args.version_min)
+    releases = recorded_value('releases', lambda: productdates.get_latest_nightly_versions_by_min_version(args.version_min))
     for release_pos in range(len(releases)):
         if release_pos == len(releases) - 1:
-            end_date = datetime.date.today() + datetime.timedelta(days = 1)
+            end_date = recorded_value('today', datetime.date.today) + datetime.timedelta(days = 1)
         else:
             end_date = releases[release_pos + 1]['date']
         version = releases[release_pos]['version']
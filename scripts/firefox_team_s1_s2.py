@@ -8,12 +8,15 @@
 import argparse
 import csv
 import datetime
-import json
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
 import productdates
-import pytz
-import urllib.request
+
+from utils.bugcache import CachedBugzillaSearches
+from utils.bugcollector import BugCollector
+from utils.checkpoint import Checkpoint
+from utils.bugzilla import BugTimeline, get_component_teams, parse_bugzilla_date
+from utils.workeraccumulator import WorkerAccumulator
+from utils.bzdata import Bugzilla, add_bzdata_arguments, init_bzdata, recorded_value
 
 from config.firefox_team import PRODUCTS_TO_CHECK, PRODUCTS_COMPONENTS_TO_CHECK
 
@@ -25,7 +28,6 @@ requests_log.setLevel(logging.DEBUG)
 requests_log.propagate = True
 
 BUG_LIST_WEB_URL = 'https://bugzilla.mozilla.org/buglist.cgi?bug_id_type=anyexact&list_id=15921940&query_format=advanced&bug_id='
-BUGZILLA_CONFIG_URL = 'https://bugzilla.mozilla.org/rest/configuration'
 
 SEVERITIES = ['S1', 'S2']
 
@@ -37,99 +39,46 @@ STATUS_UNKNOWN = ['---']
 bugs_table = []
 
 def get_component_to_team():
-    with urllib.request.urlopen(BUGZILLA_CONFIG_URL) as request_handle:
-        data = json.loads(request_handle.read())
-
-        ID_TO_PRODUCT = {}
-        products_data = data['field']['product']['values']
-        for pos in range(len(products_data)):
-            if products_data[pos]['isactive'] == 0:
-                continue
-
-            product_name = products_data[pos]['name']
-
-            ID_TO_PRODUCT[products_data[pos]['id']] = product_name
-
-        COMPONENT_TO_TEAM = {}
-        components_data = data['field']['component']['values']
-        for component_data in components_data:
-            if component_data['isactive'] == 0:
-                continue
-
-            if component_data['product_id'] not in ID_TO_PRODUCT.keys():
-                continue
-
-            product_name = ID_TO_PRODUCT[component_data['product_id']]
-            COMPONENT_TO_TEAM[f"{product_name} :: {component_data['name']}"] = component_data['team_name']
-#            if product_name in ['Firefox', 'Toolkit', 'Core']:
-#                print(f"{product_name} :: {component_data['name']} --- {component_data['team_name']}")
+    """Teams of the active components"""
+    COMPONENT_TO_TEAM = {}
+    for product_component, component_team in get_component_teams().items():
+        if component_team['active']:
+            COMPONENT_TO_TEAM[product_component] = component_team['team']
     return COMPONENT_TO_TEAM
 
-def get_relevant_bug_changes(bug_data, fields, start_date, end_date):
-    bug_states = {}
-    for field in fields:
-        bug_states[field] = {
-            "old": None,
-            "new": None,
-        }
-    for historyItem in bug_data['history']:
-        for change in historyItem['changes']:
-            field = change['field_name']
-            if field in fields:
-                change_time_str = historyItem['when']
-                change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                change_time = pytz.utc.localize(change_time).date()
-                if change_time < start_date:
-                    bug_states[field]["old"] = change['added']
-                elif start_date <= change_time < end_date:
-                    if bug_states[field]["old"] is None:
-                        bug_states[field]["old"] = change['removed']
-                    bug_states[field]["new"] = change['added']
-                if change_time >= end_date:
-                    if bug_states[field]["old"] is None:
-                        bug_states[field]["old"] = change['removed']
-                    if bug_states[field]["new"] is None:
-                        bug_states[field]["new"] = change['removed']
-    for field in fields:
-        if field in bug_data:
-            current_value = bug_data[field]
-        else:
-            current_value = '---'
-        if bug_states[field]["old"] is None:
-            bug_states[field]["old"] = current_value
-        if bug_states[field]["new"] is None:
-            bug_states[field]["new"] = current_value
-    return bug_states
-
-def get_created(label, start_date, end_date):
-
-    def bug_handler(bug_data):
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "severity"], start_date, end_date)
-        if not bug_states["severity"]["new"] in SEVERITIES:
-            return
-        if [bug_states["product"]["new"], bug_states["component"]["new"]] in PRODUCTS_COMPONENTS_TO_CHECK:
-            bugs_data.append({
-              'id': bug_data['id'],
-            })
-            bugs_table.append([
-                bug_data['id'],
-                # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-                bug_data['product'],
-                bug_data['component'],
-                label,
-                'created',
-            ])
-
-    fields = [
-              'id',
-              'product',
-              'component',
-              'severity',
-              'history',
-             ]
+# Fields needed by all bug categories. The same list is used for all queries
+# so a bug found by multiple queries only needs to be downloaded once.
+FIELDS = [
+          'id',
+          'product',
+          'component',
+          'severity',
+          'status',
+          'resolution',
+          'creation_time',
+          'history',
+         ]
+
+# The query functions take the time intervals for which bugs shall be found.
+# For a single time interval, the queries match the bugs changed in it. For
+# multiple time intervals, they return the union of the candidate bugs for all
+# of them.
+
+def get_time_range(time_intervals):
+    range_start = min([time_interval['from'] for time_interval in time_intervals])
+    range_end = max([time_interval['to'] for time_interval in time_intervals])
+    # Earliest end of a time interval, used for changes after the end of it.
+    first_end = min([time_interval['to'] for time_interval in time_intervals])
+    return range_start, range_end, first_end
+
+def get_creation_date(bug_data):
+    return parse_bugzilla_date(bug_data["creation_time"])
+
+def get_created_queries(time_intervals):
+    range_start, range_end, first_end = get_time_range(time_intervals)
 
     params = {
-        'include_fields': fields,
+        'include_fields': FIELDS,
         'product': PRODUCTS_TO_CHECK,
         'f2': 'keywords',
         'o2': 'nowords',
@@ -165,61 +114,29 @@ def get_created(label, start_date, end_date):
         'o20': 'lessthan',
     }
 
-    params['v6'] = start_date
-    params['v12'] = start_date
-    params['v19'] = start_date
-    params['v20'] = end_date
-
-    bugs_data = []
-
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
-    data = [bug_data['id'] for bug_data in bugs_data]
+    params['v6'] = range_start
+    params['v12'] = range_start
+    params['v19'] = range_start
+    params['v20'] = range_end
 
-    return data
+    return [params]
 
-def get_increased(label, start_date, end_date):
-
-    def bug_handler(bug_data):
-        if bug_data['id'] in [data['id'] for data in bugs_data]:
-            return
-        if datetime.datetime.strptime(bug_data["creation_time"], '%Y-%m-%dT%H:%M:%SZ').date() >= start_date:
-            return
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "severity", "status"], start_date, end_date)
-        if bug_states["status"]["old"] not in STATUS_OPEN and bug_states["status"]["new"] not in STATUS_OPEN:
-            return
-        if not (bug_states["severity"]["old"] not in SEVERITIES and bug_states["severity"]["new"] in SEVERITIES):
-            return
-        if [bug_states["product"]["old"], bug_states["component"]["old"]] in PRODUCTS_COMPONENTS_TO_CHECK and [bug_states["product"]["new"], bug_states["component"]["new"]] in PRODUCTS_COMPONENTS_TO_CHECK:
-            bugs_data.append({
-              'id': bug_data['id'],
-            })
-            bugs_table.append([
-                bug_data['id'],
-                # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-                bug_data['product'],
-                bug_data['component'],
-                label,
-                'increased',
-            ])
-
-
-    bugs_data = []
+def is_created(bug_timeline, start_date, end_date):
+    # Handled by the query if only a single time interval gets checked.
+    if not (start_date <= get_creation_date(bug_timeline.bug_data) < end_date):
+        return False
+    bug_states = bug_timeline.get_relevant_bug_changes(["product", "component", "severity"], start_date, end_date)
+    if not bug_states["severity"]["new"] in SEVERITIES:
+        return False
+    return [bug_states["product"]["new"], bug_states["component"]["new"]] in PRODUCTS_COMPONENTS_TO_CHECK
 
-    fields = [
-              'id',
-              'product',
-              'component',
-              'severity',
-              'status',
-              'creation_time',
-              'history',
-             ]
+def get_increased_queries(time_intervals):
+    range_start, range_end, first_end = get_time_range(time_intervals)
 
+    queries = []
     for severity in SEVERITIES:
         params = {
-            'include_fields': fields,
+            'include_fields': FIELDS,
             'product': PRODUCTS_TO_CHECK,
             'f2': 'keywords',
             'o2': 'nowords',
@@ -235,65 +152,36 @@ def get_increased(label, start_date, end_date):
             'o7': 'changedbefore',
             'f9': 'CP',
             # Using this condition slows the query down and it fails to return data;
-            # this requirement gets handled in the `bug_handler` function
+            # this requirement gets handled in the `is_increased` function
             # 'f17': 'creation_ts',
             # 'o17': 'lessthan',
         }
 
-        params['v6'] = start_date
-        params['v7'] = end_date
+        params['v6'] = range_start
+        params['v7'] = range_end
         # See above
-        # params['v17'] = start_date
-
-        Bugzilla(params,
-                 bughandler=bug_handler,
-                 timeout=960).get_data().wait()
+        # params['v17'] = range_start
 
-    data = [bug_data['id'] for bug_data in bugs_data]
+        queries.append(params)
+    return queries
 
-    return data
-
-def get_lowered(label, start_date, end_date):
+def is_increased(bug_timeline, start_date, end_date):
+    if get_creation_date(bug_timeline.bug_data) >= start_date:
+        return False
+    bug_states = bug_timeline.get_relevant_bug_changes(["product", "component", "severity", "status"], start_date, end_date)
+    if bug_states["status"]["old"] not in STATUS_OPEN and bug_states["status"]["new"] not in STATUS_OPEN:
+        return False
+    if not (bug_states["severity"]["old"] not in SEVERITIES and bug_states["severity"]["new"] in SEVERITIES):
+        return False
+    return [bug_states["product"]["old"], bug_states["component"]["old"]] in PRODUCTS_COMPONENTS_TO_CHECK and [bug_states["product"]["new"], bug_states["component"]["new"]] in PRODUCTS_COMPONENTS_TO_CHECK
 
-    def bug_handler(bug_data):
-        if bug_data['id'] in [data['id'] for data in bugs_data]:
-            return
-        if datetime.datetime.strptime(bug_data["creation_time"], '%Y-%m-%dT%H:%M:%SZ').date() >= start_date:
-            return
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "severity", "status"], start_date, end_date)
-        if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
-            return
-        if bug_states["status"]["old"] not in STATUS_OPEN and bug_states["status"]["new"] not in STATUS_OPEN:
-            return
-        if bug_states["severity"]["old"] in SEVERITIES and bug_states["severity"]["new"] not in SEVERITIES:
-            bugs_data.append({
-              'id': bug_data['id'],
-            })
-            bugs_table.append([
-                bug_data['id'],
-                # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-                bug_data['product'],
-                bug_data['component'],
-                label,
-                'lowered',
-            ])
-
-
-    bugs_data = []
-
-    fields = [
-              'id',
-              'product',
-              'component',
-              'severity',
-              'status',
-              'creation_time',
-              'history',
-             ]
+def get_lowered_queries(time_intervals):
+    range_start, range_end, first_end = get_time_range(time_intervals)
 
+    queries = []
     for severity in SEVERITIES:
         params = {
-            'include_fields': fields,
+            'include_fields': FIELDS,
             'product': PRODUCTS_TO_CHECK,
             'f2': 'keywords',
             'o2': 'nowords',
@@ -310,55 +198,29 @@ def get_lowered(label, start_date, end_date):
             'f9': 'CP',
         }
 
-        params['v6'] = start_date
-        params['v7'] = end_date
-
-        Bugzilla(params,
-                 bughandler=bug_handler,
-                 timeout=960).get_data().wait()
+        params['v6'] = range_start
+        params['v7'] = range_end
 
-    data = [bug_data['id'] for bug_data in bugs_data]
-
-    return data
+        queries.append(params)
+    return queries
 
-def get_fixed(label, start_date, end_date):
+def is_lowered(bug_timeline, start_date, end_date):
+    if get_creation_date(bug_timeline.bug_data) >= start_date:
+        return False
+    bug_states = bug_timeline.get_relevant_bug_changes(["product", "component", "severity", "status"], start_date, end_date)
+    if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
+        return False
+    if bug_states["status"]["old"] not in STATUS_OPEN and bug_states["status"]["new"] not in STATUS_OPEN:
+        return False
+    return bug_states["severity"]["old"] in SEVERITIES and bug_states["severity"]["new"] not in SEVERITIES
 
-    def bug_handler(bug_data):
-        if bug_data['id'] in [data['id'] for data in bugs_data]:
-            return
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "severity", "resolution"], start_date, end_date)
-        if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
-            return
-        if bug_states["severity"]["new"] not in SEVERITIES:
-            return
-        if bug_states["resolution"]["old"] != 'FIXED' and bug_states["resolution"]["new"] == 'FIXED':
-            bugs_data.append({
-              'id': bug_data['id'],
-            })
-            bugs_table.append([
-                bug_data['id'],
-                # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-                bug_data['product'],
-                bug_data['component'],
-                label,
-                'fixed',
-            ])
-
-
-    bugs_data = []
-
-    fields = [
-              'id',
-              'product',
-              'component',
-              'resolution',
-              'severity',
-              'history',
-             ]
+def get_fixed_queries(time_intervals):
+    range_start, range_end, first_end = get_time_range(time_intervals)
 
+    queries = []
     for severity in SEVERITIES:
         params = {
-            'include_fields': fields,
+            'include_fields': FIELDS,
             'product': PRODUCTS_TO_CHECK,
             'f2': 'keywords',
             'o2': 'nowords',
@@ -390,56 +252,28 @@ def get_fixed(label, start_date, end_date):
             'f19': 'CP',
         }
 
-        params['v10'] = start_date
-        params['v11'] = end_date
-        params['v17'] = end_date
-
-        Bugzilla(params,
-                 bughandler=bug_handler,
-                 timeout=960).get_data().wait()
+        params['v10'] = range_start
+        params['v11'] = range_end
+        params['v17'] = first_end
 
-    data = [bug_data['id'] for bug_data in bugs_data]
+        queries.append(params)
+    return queries
 
-    return data
-
-def get_closed_but_not_fixed(label, start_date, end_date):
+def is_fixed(bug_timeline, start_date, end_date):
+    bug_states = bug_timeline.get_relevant_bug_changes(["product", "component", "severity", "resolution"], start_date, end_date)
+    if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
+        return False
+    if bug_states["severity"]["new"] not in SEVERITIES:
+        return False
+    return bug_states["resolution"]["old"] != 'FIXED' and bug_states["resolution"]["new"] == 'FIXED'
 
-    def bug_handler(bug_data):
-        if bug_data['id'] in [data['id'] for data in bugs_data]:
-            return
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "severity", "resolution"], start_date, end_date)
-        if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
-            return
-        if bug_states["severity"]["new"] not in SEVERITIES:
-            return
-        if bug_states["resolution"]["old"] == '' and bug_states["resolution"]["new"] not in ['', 'FIXED']:
-            bugs_data.append({
-              'id': bug_data['id'],
-            })
-            bugs_table.append([
-                bug_data['id'],
-                # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-                bug_data['product'],
-                bug_data['component'],
-                label,
-                'closed',
-            ])
-
-
-    bugs_data = []
-
-    fields = [
-              'id',
-              'product',
-              'component',
-              'resolution',
-              'severity',
-              'history',
-             ]
+def get_closed_but_not_fixed_queries(time_intervals):
+    range_start, range_end, first_end = get_time_range(time_intervals)
 
+    queries = []
     for severity in SEVERITIES:
         params = {
-            'include_fields': fields,
+            'include_fields': FIELDS,
             'product': PRODUCTS_TO_CHECK,
             'f2': 'keywords',
             'o2': 'nowords',
@@ -464,60 +298,29 @@ def get_closed_but_not_fixed(label, start_date, end_date):
             # 'o13': 'greaterthan',
         }
 
-        # params['v13'] = start_date - datetime.timedelta(365)
-
-        params['v10'] = start_date
-        params['v11'] = end_date
+        # params['v13'] = range_start - datetime.timedelta(365)
 
-        Bugzilla(params,
-                 bughandler=bug_handler,
-                 timeout=960).get_data().wait()
+        params['v10'] = range_start
+        params['v11'] = range_end
 
-    data = [bug_data['id'] for bug_data in bugs_data]
+        queries.append(params)
+    return queries
 
-    return data
+def is_closed_but_not_fixed(bug_timeline, start_date, end_date):
+    bug_states = bug_timeline.get_relevant_bug_changes(["product", "component", "severity", "resolution"], start_date, end_date)
+    if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
+        return False
+    if bug_states["severity"]["new"] not in SEVERITIES:
+        return False
+    return bug_states["resolution"]["old"] == '' and bug_states["resolution"]["new"] not in ['', 'FIXED']
 
-def get_moved_to(label, start_date, end_date):
-
-    def bug_handler(bug_data):
-        if bug_data['id'] in [data['id'] for data in bugs_data]:
-            return
-        if datetime.datetime.strptime(bug_data["creation_time"], '%Y-%m-%dT%H:%M:%SZ').date() >= start_date:
-            return
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "severity", "status"], start_date, end_date)
-        if bug_states["status"]["old"] not in STATUS_OPEN and bug_states["status"]["new"] not in STATUS_OPEN:
-            return
-        if bug_states["severity"]["new"] not in SEVERITIES:
-            return
-        if [bug_states["product"]["old"], bug_states["component"]["old"]] not in PRODUCTS_COMPONENTS_TO_CHECK and [bug_states["product"]["new"], bug_states["component"]["new"]] in PRODUCTS_COMPONENTS_TO_CHECK:
-            bugs_data.append({
-              'id': bug_data['id'],
-            })
-            bugs_table.append([
-                bug_data['id'],
-                # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-                bug_data['product'],
-                bug_data['component'],
-                label,
-                'moved_to',
-            ])
-
-
-    bugs_data = []
-
-    fields = [
-              'id',
-              'product',
-              'component',
-              'severity',
-              'status',
-              'creation_time',
-              'history',
-             ]
+def get_moved_to_queries(time_intervals):
+    range_start, range_end, first_end = get_time_range(time_intervals)
 
+    queries = []
     for severity in SEVERITIES:
         params = {
-            'include_fields': fields,
+            'include_fields': FIELDS,
             'f2': 'keywords',
             'o2': 'nowords',
             'v2': 'crash',
@@ -558,61 +361,32 @@ def get_moved_to(label, start_date, end_date):
             'f28': 'CP',
         }
 
-        params['v6'] = end_date
-        params['v21'] = start_date
-        params['v22'] = end_date
-        params['v25'] = start_date
-        params['v26'] = end_date
-
-        Bugzilla(params,
-                 bughandler=bug_handler,
-                 timeout=960).get_data().wait()
-
-    data = [bug_data['id'] for bug_data in bugs_data]
-
-    return data
-
-def get_moved_away(label, start_date, end_date):
-
-    def bug_handler(bug_data):
-        if bug_data['id'] in [data['id'] for data in bugs_data]:
-            return
-        if datetime.datetime.strptime(bug_data["creation_time"], '%Y-%m-%dT%H:%M:%SZ').date() > start_date:
-            return
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "severity", "status"], start_date, end_date)
-        if bug_states["status"]["old"] not in STATUS_OPEN and bug_states["status"]["new"] not in STATUS_OPEN:
-            return
-        if bug_states["severity"]["old"] not in SEVERITIES:
-            return
-        if [bug_states["product"]["old"], bug_states["component"]["old"]] in PRODUCTS_COMPONENTS_TO_CHECK and [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
-            bugs_data.append({
-              'id': bug_data['id'],
-            })
-            bugs_table.append([
-                bug_data['id'],
-                # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-                bug_data['product'],
-                bug_data['component'],
-                label,
-                'moved_away',
-            ])
-
-
-    bugs_data = []
-
-    fields = [
-              'id',
-              'product',
-              'component',
-              'severity',
-              'status',
-              'creation_time',
-              'history',
-             ]
-
+        params['v6'] = first_end
+        params['v21'] = range_start
+        params['v22'] = range_end
+        params['v25'] = range_start
+        params['v26'] = range_end
+
+        queries.append(params)
+    return queries
+
+def is_moved_to(bug_timeline, start_date, end_date):
+    if get_creation_date(bug_timeline.bug_data) >= start_date:
+        return False
+    bug_states = bug_timeline.get_relevant_bug_changes(["product", "component", "severity", "status"], start_date, end_date)
+    if bug_states["status"]["old"] not in STATUS_OPEN and bug_states["status"]["new"] not in STATUS_OPEN:
+        return False
+    if bug_states["severity"]["new"] not in SEVERITIES:
+        return False
+    return [bug_states["product"]["old"], bug_states["component"]["old"]] not in PRODUCTS_COMPONENTS_TO_CHECK and [bug_states["product"]["new"], bug_states["component"]["new"]] in PRODUCTS_COMPONENTS_TO_CHECK
+
+def get_moved_away_queries(time_intervals):
+    range_start, range_end, first_end = get_time_range(time_intervals)
+
+    queries = []
     for severity in SEVERITIES:
         params = {
-            'include_fields': fields,
+            'include_fields': FIELDS,
             'f2': 'keywords',
             'o2': 'nowords',
             'v2': 'crash',
@@ -641,74 +415,30 @@ def get_moved_away(label, start_date, end_date):
             'f23': 'CP',
         }
 
-        params['v6'] = end_date
-        params['v21'] = start_date
-        params['v22'] = end_date
-
-        Bugzilla(params,
-                 bughandler=bug_handler,
-                 timeout=960).get_data().wait()
-
-    data = [bug_data['id'] for bug_data in bugs_data]
-
-    return data
+        params['v6'] = first_end
+        params['v21'] = range_start
+        params['v22'] = range_end
 
-def get_open(label, start_date, end_date):
+        queries.append(params)
+    return queries
 
-    def bug_handler(bug_data):
-        if datetime.datetime.strptime(bug_data["creation_time"], '%Y-%m-%dT%H:%M:%SZ').date() >= end_date:
-            return
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "severity", "status"], start_date, end_date)
-        if bug_states["severity"]["new"] not in SEVERITIES:
-            return
-        if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
-            return
-        if bug_states["status"]["old"] not in STATUS_OPEN and bug_states["status"]["new"] in STATUS_OPEN:
-            if bug_data['id'] in [data['id'] for data in reopened_bugs_data]:
-                return
-            reopened_bugs_data.append({
-              'id': bug_data['id'],
-            })
-            bugs_table.append([
-                bug_data['id'],
-                # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-                bug_data['product'],
-                bug_data['component'],
-                label,
-                'reopened',
-            ])
-        if bug_states["status"]["new"] not in STATUS_OPEN:
-            return
-        if bug_data['id'] in [data['id'] for data in open_bugs_data]:
-            return
-        open_bugs_data.append({
-          'id': bug_data['id'],
-        })
-        bugs_table.append([
-            bug_data['id'],
-            # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-            bug_data['product'],
-            bug_data['component'],
-            label,
-            'open',
-        ])
+def is_moved_away(bug_timeline, start_date, end_date):
+    if get_creation_date(bug_timeline.bug_data) > start_date:
+        return False
+    bug_states = bug_timeline.get_relevant_bug_changes(["product", "component", "severity", "status"], start_date, end_date)
+    if bug_states["status"]["old"] not in STATUS_OPEN and bug_states["status"]["new"] not in STATUS_OPEN:
+        return False
+    if bug_states["severity"]["old"] not in SEVERITIES:
+        return False
+    return [bug_states["product"]["old"], bug_states["component"]["old"]] in PRODUCTS_COMPONENTS_TO_CHECK and [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK
 
-    open_bugs_data = []
-    reopened_bugs_data = []
-
-    fields = [
-              'id',
-              'product',
-              'component',
-              'severity',
-              'status',
-              'creation_time',
-              'history',
-             ]
+def get_open_queries(time_intervals):
+    range_start, range_end, first_end = get_time_range(time_intervals)
 
+    queries = []
     for severity in SEVERITIES:
         params = {
-            'include_fields': fields,
+            'include_fields': FIELDS,
             'f2': 'keywords',
             'o2': 'nowords',
             'v2': 'crash',
@@ -722,14 +452,12 @@ def get_open(label, start_date, end_date):
             'f9': 'CP',
         }
 
-        params['v6'] = end_date
+        params['v6'] = first_end
 
-        Bugzilla(params,
-                 bughandler=bug_handler,
-                 timeout=960).get_data().wait()
+        queries.append(params)
 
     params = {
-        'include_fields': fields,
+        'include_fields': FIELDS,
         'severity': SEVERITIES,
         'f2': 'keywords',
         'o2': 'nowords',
@@ -738,14 +466,12 @@ def get_open(label, start_date, end_date):
         'o3': 'changedafter',
     }
 
-    params['v3'] = end_date
+    params['v3'] = first_end
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    queries.append(params)
 
     params = {
-        'include_fields': fields,
+        'include_fields': FIELDS,
         'product': PRODUCTS_TO_CHECK,
         'bug_status': STATUS_OPEN,
         'severity': SEVERITIES,
@@ -754,32 +480,49 @@ def get_open(label, start_date, end_date):
         'v2': 'crash',
     }
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
-
-    open_data = [open_bug_data['id'] for open_bug_data in open_bugs_data]
-    reopened_data = [reopened_bug_data['id'] for reopened_bug_data in reopened_bugs_data]
+    queries.append(params)
+    return queries
+
+def get_open_states(bug_timeline, start_date, end_date):
+    if get_creation_date(bug_timeline.bug_data) >= end_date:
+        return None
+    bug_states = bug_timeline.get_relevant_bug_changes(["product", "component", "severity", "status"], start_date, end_date)
+    if bug_states["severity"]["new"] not in SEVERITIES:
+        return None
+    if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
+        return None
+    return bug_states
 
-    return [open_data, reopened_data]
+def is_reopened(bug_timeline, start_date, end_date):
+    bug_states = get_open_states(bug_timeline, start_date, end_date)
+    if bug_states is None:
+        return False
+    return bug_states["status"]["old"] not in STATUS_OPEN and bug_states["status"]["new"] in STATUS_OPEN
+
+def is_open(bug_timeline, start_date, end_date):
+    bug_states = get_open_states(bug_timeline, start_date, end_date)
+    if bug_states is None:
+        return False
+    return bug_states["status"]["new"] in STATUS_OPEN
+
+# Bug categories in the order they get added to the pivot table. 'queries'
+# finds the candidate bugs, 'classify' decides with the BugTimeline of a
+# candidate if it belongs to the category for a time interval. Categories
+# sharing the same query function only query Bugzilla once.
+BUG_CATEGORIES = [
+    {'key': 'created', 'queries': get_created_queries, 'classify': is_created},
+    {'key': 'increased', 'queries': get_increased_queries, 'classify': is_increased},
+    {'key': 'lowered', 'queries': get_lowered_queries, 'classify': is_lowered},
+    {'key': 'fixed', 'queries': get_fixed_queries, 'classify': is_fixed},
+    {'key': 'closed', 'queries': get_closed_but_not_fixed_queries, 'classify': is_closed_but_not_fixed},
+    {'key': 'moved_to', 'queries': get_moved_to_queries, 'classify': is_moved_to},
+    {'key': 'moved_away', 'queries': get_moved_away_queries, 'classify': is_moved_away},
+    {'key': 'reopened', 'queries': get_open_queries, 'classify': is_reopened},
+    {'key': 'open', 'queries': get_open_queries, 'classify': is_open},
+]
 
 def get_open_blocked_ux(label):
 
-    def bug_handler(bug_data):
-        if [bug_data["product"], bug_data["component"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
-            return
-        bugs_data.append({
-          'id': bug_data['id'],
-        })
-        bugs_table.append([
-            bug_data['id'],
-            # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-            bug_data['product'],
-            bug_data['component'],
-            label,
-            'open_blocked_ux',
-        ])
-
     fields = [
               'id',
               'product',
@@ -794,64 +537,93 @@ def get_open_blocked_ux(label):
         'keywords': 'blocked-ux',
     }
 
-    bugs_data = []
+    bugs_found = WorkerAccumulator()
 
     Bugzilla(params,
-             bughandler=bug_handler,
+             bughandler=bugs_found.add_bug,
              timeout=960).get_data().wait()
-    data = [bug_data['id'] for bug_data in bugs_data]
+
+    # Add the bugs to the shared table on this thread, ordered by id.
+    bug_collector = BugCollector(bugs_table)
+    for bug_data in bugs_found.get_items():
+        if [bug_data["product"], bug_data["component"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
+            continue
+        bug_collector.add(label, 'open_blocked_ux', bug_data)
+    data = bug_collector.get_ids(label, 'open_blocked_ux')
 
     return data
 
-def get_bugs(time_interval):
-
-    start_date = time_interval['from']
-    end_date = time_interval['to']
-    label = time_interval['label']
-    data = {}
-    data['created'] = get_created(label, start_date, end_date)
-    data['increased'] = get_increased(label, start_date, end_date)
-    data['lowered'] = get_lowered(label, start_date, end_date)
-    data['fixed'] = get_fixed(label, start_date, end_date)
-    data['closed'] = get_closed_but_not_fixed(label, start_date, end_date)
-    data['moved_to'] = get_moved_to(label, start_date, end_date)
-    data['moved_away'] = get_moved_away(label, start_date, end_date)
-    [open_data, reopened_data] = get_open(label, start_date, end_date)
-    data['open'] = open_data
-    data['reopened'] = reopened_data
+def get_bugs(time_intervals):
+    """
+    Fetch the candidate bugs of all categories for the given time intervals and
+    classify each of them for every time interval.
+    """
+
+    def bug_handler(bug_data, query_functions):
+        if bug_data['id'] not in candidates:
+            candidates[bug_data['id']] = {
+                'bug_data': bug_data,
+                'bug_timeline': BugTimeline(bug_data, missing_value='---'),
+                'query_functions': set(),
+            }
+        candidates[bug_data['id']]['query_functions'] |= query_functions
+
+    # Bugs found by the queries of each category, in the order of arrival. A bug
+    # only gets classified for the categories whose queries found it.
+    candidates = {}
+
+    # Bugs found by several queries get downloaded only once.
+    bugzilla_searches = CachedBugzillaSearches(timeout=960)
+    query_functions = []
+    for bug_category in BUG_CATEGORIES:
+        if bug_category['queries'] not in query_functions:
+            query_functions.append(bug_category['queries'])
+    for query_function in query_functions:
+        for params in query_function(time_intervals):
+            bugzilla_searches.add(params, bughandler=bug_handler, bugdata={query_function})
+    bugzilla_searches.wait()
+
+    bug_collector = BugCollector(bugs_table)
+    data_by_time_intervals = []
+    for time_interval in time_intervals:
+        start_date = time_interval['from']
+        end_date = time_interval['to']
+        label = time_interval['label']
+        data = {}
+        for bug_category in BUG_CATEGORIES:
+            for candidate in candidates.values():
+                if bug_category['queries'] not in candidate['query_functions']:
+                    continue
+                if not bug_category['classify'](candidate['bug_timeline'], start_date, end_date):
+                    continue
+                bug_collector.add(label, bug_category['key'], candidate['bug_data'])
+            data[bug_category['key']] = bug_collector.get_ids(label, bug_category['key'])
+        data_by_time_intervals.append({
+            'label': label,
+            'data': data,
+        })
 
-    return data
+    return data_by_time_intervals
 
 def get_bugs_multiple_time_intervals(time_intervals, field, conditions):
 
     def bug_handler(bug_data):
-        for time_interval_pos in range(len(time_intervals)):
-            time_interval = time_intervals[time_interval_pos]
+        bug_timeline = BugTimeline(bug_data, missing_value='---')
+        creation_date = parse_bugzilla_date(bug_data["creation_time"])
+        # Time intervals ending after the bug got created
+        time_intervals_created = [time_interval for time_interval in time_intervals if creation_date < time_interval['to']]
+        bug_states_by_time_interval = bug_timeline.get_relevant_bug_changes_for_time_intervals(["product", "component", "status"] + [field['data_name']], time_intervals_created)
+        for time_interval, bug_states in zip(time_intervals_created, bug_states_by_time_interval):
             label = time_interval['label']
-            start_date = time_interval['from']
-            end_date = time_interval['to']
-            if bug_data['id'] in [data['id'] for data in bugs_data_all_conditions[label][condition['name']]]:
-                continue
-            if datetime.datetime.strptime(bug_data["creation_time"], '%Y-%m-%dT%H:%M:%SZ').date() >= end_date:
+            if bug_collector.has(label, condition['name'], bug_data['id']):
                 continue
-            bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "status"] + [field['data_name']], start_date, end_date)
             if not condition['operator_py'](condition['values'], bug_states[field['data_name']]["new"]):
                 continue
             if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
                 continue
             if bug_states["status"]["new"] not in STATUS_OPEN:
                 continue
-            bugs_data_all_conditions[label][condition['name']].append({
-              'id': bug_data['id'],
-            })
-            bugs_table.append([
-                bug_data['id'],
-                # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
-                bug_data['product'],
-                bug_data['component'],
-                time_interval['label'],
-                condition['name'],
-            ])
+            bug_collector.add(label, condition['name'], bug_data)
 
     fields = [
               'id',
@@ -863,15 +635,9 @@ def get_bugs_multiple_time_intervals(time_intervals, field, conditions):
              ] + [field['data_name']]
 
     time_start = min([time_interval['from'] for time_interval in time_intervals])
-    bugs_data_all_conditions = {}
-    for time_interval in time_intervals:
-        label = time_interval['label']
-        bugs_data_all_conditions[label] = {}
+    bug_collector = BugCollector(bugs_table)
 
     for condition in conditions:
-        for time_interval in time_intervals:
-            label = time_interval['label']
-            bugs_data_all_conditions[label][condition['name']] = []
         # bugs_data_all_time_intervals = [[] for time_interval in time_intervals]
 
         params = {
@@ -882,9 +648,8 @@ def get_bugs_multiple_time_intervals(time_intervals, field, conditions):
             'o1': condition['operator_bz'],
             'v1': condition['values'],
         }
-        Bugzilla(params,
-                 bughandler=bug_handler,
-                 timeout=960).get_data().wait()
+        bugzilla_searches = CachedBugzillaSearches(timeout=960)
+        bugzilla_searches.add(params, bughandler=bug_handler)
 
         params = {
             'include_fields': fields,
@@ -892,15 +657,15 @@ def get_bugs_multiple_time_intervals(time_intervals, field, conditions):
             'o1': 'changedafter',
             'v1': time_start,
         }
-        Bugzilla(params,
-                 bughandler=bug_handler,
-                 timeout=960).get_data().wait()
+        bugzilla_searches.add(params, bughandler=bug_handler)
+        bugzilla_searches.wait()
 
     data_all_conditions = {}
-    for label, bugs_data_time_interval in bugs_data_all_conditions.items():
+    for time_interval in time_intervals:
+        label = time_interval['label']
         data_all_conditions[label] = {}
-        for condition_name, bugs_data_time_interval_condition in bugs_data_time_interval.items():
-            data_all_conditions[label][condition_name] = [bug_data['id'] for bug_data in bugs_data_time_interval_condition]
+        for condition in conditions:
+            data_all_conditions[label][condition['name']] = bug_collector.get_ids(label, condition['name'])
 
     return data_all_conditions
 
@@ -908,12 +673,13 @@ def log(message):
     print(message)
 
 def measure_data(time_intervals):
-    data_by_time_intervals = []
-    for time_interval in time_intervals:
-        data_by_time_intervals.append({
-            'label': time_interval['label'],
-            'data': get_bugs(time_interval)
-        })
+    # Each step gets stored once it completed, see --resume.
+    if args.single_pass:
+        data_by_time_intervals = checkpoint.run_step('bugs', get_bugs, time_intervals, table=bugs_table)
+    else:
+        data_by_time_intervals = []
+        for time_interval in time_intervals:
+            data_by_time_intervals += checkpoint.run_step('bugs ' + time_interval['label'], get_bugs, [time_interval], table=bugs_table)
 
     conditions = [
         {
@@ -930,7 +696,7 @@ def measure_data(time_intervals):
         },
     ]
     field = { 'query_name': 'status_whiteboard', 'data_name': 'whiteboard' }
-    data_multiple_conditions = get_bugs_multiple_time_intervals(time_intervals, field, conditions)
+    data_multiple_conditions = checkpoint.run_step('bugs ' + field['data_name'], get_bugs_multiple_time_intervals, time_intervals, field, conditions, table=bugs_table)
     pos = 0
     for label, data_time_interval in data_multiple_conditions.items():
         for condition_name, data_time_interval_condition in data_time_interval.items():
@@ -952,7 +718,7 @@ def measure_data(time_intervals):
         },
     ]
     field = { 'query_name': 'cf_accessibility_severity', 'data_name': 'cf_accessibility_severity' }
-    data_multiple_conditions = get_bugs_multiple_time_intervals(time_intervals, field, conditions)
+    data_multiple_conditions = checkpoint.run_step('bugs ' + field['data_name'], get_bugs_multiple_time_intervals, time_intervals, field, conditions, table=bugs_table)
     pos = 0
     for label, data_time_interval in data_multiple_conditions.items():
         for condition_name, data_time_interval_condition in data_time_interval.items():
@@ -1044,18 +810,27 @@ parser.add_argument('--version-min', type=int,
                     help='Minimum Firefox version to check')
 parser.add_argument('--weeks', type=int,
                     help='Number of recent weeks to check')
+parser.add_argument('--single-pass',
+                    action='store_true',
+                    help='Query the bugs for all time intervals at once and classify them locally')
+parser.add_argument('--resume',
+                    action='store_true',
+                    help='Skip the steps completed by an earlier run with the same arguments')
 parser.add_argument('--debug',
                     action='store_true',
                     help='Show debug information')
+add_bzdata_arguments(parser)
 args = parser.parse_args()
+init_bzdata(args, 'data/firefox_team_s1_s2_bugzilla_data.json')
 debug = args.debug
 
 COMPONENT_TO_TEAM = get_component_to_team()
 
 time_intervals = []
 if args.weeks:
+    # Read once, all weeks end relative to the same time.
+    now = recorded_value('now', datetime.datetime.utcnow)
     for week_nr in range(args.weeks):
-        now = datetime.datetime.utcnow()
         to_sunday = now.date() - datetime.timedelta(now.weekday() + 1 + 7 * week_nr)
         from_sunday = to_sunday - datetime.timedelta(7)
         time_intervals.append({
@@ -1065,10 +840,10 @@ if args.weeks:
         })
     time_intervals.reverse()
 elif args.version_min:
-    releases = productdates.get_latest_nightly_versions_by_min_version(args.version_min)
+    releases = recorded_value('releases', lambda: productdates.get_latest_nightly_versions_by_min_version(args.version_min))
     for release_pos in range(len(releases)):
         if release_pos == len(releases) - 1:
-            end_date = datetime.date.today() + datetime.timedelta(days = 1)
+            end_date = recorded_value('today', datetime.date.today) + datetime.timedelta(days = 1)
         else:
             end_date = releases[release_pos + 1]['date']
         version = releases[release_pos]['version']
@@ -1080,8 +855,13 @@ elif args.version_min:
 else:
     import sys
     sys.exit('No time intervals requested')
+checkpoint = Checkpoint('firefox_team_s1_s2', {
+    'time_intervals': time_intervals,
+    'single_pass': args.single_pass,
+}, resume=args.resume)
 data_by_time_intervals = measure_data(time_intervals)
 # open_bugs = get_open(time_intervals[-1]['label'])
-open_blocked_ux_bugs = get_open_blocked_ux(time_intervals[-1]['label'])
+open_blocked_ux_bugs = checkpoint.run_step('open_blocked_ux', get_open_blocked_ux, time_intervals[-1]['label'], table=bugs_table)
 write_csv(data_by_time_intervals, open_blocked_ux_bugs, bugs_table)
+checkpoint.remove()
 
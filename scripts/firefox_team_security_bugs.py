@@ -6,14 +6,16 @@ import argparse
 import csv
 import datetime
 import json
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
 import productdates
 import pytz
 import urllib.request
 import sys
 
-from utils.bugzilla import BUG_LIST_WEB_URL, get_relevant_bug_changes
+from utils.bugzilla import BUG_LIST_WEB_URL, get_relevant_bug_changes_for_bugs_found, parse_bugzilla_date
+from utils.bugcache import CachedBugzillaSearches
+from utils.bugcollector import BugCollector
+from utils.bzdata import add_bzdata_arguments, init_bzdata, recorded_value
 from config.firefox_team import PRODUCTS_TO_CHECK, PRODUCTS_COMPONENTS_TO_CHECK
 
 import logging
@@ -27,14 +29,14 @@ STATUS_OPEN = ['UNCONFIRMED', 'NEW', 'ASSIGNED', 'REOPENED']
 
 SEVERITIES = ['S1', 'S2']
 
-def get_security_open(label, start_date, end_date):
+def get_security_open(time_intervals):
 
-    def bug_handler(bug_data):
-        if bug_data['id'] in [data['id'] for data in bugs_data]:
+    def bug_handler(bug_data, time_interval_pos):
+        if parse_bugzilla_date(bug_data["creation_time"]) >= time_intervals[time_interval_pos]['to']:
             return
-        if datetime.datetime.strptime(bug_data["creation_time"], '%Y-%m-%dT%H:%M:%SZ').date() >= end_date:
-            return
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "status", "keywords", "severity", "groups"], start_date, end_date)
+        bugs_found.append((time_interval_pos, bug_data))
+
+    def add_security_open(label, bug_data, bug_states):
         if [bug_states["product"]["new"], bug_states["component"]["new"]] not in PRODUCTS_COMPONENTS_TO_CHECK:
             return
         if bug_states["status"]["new"] not in STATUS_OPEN:
@@ -46,11 +48,11 @@ def get_security_open(label, start_date, end_date):
             return
         if "stalled" in bug_states["keywords"]["new"] :
             return
-        bugs_data.append({
-          'id': bug_data['id'],
-        })
+        bug_collector.add(label, 'security_open', bug_data)
 
-    bugs_data = []
+    # Bugs found by the searches of all time intervals, the history of each
+    # bug gets walked once.
+    bugs_found = []
 
     fields = [
               'id',
@@ -64,57 +66,66 @@ def get_security_open(label, start_date, end_date):
               'history',
              ]
 
-    params = {
-        'include_fields': fields,
-        'f1': 'bug_group',
-        'o1': 'substring',
-        'v1': 'security',
-        'f2': 'bug_status',
-        'o2': 'anywords',
-        'v2': STATUS_OPEN,
-    }
-
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
-
-    params = {
-        'include_fields': fields,
-        'f1': 'bug_group',
-        'o1': 'substring',
-        'v1': 'security',
-        'f2': 'bug_status',
-        'o2': 'changedafter',
-        'v2': start_date,
-    }
-
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
-
-    params = {
-        'include_fields': fields,
-        'f1': 'bug_group',
-        'o1': 'changedafter',
-        'v1': start_date,
-    }
-
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
-
-    return bugs_data
-
-
-def get_security_fixed(label, start_date, end_date):
-
-    def bug_handler(bug_data):
-        if bug_data['id'] in [data['id'] for data in bugs_data]:
-            return
-        creation_date = datetime.datetime.strptime(bug_data["creation_time"], '%Y-%m-%dT%H:%M:%SZ').date()
-        if creation_date >= end_date:
+    bugzilla_searches = CachedBugzillaSearches(timeout=960)
+
+    for time_interval_pos, time_interval in enumerate(time_intervals):
+        start_date = time_interval['from']
+
+        params = {
+            'include_fields': fields,
+            'f1': 'bug_group',
+            'o1': 'substring',
+            'v1': 'security',
+            'f2': 'bug_status',
+            'o2': 'anywords',
+            'v2': STATUS_OPEN,
+        }
+
+        bugzilla_searches.add(params, bughandler=bug_handler, bugdata=time_interval_pos)
+
+        params = {
+            'include_fields': fields,
+            'f1': 'bug_group',
+            'o1': 'substring',
+            'v1': 'security',
+            'f2': 'bug_status',
+            'o2': 'changedafter',
+            'v2': start_date,
+        }
+
+        bugzilla_searches.add(params, bughandler=bug_handler, bugdata=time_interval_pos)
+
+        params = {
+            'include_fields': fields,
+            'f1': 'bug_group',
+            'o1': 'changedafter',
+            'v1': start_date,
+        }
+
+        bugzilla_searches.add(params, bughandler=bug_handler, bugdata=time_interval_pos)
+
+    bugzilla_searches.wait()
+
+    bug_collector = BugCollector()
+    bug_states_found = get_relevant_bug_changes_for_bugs_found(bugs_found, ["product", "component", "status", "keywords", "severity", "groups"], time_intervals)
+    for (time_interval_pos, bug_data), bug_states in zip(bugs_found, bug_states_found):
+        label = time_intervals[time_interval_pos]['label']
+        if bug_collector.has(label, 'security_open', bug_data['id']):
+            continue
+        add_security_open(label, bug_data, bug_states)
+
+    return [bug_collector.get_entries(time_interval['label'], 'security_open') for time_interval in time_intervals]
+
+
+def get_security_fixed(time_intervals):
+
+    def bug_handler(bug_data, time_interval_pos):
+        if parse_bugzilla_date(bug_data["creation_time"]) >= time_intervals[time_interval_pos]['to']:
             return
-        bug_states = get_relevant_bug_changes(bug_data, ["product", "component", "status", "resolution", "keywords", "severity", "groups"], start_date, end_date)
+        bugs_found.append((time_interval_pos, bug_data))
+
+    def add_security_fixed(label, start_date, bug_data, bug_states):
+        creation_date = parse_bugzilla_date(bug_data["creation_time"])
         if creation_date < start_date and bug_states["status"]["old"] not in STATUS_OPEN:
             return
         if bug_states["severity"]["new"] not in SEVERITIES:
@@ -125,11 +136,11 @@ def get_security_fixed(label, start_date, end_date):
             return
         if not any(["security" in group for group in bug_states["groups"]["new"]]):
             return
-        bugs_data.append({
-          'id': bug_data['id'],
-        })
+        bug_collector.add(label, 'security_fixed', bug_data)
 
-    bugs_data = []
+    # Bugs found by the searches of all time intervals, the history of each
+    # bug gets walked once.
+    bugs_found = []
 
     fields = [
               'id',
@@ -144,46 +155,54 @@ def get_security_fixed(label, start_date, end_date):
               'history',
              ]
 
-    params = {
-        'include_fields': fields,
-        'f1': 'OP',
-        'j1': 'AND_G',
-        'f2': 'resolution',
-        'o2': 'changedto',
-        'v2': 'FIXED',
-        'f3': 'resolution',
-        'o3': 'changedafter',
-        'v3': start_date,
-        'f4': 'resolution',
-        'o4': 'changedbefore',
-        'v4': end_date,
-        'f5': 'CP',
-    }
+    bugzilla_searches = CachedBugzillaSearches(timeout=960)
+
+    for time_interval_pos, time_interval in enumerate(time_intervals):
+        start_date = time_interval['from']
+        end_date = time_interval['to']
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+        params = {
+            'include_fields': fields,
+            'f1': 'OP',
+            'j1': 'AND_G',
+            'f2': 'resolution',
+            'o2': 'changedto',
+            'v2': 'FIXED',
+            'f3': 'resolution',
+            'o3': 'changedafter',
+            'v3': start_date,
+            'f4': 'resolution',
+            'o4': 'changedbefore',
+            'v4': end_date,
+            'f5': 'CP',
+        }
 
-    return bugs_data
+        bugzilla_searches.add(params, bughandler=bug_handler, bugdata=time_interval_pos)
 
+    bugzilla_searches.wait()
 
-def get_bugs(time_interval):
-    start_date = time_interval['from']
-    end_date = time_interval['to']
-    label = time_interval['label']
-    data = {}
-    data['security_open'] = get_security_open(label, start_date, end_date)
-    data['security_fixed'] = get_security_fixed(label, start_date, end_date)
+    bug_collector = BugCollector()
+    bug_states_found = get_relevant_bug_changes_for_bugs_found(bugs_found, ["product", "component", "status", "resolution", "keywords", "severity", "groups"], time_intervals)
+    for (time_interval_pos, bug_data), bug_states in zip(bugs_found, bug_states_found):
+        time_interval = time_intervals[time_interval_pos]
+        if bug_collector.has(time_interval['label'], 'security_fixed', bug_data['id']):
+            continue
+        add_security_fixed(time_interval['label'], time_interval['from'], bug_data, bug_states)
 
-    return data
+    return [bug_collector.get_entries(time_interval['label'], 'security_fixed') for time_interval in time_intervals]
 
 
 def measure_data(time_intervals):
+    security_open_by_time_interval = get_security_open(time_intervals)
+    security_fixed_by_time_interval = get_security_fixed(time_intervals)
     data_by_time_intervals = []
-    for time_interval in time_intervals:
+    for time_interval, security_open, security_fixed in zip(time_intervals, security_open_by_time_interval, security_fixed_by_time_interval):
         data_by_time_intervals.append({
             'label': time_interval['label'],
-            'data': get_bugs(time_interval)
+            'data': {
+                'security_open': security_open,
+                'security_fixed': security_fixed,
+            },
         })
     return data_by_time_intervals
 
@@ -226,7 +245,9 @@ parser.add_argument('--version-min', type=int,
                     help='Minimum Firefox version to check')
 parser.add_argument('--weeks', type=int,
                     help='Number of recent weeks to check')
+add_bzdata_arguments(parser)
 args = parser.parse_args()
+init_bzdata(args, 'data/firefox_team_security_bugs_bugzilla_data.json')
 
 time_intervals = []
 if args.date_min:
@@ -238,7 +259,7 @@ if args.date_min:
         start_sunday = start_day - datetime.timedelta(start_day.weekday() + 1 - 7)
     else:
         start_sunday = start_day
-    now = datetime.datetime.utcnow()
+    now = recorded_value('now', datetime.datetime.utcnow)
     end_sunday = now.date() - datetime.timedelta(now.weekday())
     weeks_count = (end_sunday - start_sunday).days // 7
     for week_nr in range(weeks_count):
@@ -251,7 +272,7 @@ if args.date_min:
         })
 elif args.weeks:
     for week_nr in range(args.weeks):
-        now = datetime.datetime.utcnow()
+        now = recorded_value('now', datetime.datetime.utcnow)
         to_sunday = now.date() - datetime.timedelta(now.weekday() + 1 + 7 * week_nr)
         from_sunday = to_sunday - datetime.timedelta(7)
         time_intervals.append({
@@ -261,10 +282,10 @@ elif args.weeks:
         })
     time_intervals.reverse()
 elif args.version_min:
-    releases = productdates.get_latest_nightly_versions_by_min_version(args.version_min)
+    releases = recorded_value('releases', lambda: productdates.get_latest_nightly_versions_by_min_version(args.version_min))
     for release_pos in range(len(releases)):
         if release_pos == len(releases) - 1:
-            end_date = datetime.date.today() + datetime.timedelta(days = 1)
+            end_date = recorded_value('today', datetime.date.today) + datetime.timedelta(days = 1)
         else:
             end_date = releases[release_pos + 1]['date']
         version = releases[release_pos]['version']
@@ -0,0 +1,23 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Writes the histories of the bugs in the bug cache to the columnar history
+# store (see utils/historystore.py). Reports started with '--history-store'
+# read the changes of bugs which didn't change since then from the store.
+#
+# Usage: python history_store.py
+
+import argparse
+
+from utils.bugcache import get_bug_cache
+from utils.historystore import HISTORY_STORE_PATH, write_history_store
+
+parser = argparse.ArgumentParser(description='Write the histories of the cached bugs to the columnar history store')
+parser.add_argument('--path',
+                    default=HISTORY_STORE_PATH,
+                    help=f'Folder of the store, default: {HISTORY_STORE_PATH}')
+args = parser.parse_args()
+
+bug_count, change_count = write_history_store(get_bug_cache().get_histories(), args.path)
+print(f"Wrote {change_count} changes of {bug_count} bugs to {args.path}")
@@ -6,17 +6,19 @@
 # * have the severity S1 or S2
 
 import argparse
+import bisect
 import csv
 import datetime
 import json
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
 import productdates
-import pytz
 import re
 import urllib.request
 
-from utils.bugzilla import get_component_to_team
+from utils.bugzilla import get_comments_by_creator, get_component_to_team, get_field_change_times, get_flag_events, pair_needinfo_requests
+from utils.bugcache import CachedBugzillaSearches
+from utils.checkpoint import Checkpoint
+from utils.bzdata import add_bzdata_arguments, init_bzdata, recorded_value
 
 import logging
 logging.basicConfig()
@@ -117,8 +119,6 @@ needinfo_types = [
     },
 ]
 
-BUGZILLA_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
-
 PRODUCTS_TO_CHECK = [
     'Core',
     'DevTools',
@@ -140,103 +140,118 @@ NEEDINFO_CREATOR_BUGZILLA_EMAIL = 'release-mgmt-account-bot@mozilla.tld'
 # to identify what the needinfo request got set for. Value in seconds.
 TIME_DIFF_MAX_NEEDINFO_COMMENT = 5
 
-def check_reaction(bug_data, initial_modification, reaction_conditions, followup_limit=FOLLOWUP_LIMIT):
-    reaction_fields = reaction_conditions['fields']
-    for historyItem in bug_data['history']:
-        change_time = parse_time(historyItem['when'], BUGZILLA_DATETIME_FORMAT)
-        if change_time > initial_modification + datetime.timedelta(seconds = followup_limit):
-            return False
-        for change in historyItem['changes']:
-            field = change['field_name']
-            if field not in reaction_fields:
-                continue
-            # change_time < initial_modification + followup_limit handled above
-            if change_time > initial_modification - datetime.timedelta(seconds = TIME_DIFF_MAX_NEEDINFO_COMMENT):
-                return True
+def check_reaction(field_change_times, initial_modification, reaction_conditions, followup_limit=FOLLOWUP_LIMIT):
+    """
+    Whether one of the reaction fields changed within the followup limit after
+    the initial modification, field_change_times like get_field_change_times()
+    returns.
+    """
+    reaction_start = initial_modification - datetime.timedelta(seconds = TIME_DIFF_MAX_NEEDINFO_COMMENT)
+    reaction_end = initial_modification + datetime.timedelta(seconds = followup_limit)
+    for field in reaction_conditions['fields']:
+        change_times = field_change_times.get(field, [])
+        # First change after the start of the reaction window
+        pos = bisect.bisect_right(change_times, reaction_start)
+        if pos < len(change_times) and change_times[pos] <= reaction_end:
+            return True
     return False
 
-def get_needinfo_histories(bug_data, start_date, end_date, needinfo_comment_identifier, needinfo_creator, reaction_conditions):
-    needinfo_histories = {}
-    for historyItem in bug_data['history']:
-        for change in historyItem['changes']:
-            field = change['field_name']
-            if field != 'flagtypes.name':
-                continue
-            if not change['added'].startswith('needinfo?') and not change['removed'].startswith('needinfo?'):
-                continue
-            if change['removed'].startswith('needinfo?'):
-                match = re.search('(?<=needinfo\?\()[^)]*(?=\))', change['removed'])
-                if match:
-                    user_needinfoed = match.group(0)
-                    needinfo_end = parse_time(historyItem['when'], BUGZILLA_DATETIME_FORMAT)
-                    if user_needinfoed in needinfo_histories.keys():
-                        # Creation of needinfo flag not missing and by desired user.
-                        # Even when a bug gets created and the needinfo flag used
-                        # during the creation, it will be recorded as change after
-                        # the bug got created.
-                        if needinfo_histories[user_needinfoed][-1]['end'] is None:
-                            # Creation of needinfo by desired user.
-                            needinfo_histories[user_needinfoed][-1]['end'] = needinfo_end
-                            reaction = check_reaction(bug_data, needinfo_end, reaction_conditions) if reaction_conditions else None
-                            needinfo_histories[user_needinfoed][-1]['reaction'] = reaction
-            if change['added'].startswith('needinfo?'):
-                if needinfo_creator is not None and historyItem['who'] != needinfo_creator:
-                    continue
-                match = re.search('(?<=needinfo\?\()[^)]*(?=\))', change['added'])
-                if not match:
-                    continue
-                user_needinfoed = match.group(0)
-                needinfo_start = parse_time(historyItem['when'], BUGZILLA_DATETIME_FORMAT)
-                if needinfo_comment_identifier is None:
-                    if user_needinfoed not in needinfo_histories.keys():
-                        needinfo_histories[user_needinfoed] = []
-                    if len(needinfo_histories[user_needinfoed]) == 0 or needinfo_histories[user_needinfoed][-1]['end']:
-                        needinfo_histories[user_needinfoed].append({
-                            'start': needinfo_start,
-                            'end': None,
-                            'reaction': None,
-                        })
+def get_comment_pattern(needinfo_comment_identifiers):
+    """
+    Regular expression finding the identifiers in a comment with one scan. The
+    lookahead finds matches at every position, longer identifiers are tried
+    first.
+    """
+    identifiers = sorted(needinfo_comment_identifiers, key=len, reverse=True)
+    return re.compile('(?=(' + '|'.join([re.escape(identifier) for identifier in identifiers]) + '))')
+
+def find_needinfo_comment_identifiers(comment_text, comment_pattern, needinfo_comment_identifiers):
+    identifiers_found = set(comment_pattern.findall(comment_text))
+    # Identifiers within a longer one found at the same position
+    for identifier in list(identifiers_found):
+        for needinfo_comment_identifier in needinfo_comment_identifiers:
+            if needinfo_comment_identifier in identifier:
+                identifiers_found.add(needinfo_comment_identifier)
+    return identifiers_found
+
+def get_needinfo_histories(bug_data, start_date, end_date, needinfo_types_to_process, with_everybodys):
+    """
+    Needinfo requests set in the time range by needinfo type key and user
+    asked. The needinfo types get identified by the key in the comment the
+    needinfo creator posted together with the request.
+    """
+    flag_events = get_flag_events(bug_data, 'needinfo')
+    needinfo_histories_by_type = {}
+    if with_everybodys:
+        needinfo_histories_by_type['everybodys_needinfos'] = pair_needinfo_requests(flag_events)
+
+    if needinfo_types_to_process:
+        needinfo_comment_identifiers = [needinfo_type['key'] for needinfo_type in needinfo_types_to_process]
+        comment_pattern = get_comment_pattern(needinfo_comment_identifiers)
+        comments_by_creator = None
+        request_identifiers = {}
+
+        def get_request_identifiers(flag_event):
+            """Identifiers in the creator's comments posted together with the request"""
+            nonlocal comments_by_creator
+            if flag_event['who'] != NEEDINFO_CREATOR_BUGZILLA_EMAIL:
+                return set()
+            if id(flag_event) not in request_identifiers:
+                if comments_by_creator is None:
+                    comments_by_creator = get_comments_by_creator(bug_data)
+                identifiers_found = set()
+                creator_comments = comments_by_creator.get(NEEDINFO_CREATOR_BUGZILLA_EMAIL)
+                if creator_comments is not None:
+                    window_start = flag_event['time'] - datetime.timedelta(seconds = TIME_DIFF_MAX_NEEDINFO_COMMENT)
+                    window_end = flag_event['time'] + datetime.timedelta(seconds = TIME_DIFF_MAX_NEEDINFO_COMMENT)
+                    # Comments created within the time difference of the needinfo
+                    pos_start = bisect.bisect_left(creator_comments['times'], window_start)
+                    pos_end = bisect.bisect_right(creator_comments['times'], window_end)
+                    for comment in creator_comments['comments'][pos_start:pos_end]:
+                        identifiers_found |= find_needinfo_comment_identifiers(comment['text'], comment_pattern, needinfo_comment_identifiers)
+                request_identifiers[id(flag_event)] = identifiers_found
+            return request_identifiers[id(flag_event)]
+
+        for needinfo_type in needinfo_types_to_process:
+            needinfo_histories_by_type[needinfo_type['key']] = pair_needinfo_requests(flag_events, lambda flag_event: needinfo_type['key'] in get_request_identifiers(flag_event))
+
+    field_change_times = None
+    reaction_conditions_by_type = {needinfo_type['key']: needinfo_type.get('reaction_conditions') for needinfo_type in needinfo_types_to_process}
+    for needinfo_key, needinfo_histories in needinfo_histories_by_type.items():
+        reaction_conditions = reaction_conditions_by_type.get(needinfo_key)
+        for user_needinfoed in needinfo_histories.keys():
+            needinfo_histories[user_needinfoed] = [needinfo_history for needinfo_history in needinfo_histories[user_needinfoed]
+                                                   if start_date <= needinfo_history['start'].date() < end_date]
+            for needinfo_history in needinfo_histories[user_needinfoed]:
+                if needinfo_history['end'] is not None and reaction_conditions:
+                    if field_change_times is None:
+                        field_change_times = get_field_change_times(bug_data)
+                    needinfo_history['reaction'] = check_reaction(field_change_times, needinfo_history['end'], reaction_conditions)
                 else:
-                    for comment in bug_data['comments']:
-                        if needinfo_creator is not None and comment['creator'] != needinfo_creator:
-                            continue
-                        if needinfo_comment_identifier not in comment['text']:
-                            continue
-                        comment_time = parse_time(comment['creation_time'], BUGZILLA_DATETIME_FORMAT)
-                        if abs((needinfo_start - comment_time).total_seconds()) > TIME_DIFF_MAX_NEEDINFO_COMMENT:
-                            continue
-                        if user_needinfoed not in needinfo_histories.keys():
-                            needinfo_histories[user_needinfoed] = []
-                        # Under rare circumstances, it's possible the same person
-                        # gets needinfo twice (e.g. with the API)
-                        if len(needinfo_histories[user_needinfoed]) == 0 or needinfo_histories[user_needinfoed][-1]['end']:
-                            needinfo_histories[user_needinfoed].append({
-                                'start': needinfo_start,
-                                'end': None,
-                                'reaction': None,
-                            })
-                        break
-    for user_needinfoed in needinfo_histories.keys():
-        for i in range(len(needinfo_histories[user_needinfoed]) - 1, -1, -1):
-            needinfo_start_date = needinfo_histories[user_needinfoed][i]['start'].date()
-            if not (start_date <= needinfo_start_date < end_date):
-                needinfo_histories[user_needinfoed].pop(i)
-    return needinfo_histories
-
-def get_needinfo_data(label, start_date, end_date, needinfo_comment_identifier, needinfo_creator=NEEDINFO_CREATOR_BUGZILLA_EMAIL, reaction_conditions={}):
+                    needinfo_history['reaction'] = None
+    return needinfo_histories_by_type
+
+def get_needinfo_data(start_date, end_date, needinfo_types_to_process, with_everybodys, bugzilla_searches):
+    """
+    Adds one search for the needinfo requests of all needinfo types to
+    bugzilla_searches. The returned lists by needinfo type key get filled once
+    the searches have run.
+    """
 
     def bug_handler(bug_data):
-        needinfo_histories = get_needinfo_histories(bug_data, start_date, end_date, needinfo_comment_identifier, needinfo_creator, reaction_conditions)
-        for user_needinfoed in needinfo_histories.keys():
-            for needinfo_history in needinfo_histories[user_needinfoed]:
-                if get_component_to_team(bug_data['product'], bug_data['component']) is None:
-                    print(f"team value None for bug {bug_data['id']}: {bug_data['product']} :: {bug_data['component']}")
-                bugs_data.append({
-                  'id': bug_data['id'],
-                  'team': get_component_to_team(bug_data['product'], bug_data['component']),
-                  'user_needinfoed': user_needinfoed,
-                  'needinfo_history': needinfo_history,
-                })
+        team = get_component_to_team(bug_data['product'], bug_data['component'])
+        needinfo_histories_by_type = get_needinfo_histories(bug_data, start_date, end_date, needinfo_types_to_process, with_everybodys)
+        for needinfo_key, needinfo_histories in needinfo_histories_by_type.items():
+            for user_needinfoed in needinfo_histories.keys():
+                for needinfo_history in needinfo_histories[user_needinfoed]:
+                    if team is None:
+                        print(f"team value None for bug {bug_data['id']}: {bug_data['product']} :: {bug_data['component']}")
+                    bugs_data_by_type[needinfo_key].append({
+                      'id': bug_data['id'],
+                      'team': team,
+                      'user_needinfoed': user_needinfoed,
+                      'needinfo_history': needinfo_history,
+                    })
 
     fields = [
               'id',
@@ -246,81 +261,114 @@ def get_needinfo_data(label, start_date, end_date, needinfo_comment_identifier,
               'history',
              ]
 
+    # Each needinfo request changes the flags, for needinfos of the bot, it
+    # also commented.
     params = {
         'include_fields': fields,
         'product': PRODUCTS_TO_CHECK,
+        'o2': 'changedafter',
+        'f2': 'flagtypes.name',
+        'v2': start_date,
+        'o3': 'changedbefore',
+        'f3': 'flagtypes.name',
+        'v3': end_date,
     }
 
-    if needinfo_comment_identifier is not None:
-        params['j_top'] = 'AND_G',
-        params['o1'] = 'changedby',
-        params['f1'] = 'longdesc',
-        params['v1'] = needinfo_creator,
-        params['o2'] = 'changedafter',
-        params['f2'] = 'longdesc',
-        params['v2'] = start_date
-        params['o3'] = 'changedbefore',
-        params['f3'] = 'longdesc',
-        params['v3'] = end_date
-        params['o4'] = 'substring',
-        params['f4'] = 'longdesc',
-        params['v4'] = needinfo_comment_identifier,
-
-    elif needinfo_creator is None:
-        params['o2'] = 'changedafter',
-        params['f2'] = 'flagtypes.name',
-        params['v2'] = start_date
-        params['o3'] = 'changedbefore',
-        params['f3'] = 'flagtypes.name',
-        params['v3'] = end_date
+    if not with_everybodys:
+        params['o4'] = 'changedby'
+        params['f4'] = 'longdesc'
+        params['v4'] = NEEDINFO_CREATOR_BUGZILLA_EMAIL
+        params['o5'] = 'changedafter'
+        params['f5'] = 'longdesc'
+        params['v5'] = start_date
 
-    bugs_data = []
+    bugs_data_by_type = {needinfo_type['key']: [] for needinfo_type in needinfo_types_to_process}
+    if with_everybodys:
+        bugs_data_by_type['everybodys_needinfos'] = []
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
 
-    return bugs_data
+    return bugs_data_by_type
 
 def measure_data_for_interval(time_interval, needinfo_types_requested):
+    bugzilla_searches = CachedBugzillaSearches(timeout=960)
 
     start_date = time_interval['from']
     end_date = time_interval['to']
-    label = time_interval['label']
-    data = {}
-    needinfo_types_to_process = needinfo_types_requested if needinfo_types_requested else needinfo_types
-    for needinfo_type in needinfo_types_to_process:
-        reaction_conditions = needinfo_type['reaction_conditions'] if 'reaction_conditions' in needinfo_type else None
-        data[needinfo_type['key']] = get_needinfo_data(label, start_date, end_date, needinfo_type['key'], reaction_conditions=reaction_conditions)
-    if needinfo_types_requested and 'everybodys_needinfos' in needinfo_types_requested:
-        data['everybodys_needinfos'] = get_needinfo_data(label, start_date, end_date, None, needinfo_creator=None)
-    elif not needinfo_types_requested:
-        data['everybodys_needinfos'] = get_needinfo_data(label, start_date, end_date, None, needinfo_creator=None)
+    if needinfo_types_requested:
+        needinfo_types_to_process = [needinfo_type for needinfo_type in needinfo_types if needinfo_type['key'] in needinfo_types_requested]
+        with_everybodys = 'everybodys_needinfos' in needinfo_types_requested
+    else:
+        needinfo_types_to_process = needinfo_types
+        with_everybodys = True
+    # One search for all needinfo types, the bugs found get classified.
+    data = get_needinfo_data(start_date, end_date, needinfo_types_to_process, with_everybodys, bugzilla_searches)
+
+    bugzilla_searches.wait()
 
     return data
 
+def get_teams_needinfo_data(time_intervals, data_by_time_intervals, now):
+    """
+    Needinfo requests of everybody from the 17 weeks before now. The requests
+    found for the time intervals get reused, only the days not covered by them
+    get searched.
+    """
+    to_sunday = now.date() - datetime.timedelta(now.weekday() + 1)
+    # Look at last 17 weeks for responsiveness by team
+    from_sunday = to_sunday - datetime.timedelta(17 * 7)
+
+    bugs_data = []
+    ranges_covered = []
+    for time_interval, data_by_time_interval in sorted(zip(time_intervals, data_by_time_intervals), key=lambda interval_data: interval_data[0]['from']):
+        if 'everybodys_needinfos' not in data_by_time_interval['data']:
+            continue
+        range_start = max(time_interval['from'], from_sunday)
+        if ranges_covered:
+            # Days of overlapping time intervals get counted once.
+            range_start = max(range_start, ranges_covered[-1][1])
+        range_end = min(time_interval['to'], to_sunday)
+        if range_start >= range_end:
+            continue
+        ranges_covered.append((range_start, range_end))
+        for bug_data in data_by_time_interval['data']['everybodys_needinfos']:
+            if range_start <= bug_data['needinfo_history']['start'].date() < range_end:
+                bugs_data.append(bug_data)
+
+    ranges_missing = []
+    range_start = from_sunday
+    for range_covered_start, range_covered_end in ranges_covered:
+        if range_start < range_covered_start:
+            ranges_missing.append((range_start, range_covered_start))
+        range_start = max(range_start, range_covered_end)
+    if range_start < to_sunday:
+        ranges_missing.append((range_start, to_sunday))
+
+    if ranges_missing:
+        bugzilla_searches = CachedBugzillaSearches(timeout=960)
+        bugs_data_missing = [get_needinfo_data(range_start, range_end, [], True, bugzilla_searches)['everybodys_needinfos']
+                             for range_start, range_end in ranges_missing]
+        bugzilla_searches.wait()
+        for bugs_data_range in bugs_data_missing:
+            bugs_data.extend(bugs_data_range)
+
+    return bugs_data
+
 def log(message):
     print(message)
 
-def parse_time(string, format_string):
-    change_time = datetime.datetime.strptime(string, format_string)
-    return pytz.utc.localize(change_time)
-
-def measure_data(time_intervals, needinfo_types_requested):
+def measure_data(time_intervals, needinfo_types_requested, now):
+    # Each time interval gets stored once its searches completed, see --resume.
+    # Bugs found again for later time intervals are served by the bug cache.
     data_by_time_intervals = []
     for time_interval in time_intervals:
         data_by_time_intervals.append({
             'label': time_interval['label'],
-            'data': measure_data_for_interval(time_interval, needinfo_types_requested)
+            'data': checkpoint.run_step('needinfos ' + time_interval['label'], measure_data_for_interval, time_interval, needinfo_types_requested)
         })
 
     if run_teams:
-        now = datetime.datetime.utcnow()
-        to_sunday = now.date() - datetime.timedelta(now.weekday() + 1)
-        # Look at last 17 weeks for responsiveness by team
-        from_sunday = to_sunday - datetime.timedelta(17 * 7)
-        bugs_data = get_needinfo_data(to_sunday.isoformat(), from_sunday, to_sunday, None, needinfo_creator=None)
-
+        bugs_data = checkpoint.run_step('teams', get_teams_needinfo_data, time_intervals, data_by_time_intervals, now)
         teams_bugs = {}
         for bug_data in bugs_data:
             team = bug_data['team']
@@ -513,18 +561,25 @@ parser.add_argument('--types',
 parser.add_argument('--skip-teams',
                     action='store_true',
                     help='Do not generate a report about needinfo requests by team')
+parser.add_argument('--resume',
+                    action='store_true',
+                    help='Skip the time intervals completed by an earlier run with the same arguments')
 parser.add_argument('--debug',
                     action='store_true',
                     help='Show debug information')
+add_bzdata_arguments(parser)
 args = parser.parse_args()
+init_bzdata(args, 'data/needinfo_autonag_bugzilla_data.json')
 debug = args.debug
 run_teams = not args.skip_teams
 needinfo_types_requested = args.types
 
+# Read once, the weeks and the team report end relative to the same time.
+now = recorded_value('now', datetime.datetime.utcnow) if args.weeks or run_teams else None
+
 time_intervals = []
 if args.weeks:
     for week_nr in range(args.weeks):
-        now = datetime.datetime.utcnow()
         to_sunday = now.date() - datetime.timedelta(now.weekday() + 1 + 7 * week_nr)
         from_sunday = to_sunday - datetime.timedelta(7)
         time_intervals.append({
@@ -534,10 +589,10 @@ if args.weeks:
         })
     time_intervals.reverse()
 elif args.version_min:
-    releases = productdates.get_latest_nightly_versions_by_min_version(args.version_min)
+    releases = recorded_value('releases', lambda: productdates.get_latest_nightly_versions_by_min_version(args.version_min))
     for release_pos in range(len(releases)):
         if release_pos == len(releases) - 1:
-            end_date = datetime.date.today() + datetime.timedelta(days = 1)
+            end_date = recorded_value('today', datetime.date.today) + datetime.timedelta(days = 1)
         else:
             end_date = releases[release_pos + 1]['date']
         version = releases[release_pos]['version']
@@ -549,6 +604,12 @@ elif args.version_min:
 else:
     import sys
     sys.exit('No time intervals requested')
-data_by_time_intervals, teams_bugs = measure_data(time_intervals, needinfo_types_requested)
+checkpoint = Checkpoint('needinfo_autonag', {
+    'time_intervals': time_intervals,
+    'types': needinfo_types_requested,
+    'teams': run_teams,
+}, resume=args.resume)
+data_by_time_intervals, teams_bugs = measure_data(time_intervals, needinfo_types_requested, now)
 write_csv(data_by_time_intervals, teams_bugs, needinfo_types_requested)
+checkpoint.remove()
 
@@ -11,10 +11,12 @@
 import argparse
 import csv
 import datetime
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
 import productdates
 
+from utils.workeraccumulator import WorkerAccumulator
+from utils.bzdata import Bugzilla, add_bzdata_arguments, init_bzdata, recorded_value
+
 PRODUCTS_TO_CHECK = [
     'Core',
     'DevTools',
@@ -52,7 +54,7 @@ def get_bugs(version, start_date, end_date):
             if debug:
                 log('First affected version for bug ' + str(bug_data['id']) + ' is ' + str(version_first_affected) + ', not ' + str(version) + ' we are interested in.')
             return
-        bugs_data.append({
+        bugs_found.add(bug_data['id'], {
           'id': bug_data['id'],
           'severity': bug_data['severity'],
           'release_status': release_status,
@@ -102,11 +104,12 @@ def get_bugs(version, start_date, end_date):
         'f16': 'CP',
     }
 
-    bugs_data = []
+    bugs_found = WorkerAccumulator()
 
     Bugzilla(params,
              bughandler=bug_handler,
              timeout=960).get_data().wait()
+    bugs_data = bugs_found.get_items()
     severity_buckets = {
       'S1_affected_set': [bug_data['id'] for bug_data in bugs_data if bug_data['severity'] == 'S1'],
       'S2_affected_set': [bug_data['id'] for bug_data in bugs_data if bug_data['severity'] == 'S2'],
@@ -162,11 +165,12 @@ def get_bugs(version, start_date, end_date):
     params['v9'] = start_date
     params['v10'] = end_date
 
-    bugs_data = []
+    bugs_found = WorkerAccumulator()
 
     Bugzilla(params,
              bughandler=bug_handler,
              timeout=960).get_data().wait()
+    bugs_data = bugs_found.get_items()
     severity_buckets['S1_affected_unknown'] = [bug_data['id'] for bug_data in bugs_data if bug_data['severity'] == 'S1']
     severity_buckets['S2_affected_unknown'] = [bug_data['id'] for bug_data in bugs_data if bug_data['severity'] == 'S2']
 
@@ -179,7 +183,7 @@ def measure_data(releases):
     defect_data_by_version = []
     for release_pos in range(len(releases)):
         if release_pos == len(releases) - 1:
-            end_date = datetime.date.today() + datetime.timedelta(days = 1)
+            end_date = recorded_value('today', datetime.date.today) + datetime.timedelta(days = 1)
         else:
             end_date = releases[release_pos + 1]['date']
         version = int((releases[release_pos]['version'].split('.'))[0])
@@ -229,10 +233,12 @@ parser.add_argument('version_min', type=int,
 parser.add_argument('--debug',
                     action='store_true',
                     help='Show debug information')
+add_bzdata_arguments(parser)
 args = parser.parse_args()
+init_bzdata(args, 'data/open_defects_bugzilla_data.json')
 debug = args.debug
 
-releases = productdates.get_latest_released_versions_by_min_version(args.version_min)
+releases = recorded_value('releases', lambda: productdates.get_latest_released_versions_by_min_version(args.version_min))
 defect_data_by_version = measure_data(releases)
 write_csv(defect_data_by_version)
 
@@ -2,12 +2,15 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import argparse
 import csv
-from libmozdata.bugzilla import Bugzilla, BugzillaUser
+from libmozdata.bugzilla import BugzillaUser
 from logger import logger
 import urllib.request
 
 from utils.bugzilla import BUG_LIST_WEB_URL, get_component_to_team, get_needinfo_histories
+from utils.workeraccumulator import WorkerAccumulator
+from utils.bzdata import Bugzilla, add_bzdata_arguments, init_bzdata
 
 import http
 import logging
@@ -78,10 +81,7 @@ def filter_data_by_employee_status(needinfos_open_by_user, employees):
 
 def get_bugs():
 
-    def bug_handler(bug_data):
-        bugs_data.append(bug_data)
-
-    bugs_data = []
+    bugs_found = WorkerAccumulator()
 
     fields = [
               'id',
@@ -96,16 +96,19 @@ def get_bugs():
     }
 
     Bugzilla(params,
-             bughandler=bug_handler,
+             bughandler=bugs_found.add_bug,
              timeout=960).get_data().wait()
 
-    return bugs_data
+    return bugs_found.get_items()
 
 
 def get_needinfo_data(bugs_data):
 
     def bug_handler(bug_data):
+        # Runs on libmozdata's worker threads, only collect the open needinfos
+        # of the bug here.
         needinfo_histories = get_needinfo_histories(bug_data)
+        needinfoed_users = []
         for needinfoed_user in needinfo_histories:
             for needinfo in needinfo_histories[needinfoed_user]:
                 if needinfo['requester'] == needinfo['requestee']:
@@ -115,29 +118,15 @@ def get_needinfo_data(bugs_data):
                 if needinfo['end'] is not None:
                     continue
 
-                product = bug_data['product']
-                component = bug_data['component']
-                team = get_component_to_team(product, component)
-                if team in TEAMS_IGNORED:
-                    continue
-
-                if needinfoed_user not in needinfos_open_by_user:
-                    needinfos_open_by_user[needinfoed_user] = {
-                        'bug_ids': [],
-                        'needinfos': [],
-                    }
-                bug_id = bug_data['id']
-                if bug_id not in needinfos_open_by_user[needinfoed_user]['bug_ids']:
-                    needinfos_open_by_user[needinfoed_user]['bug_ids'].append(bug_id)
-                    needinfos_open_by_user[needinfoed_user]['needinfos'].append({
-                        'bug_id': bug_id,
-                        'user': needinfoed_user,
-                        'team': team,
-                        'product': product,
-                        'component': component,
-                    })
+                needinfoed_users.append(needinfoed_user)
+        bugs_needinfos.add(bug_data['id'], {
+            'bug_id': bug_data['id'],
+            'product': bug_data['product'],
+            'component': bug_data['component'],
+            'users': needinfoed_users,
+        })
 
-    needinfos_open_by_user = {}
+    bugs_needinfos = WorkerAccumulator()
 
     bucket_width = 500
     for bug_ids_start in range(0, len(bugs_data), bucket_width):
@@ -151,13 +140,38 @@ def get_needinfo_data(bugs_data):
 
         params = {
             'include_fields': fields,
-            'id': [bug['id'] for bug in bugs_data[bug_ids_start:min(bug_ids_start + bucket_width, len(bugs_data)) + 1]],
+            'id': [bug['id'] for bug in bugs_data[bug_ids_start:bug_ids_start + bucket_width]],
         }
 
         Bugzilla(params,
                  bughandler=bug_handler,
                  timeout=960).get_data().wait()
 
+    needinfos_open_by_user = {}
+    for bug_needinfos in bugs_needinfos.get_items():
+        bug_id = bug_needinfos['bug_id']
+        product = bug_needinfos['product']
+        component = bug_needinfos['component']
+        for needinfoed_user in bug_needinfos['users']:
+            team = get_component_to_team(product, component)
+            if team in TEAMS_IGNORED:
+                continue
+
+            if needinfoed_user not in needinfos_open_by_user:
+                needinfos_open_by_user[needinfoed_user] = {
+                    'bug_ids': [],
+                    'needinfos': [],
+                }
+            if bug_id not in needinfos_open_by_user[needinfoed_user]['bug_ids']:
+                needinfos_open_by_user[needinfoed_user]['bug_ids'].append(bug_id)
+                needinfos_open_by_user[needinfoed_user]['needinfos'].append({
+                    'bug_id': bug_id,
+                    'user': needinfoed_user,
+                    'team': team,
+                    'product': product,
+                    'component': component,
+                })
+
     return needinfos_open_by_user
 
 def get_employees(user_names):
@@ -271,6 +285,11 @@ def write_csv(needinfos_open_by_employee, needinfos_open_by_component, needinfos
                     BUG_LIST_WEB_URL + ",".join(sorted(list(set([str(bug_data['bug_id']) for bug_data in needinfos_open_by_team_and_employee[team][employee]])))),
                 ])
 
+parser = argparse.ArgumentParser(description='Count open needinfo requests for Platform employees')
+add_bzdata_arguments(parser)
+args = parser.parse_args()
+init_bzdata(args, 'data/platform_org_needinfo_requests_bugzilla_data.json')
+
 bugs_data = get_bugs()
 needinfos_open_by_user = get_needinfo_data(bugs_data)
 employees = get_employees(needinfos_open_by_user.keys())
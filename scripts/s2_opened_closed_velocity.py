@@ -9,12 +9,16 @@ import argparse
 import csv
 import datetime
 import json
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
 import productdates
-import pytz
 import urllib.request
 
+from utils.bugcache import CachedBugzilla, CachedBugzillaSearches
+from utils.bugzilla import BugTimeline, parse_bugzilla_date
+from utils.bzdata import add_bzdata_arguments, init_bzdata, recorded_value
+from utils.historystore import open_history_store
+from utils.versions import ReleaseTimeline
+
 import logging
 logging.basicConfig()
 logging.getLogger().setLevel(logging.DEBUG)
@@ -64,39 +68,8 @@ STATUS_VERSION_FIXED = [
   'verified'
 ]
 
-def get_relevant_bug_changes(bug_data, fields, start_date, end_date):
-    bug_states = {}
-    for field in fields:
-        bug_states[field] = {
-            "old": None,
-            "new": None,
-        }
-    for historyItem in bug_data['history']:
-        for change in historyItem['changes']:
-            field = change['field_name']
-            if field in fields:
-                change_time_str = historyItem['when']
-                change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                change_time = pytz.utc.localize(change_time).date()
-                if change_time < start_date:
-                    bug_states[field]["old"] = change['added']
-                elif start_date <= change_time < end_date:
-                    if bug_states[field]["old"] is None:
-                        bug_states[field]["old"] = change['removed']
-                    bug_states[field]["new"] = change['added']
-                if change_time > end_date:
-                    if bug_states[field]["old"] is None:
-                        bug_states[field]["old"] = change['removed']
-                    if bug_states[field]["new"] is None:
-                        bug_states[field]["new"] = change['removed']
-    for field in fields:
-        if bug_states[field]["old"] is None:
-            bug_states[field]["old"] = bug_data[field]
-        if bug_states[field]["new"] is None:
-            bug_states[field]["new"] = bug_data[field]
-    return bug_states
-
-def get_status_for_versions(bug_data, adjust_fixed_for_dot_release=False):
+def get_status_for_versions(bug_timeline, adjust_fixed_for_dot_release=False):
+    bug_data = bug_timeline.bug_data
     status_for_versions = {}
     for field, value in bug_data.items():
         if not field.startswith('cf_status_firefox'):
@@ -118,17 +91,14 @@ def get_status_for_versions(bug_data, adjust_fixed_for_dot_release=False):
     fixed_lowest_bumped_for_fix_after_release = False
     if adjust_fixed_for_dot_release and fixed_lowest_version:
         fixed_lowest_version_latest = None
-        for historyItem in bug_data['history']:
-            for change in historyItem['changes']:
-                change_time_str = historyItem['when']
-                change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                change_time = pytz.utc.localize(change_time).date()
-                if change['field_name'] == f'cf_status_firefox{fixed_lowest_version}' and change['added'] == 'fixed':
-                    fixed_lowest_version_latest = change_time
+        change_times, _, values_added = bug_timeline.get_field_changes(f'cf_status_firefox{fixed_lowest_version}')
+        for change_time, value_added in zip(change_times, values_added):
+            if value_added == 'fixed':
+                fixed_lowest_version_latest = change_time
         fixed_full_version = f'{fixed_lowest_version}.0'
         if fixed_lowest_version_latest and fixed_full_version in release_dates and fixed_lowest_version_latest >= release_dates[fixed_full_version]:
             fixed_lowest_bumped_for_fix_after_release = True
-            print(f'bumped bug {bug_data["id"]} as fixed from version {fixed_lowest_version} to {fixed_lowest_version + 1} at {change_time} on or after release on {release_dates[fixed_full_version]}')
+            print(f'bumped bug {bug_data["id"]} as fixed from version {fixed_lowest_version} to {fixed_lowest_version + 1} at {fixed_lowest_version_latest} on or after release on {release_dates[fixed_full_version]}')
             fixed_lowest_version += 1
 
     unfixed_versions = [version for version, status in status_for_versions.items() if status in STATUS_VERSION_STILL_AFFECTED]
@@ -145,27 +115,19 @@ def get_status_for_versions(bug_data, adjust_fixed_for_dot_release=False):
       "unaffected_highest_version": unaffected_highest_version,
     }
 
-def get_severity_start_and_resolved(bug_data):
+def get_severity_start_and_resolved(bug_timeline):
+    bug_data = bug_timeline.bug_data
     severity_start = None
-    last_resolved = None
-    for historyItem in bug_data['history']:
-        for change in historyItem['changes']:
-            change_time_str = historyItem['when']
-            change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-            change_time = pytz.utc.localize(change_time).date()
-            field = change['field_name']
-            if field == 'severity':
-                severity_old = change['removed']
-                severity_new = change['added']
-                if severity_start is None and severity_new in ['S1', 'S2']:
-                    severity_start = change_time
-                elif severity_new not in ['S1', 'S2']:
-                    severity_start = None
-            elif field == 'cf_last_resolved':
-                last_resolved = change_time
+    change_times, _, severities_new = bug_timeline.get_field_changes('severity')
+    for change_time, severity_new in zip(change_times, severities_new):
+        if severity_start is None and severity_new in ['S1', 'S2']:
+            severity_start = change_time
+        elif severity_new not in ['S1', 'S2']:
+            severity_start = None
+    resolved_times = bug_timeline.get_field_changes('cf_last_resolved')[0]
+    last_resolved = resolved_times[-1] if resolved_times else None
     if severity_start is None:
-        creation_time = datetime.datetime.strptime(bug_data['creation_time'], '%Y-%m-%dT%H:%M:%SZ')
-        creation_time = pytz.utc.localize(creation_time).date()
+        creation_time = parse_bugzilla_date(bug_data['creation_time'])
         severity_start = creation_time
     if bug_data['status'] in STATUS_OPEN:
         last_resolved = None
@@ -174,16 +136,16 @@ def get_severity_start_and_resolved(bug_data):
 def get_bugs(time_intervals):
 
     def bug_handler(bug_data):
-        creation_time = datetime.datetime.strptime(bug_data['creation_time'], '%Y-%m-%dT%H:%M:%SZ')
-        creation_time = pytz.utc.localize(creation_time).date()
-        for time_interval in time_intervals:
+        creation_time = parse_bugzilla_date(bug_data['creation_time'])
+        bug_timeline = BugTimeline(bug_data)
+        # Time intervals ending after the bug got created
+        time_intervals_created = [time_interval for time_interval in time_intervals if creation_time < time_interval['to']]
+        bug_states_by_time_interval = bug_timeline.get_relevant_bug_changes_for_time_intervals(["product", "severity", "status", "resolution"], time_intervals_created)
+        for time_interval, bug_states in zip(time_intervals_created, bug_states_by_time_interval):
             start_date = time_interval['from']
             end_date = time_interval['to']
             date_label = time_interval['label']
-            if creation_time >= end_date:
-                continue
-            # [severity_start, last_resolved] = get_severity_start_and_resolved(bug_data)
-            bug_states = get_relevant_bug_changes(bug_data, ["product", "severity", "status", "resolution"], start_date, end_date)
+            # [severity_start, last_resolved] = get_severity_start_and_resolved(bug_timeline)
             if bug_states["severity"]["new"] not in SEVERITIES:
                 continue
             if bug_states["product"]["new"] not in PRODUCTS_TO_CHECK:
@@ -193,14 +155,13 @@ def get_bugs(time_intervals):
                     bugs_by_date[date_label].append(bug_data['id'])
             if bug_states["status"]["old"] in STATUS_OPEN and bug_states["resolution"]["new"] == "FIXED":
                 if bug_data["resolution"] == "FIXED":
-                    resolved_time = datetime.datetime.strptime(bug_data['cf_last_resolved'], '%Y-%m-%dT%H:%M:%SZ')
-                    resolved_time = pytz.utc.localize(resolved_time).date()
+                    resolved_time = parse_bugzilla_date(bug_data['cf_last_resolved'])
                     if str(resolved_time) > '2022-06-30':
                         continue
                     bug_id = bug_data["id"]
                     if bug_id not in fixed_bugs_data:
                         fixed_bugs_data[bug_id] = {
-                            "status_for_versions": get_status_for_versions(bug_data, adjust_fixed_for_dot_release=True),
+                            "status_for_versions": get_status_for_versions(bug_timeline, adjust_fixed_for_dot_release=True),
                             "regressed_by": bug_data["regressed_by"],
                             "creation_time": bug_data["creation_time"]
                         }
@@ -214,7 +175,7 @@ def get_bugs(time_intervals):
         bug_id = bug_data["id"]
         if bug_data["resolution"] == "FIXED":
             regressed_by_bugs_data[bug_id] = {
-                "status_for_versions": get_status_for_versions(bug_data, adjust_fixed_for_dot_release=False),
+                "status_for_versions": get_status_for_versions(BugTimeline(bug_data), adjust_fixed_for_dot_release=False),
             }
         else:
             regressed_by_bugs_data[bug_id] = {}
@@ -242,6 +203,8 @@ def get_bugs(time_intervals):
               'history',
              ]
 
+    bugzilla_searches = CachedBugzillaSearches(timeout=960)
+
     params = {
         'include_fields': fields,
         'bug_severity': SEVERITIES,
@@ -253,9 +216,7 @@ def get_bugs(time_intervals):
         'v2': STATUS_OPEN,
     }
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
 
     params = {
         'include_fields': fields,
@@ -269,9 +230,7 @@ def get_bugs(time_intervals):
 
     params['v2'] = start_date
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
 
     params = {
         'include_fields': fields,
@@ -290,9 +249,9 @@ def get_bugs(time_intervals):
 
     params['v4'] = start_date
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
+
+    bugzilla_searches.wait()
 
     open_bug_count_by_day = []
     bugs_by_date_list = sorted([{key: value} for key, value in bugs_by_date.items()], key = lambda item: list(item.keys())[0])
@@ -332,9 +291,9 @@ def get_bugs(time_intervals):
         bug_ids = regressing_bugs[range_start:min(range_start + 500, len(regressing_bugs))]
         params['id'] = ",".join([str(bug_id) for bug_id in bug_ids])
 
-        Bugzilla(params,
-                 bughandler=regressed_by_handler,
-                 timeout=960).get_data().wait()
+        CachedBugzilla(params,
+                       bughandler=regressed_by_handler,
+                       timeout=960).get_data().wait()
 
     for (bug_id, regressed_by) in list(set([(bug_id, fixed_bugs_data[bug_id]["regressed_by"][0]) for bug_id in fixed_bugs_data if len(fixed_bugs_data[bug_id]["regressed_by"]) > 0])):
         if regressed_by_bugs_data[regressed_by]:
@@ -353,20 +312,11 @@ def get_bugs(time_intervals):
     # the last unaffected.
     # Use the date the bug got reported and assume the Nightly/mozilla-central
     # version for that day is the first affected one.
-    nightly_start_data = productdates.get_latest_nightly_versions_by_min_version(1)
     for bug_id in fixed_bugs_data:
         if fixed_bugs_data[bug_id]["status_for_versions"]["unaffected_highest_version"] is None:
             creation_time_str = fixed_bugs_data[bug_id]["creation_time"]
-            creation_time = datetime.datetime.strptime(creation_time_str, '%Y-%m-%dT%H:%M:%SZ')
-            creation_time = pytz.utc.localize(creation_time).date()
-            first_affected_version = None
-            version_start_bug_creation_diff_min = None
-            for nightly_start in nightly_start_data:
-                version_start_bug_creation_diff = (creation_time - nightly_start["date"]).days
-                if version_start_bug_creation_diff >= 0:
-                    if first_affected_version is None or version_start_bug_creation_diff < version_start_bug_creation_diff_min:
-                        first_affected_version = nightly_start["version"]
-                        version_start_bug_creation_diff_min = version_start_bug_creation_diff
+            creation_time = parse_bugzilla_date(creation_time_str)
+            first_affected_version = release_timeline.get_nightly_version(creation_time)
             if first_affected_version and first_affected_version < fixed_bugs_data[bug_id]["status_for_versions"]["fixed_lowest_version"]:
                 if first_affected_version > fixed_bugs_data[bug_id]["status_for_versions"]["unfixed_lowest_version"]:
                     first_affected_version = fixed_bugs_data[bug_id]["status_for_versions"]["unfixed_lowest_version"]
@@ -430,13 +380,21 @@ parser.add_argument('--start-date', type=str,
 parser.add_argument('--debug',
                     action='store_true',
                     help='Show debug information')
+parser.add_argument('--history-store',
+                    action='store_true',
+                    help='Read the histories of bugs which didn\'t change from the store written by history_store.py')
+add_bzdata_arguments(parser)
 args = parser.parse_args()
+init_bzdata(args, 'data/s2_opened_closed_velocity_bugzilla_data.json')
+if args.history_store:
+    open_history_store()
 debug = args.debug
 
-release_start_data = productdates.get_latest_released_versions_by_min_version(1)
+release_start_data = recorded_value('releases', lambda: productdates.get_latest_released_versions_by_min_version(1))
 release_dates = {}
 for version_data in release_start_data:
     release_dates[version_data['version']] = version_data['date']
+release_timeline = ReleaseTimeline(release_start_data)
 
 # Close to date when 'S<number>' severities replaced 'major', 'minor' etc.
 start_date = args.start_date if args.start_date else '2022-01-02'
@@ -446,7 +404,7 @@ start_day = datetime.datetime.strptime(start_date, '%Y-%m-%d')
 time_intervals = []
 # First Sunday of the year
 from_day = start_day - datetime.timedelta(7)
-day_max = min(datetime.datetime(2023, 1, 1), datetime.datetime.now())
+day_max = min(datetime.datetime(2023, 1, 1), recorded_value('now', datetime.datetime.now))
 while from_day < day_max:
     to_day = from_day + datetime.timedelta(7)
     time_intervals.append({
@@ -28,11 +28,14 @@ import csv
 import datetime
 from dateutil.relativedelta import relativedelta
 import json
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
 import pytz
 import utils
 
+from utils.bugzilla import parse_bugzilla_time
+from utils.bugcache import CachedBugzilla
+from utils.bzdata import add_bzdata_arguments, init_bzdata, recorded_value
+
 PRODUCTS_TO_CHECK = [
     'Core',
     'DevTools',
@@ -72,25 +75,6 @@ STATUS_GLOBAL_RESOLUTIONS = [
 
 WFMT = '{}-{:02d}'
 
-# Bugzilla data can be loaded from file
-bugzilla_data_loaded = None
-
-# Bugzilla data can be saved froto file
-bugzilla_data_to_save = {}
-
-
-def add_bugzilla_data_to_save(node_path, data):
-    # node_path is an array of strings representing the nodes in the JSON to
-    # which the data shall be saved. The node has a child 'data' which holds the
-    # data.
-    node = bugzilla_data_to_save
-    for path_step in node_path:
-        if not path_step in node:
-            node[path_step] = {'data': []}
-        node = node[path_step]
-    node['data'].append(data)
-
-
 def get_weeks(start_date, end_date):
     res = []
     weeks_attrs = {}
@@ -110,12 +94,8 @@ def get_weeks(start_date, end_date):
 def get_bugs():
 
     def bug_handler(bug_data, other_data):
-        if bzdata_save_path:
-            add_bugzilla_data_to_save(['sec-critical-high'], bug_data)
-
         bug_creation_time_str = bug_data['creation_time']
-        bug_creation_time = datetime.datetime.strptime(bug_creation_time_str, '%Y-%m-%dT%H:%M:%SZ')
-        bug_creation_time = pytz.utc.localize(bug_creation_time)
+        bug_creation_time = parse_bugzilla_time(bug_creation_time_str)
 
         sec_important_start = None
         sec_important_end = None
@@ -128,8 +108,7 @@ def get_bugs():
             for change in historyItem['changes']:
                 if change['field_name'] == 'keywords':
                     change_time_str = historyItem['when']
-                    change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                    change_time = pytz.utc.localize(change_time)
+                    change_time = parse_bugzilla_time(change_time_str)
 
                     keywords_removed = change['removed'].split(', ')
                     keywords_added = change['added'].split(', ')
@@ -214,8 +193,7 @@ def get_bugs():
                 # Bug closed, last time it got resolved used as ended of
                 # affected time range.
                 last_resolved_str = bug_data['cf_last_resolved']
-                last_resolved = datetime.datetime.strptime(last_resolved_str, '%Y-%m-%dT%H:%M:%SZ')
-                last_resolved = pytz.utc.localize(last_resolved)
+                last_resolved = parse_bugzilla_time(last_resolved_str)
                 sec_open_end = min(sec_important_times[-1]['end'], last_resolved)
         else:
             sec_open_end = sec_important_times[0]['start']
@@ -231,78 +209,70 @@ def get_bugs():
                             }
         bug_sec_open_ranges.append(bug_data_to_export)
 
-    # Load Bugzilla data from file
-    if bzdata_load_path:
-        for bug_data in bugzilla_data_loaded['sec-critical-high']['data']:
-            other_data = {}
-            bug_handler(bug_data, other_data)
-    # Load Bugzilla data from Bugzilla server
-    else:
-        queries = []
-        fields = [
-                  'id',
-                  'creation_time',
-                  'status',
-                  'is_open',
-                  'resolution',
-                  'cf_last_resolved',
-                  'keywords',
-                  'history',
-                 ]
-
-        params = {
-            'include_fields': fields,
-            'product': PRODUCTS_TO_CHECK,
-            'j_top' : 'OR',
-            # Either the keywords 'sec-critical' or 'sec-high' got removed
-            # after the given date.
-            'f1' : 'OP',
-            'j1' : 'AND_G',
-            'f2' : 'keywords',
-            'o2' : 'changedfrom',
-            'v2' : 'sec-critical',
-            'f3' : 'keywords',
-            'o3' : 'changedafter',
-            'v3' : '',
-            'f4' : 'CP',
-            'f5' : 'OP',
-            'j5' : 'AND_G',
-            'f6' : 'keywords',
-            'o6' : 'changedfrom',
-            'v6' : 'sec-high',
-            'f7' : 'keywords',
-            'o7' : 'changedafter',
-            'v7' : '',
-            'f8' : 'CP',
-            # Or the bug still has either the keyword 'sec-critical' or
-            # 'sec-high' and
-            'f9' : 'OP',
-            'f10' : 'keywords',
-            'o10' : 'anywords',
-            'v10' : 'sec-critical, sec-high',
-            'f11' : 'OP',
-            'j11' : 'OR',
-            # ... got resolved after the given date ...
-            'f12' : 'cf_last_resolved',
-            'o12' : 'changedafter',
-            'v12' : '',
-            # or hasn't been resolved yet.
-            'f13' : 'bug_status',
-            'o13' : 'anywords',
-            'v13' : 'UNCONFIRMED, NEW, ASSIGNED, REOPENED',
-            'f14' : 'CP',
-            'f15' : 'CP',
-        }
-
-        params['v3'] = date_start_str
-        params['v7'] = date_start_str
-        params['v12'] = date_start_str
-
-        query = Bugzilla(params,
-                         bughandler=bug_handler,
-                         bugdata={},
-                         timeout=960)
-        query.get_data().wait()
+    fields = [
+              'id',
+              'creation_time',
+              'status',
+              'is_open',
+              'resolution',
+              'cf_last_resolved',
+              'keywords',
+              'history',
+             ]
+
+    params = {
+        'include_fields': fields,
+        'product': PRODUCTS_TO_CHECK,
+        'j_top' : 'OR',
+        # Either the keywords 'sec-critical' or 'sec-high' got removed
+        # after the given date.
+        'f1' : 'OP',
+        'j1' : 'AND_G',
+        'f2' : 'keywords',
+        'o2' : 'changedfrom',
+        'v2' : 'sec-critical',
+        'f3' : 'keywords',
+        'o3' : 'changedafter',
+        'v3' : '',
+        'f4' : 'CP',
+        'f5' : 'OP',
+        'j5' : 'AND_G',
+        'f6' : 'keywords',
+        'o6' : 'changedfrom',
+        'v6' : 'sec-high',
+        'f7' : 'keywords',
+        'o7' : 'changedafter',
+        'v7' : '',
+        'f8' : 'CP',
+        # Or the bug still has either the keyword 'sec-critical' or
+        # 'sec-high' and
+        'f9' : 'OP',
+        'f10' : 'keywords',
+        'o10' : 'anywords',
+        'v10' : 'sec-critical, sec-high',
+        'f11' : 'OP',
+        'j11' : 'OR',
+        # ... got resolved after the given date ...
+        'f12' : 'cf_last_resolved',
+        'o12' : 'changedafter',
+        'v12' : '',
+        # or hasn't been resolved yet.
+        'f13' : 'bug_status',
+        'o13' : 'anywords',
+        'v13' : 'UNCONFIRMED, NEW, ASSIGNED, REOPENED',
+        'f14' : 'CP',
+        'f15' : 'CP',
+    }
+
+    params['v3'] = date_start_str
+    params['v7'] = date_start_str
+    params['v12'] = date_start_str
+
+    query = CachedBugzilla(params,
+                           bughandler=bug_handler,
+                           bugdata={},
+                           timeout=960)
+    query.get_data().wait()
 
 
 def log(message):
@@ -437,61 +407,20 @@ def write_csv():
 
 
 parser = argparse.ArgumentParser(description='Count security bugs opened and closed by week')
-parser.add_argument('--bzdata-load',
-                    nargs='?',
-                    default=argparse.SUPPRESS,
-                    help='Load the Bugzilla data from a local JSON file. If no path is provided '
-                         'the program will try to load "sec_bugs_bugzilla_data.json" from the "data" folder.')
-parser.add_argument('--bzdata-save',
-                    nargs='?',
-                    default=argparse.SUPPRESS,
-                    help='Save the Bugzilla data to a local JSON file. If no path is provided '
-                         'the program will try to save as "sec_bugs_bugzilla_data.json" into the "data" folder.')
+add_bzdata_arguments(parser)
 args = parser.parse_args()
+init_bzdata(args, 'data/sec_bugs_bugzilla_data.json')
 
 # Start of time range used by report. Hardcoded default of 1 year.
-date_start = datetime.datetime.now() - datetime.timedelta(days = 365)
-date_start = pytz.utc.localize(date_start)
+date_start = recorded_value('date_start', lambda: pytz.utc.localize(datetime.datetime.now() - datetime.timedelta(days = 365)))
 date_start_str = date_start.strftime('%Y-%m-%dT%H:%M:%SZ')
 
 # End of time range used by report.
-date_end = datetime.datetime.utcnow()
-date_end = pytz.utc.localize(date_end)
+date_end = recorded_value('date_end', lambda: pytz.utc.localize(datetime.datetime.utcnow()))
 date_end_str = date_end.strftime('%Y-%m-%dT%H:%M:%SZ')
 
 weeks, weeks_attrs = get_weeks(date_start, date_end)
 
-bzdata_load_path = None
-if 'bzdata_load' in args:
-    # Load Bugzilla data from file
-    if args.bzdata_load:
-        # File path provided as command line argument
-        bzdata_load_path = args.bzdata_load
-    else:
-        # No file path provided, use default location
-        bzdata_load_path = 'data/sec_bugs_bugzilla_data.json'
-    with open(bzdata_load_path, 'r') as bugzilla_data_reader:
-        bugzilla_data_loaded = json.load(bugzilla_data_reader)
-    log('Loaded Bugzilla data from {}'.format(bzdata_load_path))
-    date_start_str = bugzilla_data_loaded['date_start']['data'][0]
-    date_start = datetime.datetime.strptime(date_start_str, '%Y-%m-%dT%H:%M:%SZ')
-    date_start = pytz.utc.localize(date_start)
-    log('Date start from loaded Bugzilla data: {}'.format(date_start_str))
-    date_end_str = bugzilla_data_loaded['date_end']['data'][0]
-    date_end = datetime.datetime.strptime(date_end_str, '%Y-%m-%dT%H:%M:%SZ')
-    date_end = pytz.utc.localize(date_end)
-    log('Date end from loaded Bugzilla data: {}'.format(date_end_str))
-
-bzdata_save_path = None
-if 'bzdata_save' in args:
-    # File path to which Bugzilla data shall be saved
-    if args.bzdata_save:
-        # File path provided as command line argument
-        bzdata_save_path = args.bzdata_save
-    else:
-        # No file path provided, use default location
-        bzdata_save_path = 'data/sec_bugs_bugzilla_data.json'
-
 # Holds the time range in which a bug was considered open (see top of file) and
 # had security rating.
 bug_sec_open_ranges = []
@@ -514,12 +443,3 @@ resolutions_by_week['unknown'] = { week : 0 for week in weeks }
 aggregate_to_weekly_reports()
 
 write_csv()
-
-if bzdata_save_path:
-    # Save Bugzilla data to file
-    with open('data/sec_bugs_bugzilla_data.json', 'w') as bugzilla_data_writer:
-        add_bugzilla_data_to_save(['date_start'], date_start_str)
-        add_bugzilla_data_to_save(['date_end'], date_end_str)
-        bugzilla_data_writer.write(json.dumps(bugzilla_data_to_save))
-        log('Saved Bugzilla data to {}'.format(bzdata_save_path))
-
@@ -9,13 +9,15 @@ import argparse
 import csv
 import datetime
 import json
-from libmozdata.bugzilla import Bugzilla
 from logger import logger
 import productdates
-import pytz
 import re
 import urllib.request
 
+from utils.bugcache import CachedBugzillaSearches
+from utils.bugzilla import BugTimeline, parse_bugzilla_date
+from utils.bzdata import add_bzdata_arguments, init_bzdata, recorded_value
+
 import logging
 logging.basicConfig()
 logging.getLogger().setLevel(logging.DEBUG)
@@ -36,51 +38,19 @@ PRODUCTS_TO_CHECK = [
 
 STATUS_OPEN = ['UNCONFIRMED', 'NEW', 'ASSIGNED', 'REOPENED']
 
-def get_relevant_bug_changes(bug_data, fields, start_date, end_date):
-    bug_states = {}
-    for field in fields:
-        bug_states[field] = {
-            "old": None,
-            "new": None,
-        }
-    for historyItem in bug_data['history']:
-        for change in historyItem['changes']:
-            field = change['field_name']
-            if field in fields:
-                change_time_str = historyItem['when']
-                change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                change_time = pytz.utc.localize(change_time).date()
-                if change_time < start_date:
-                    bug_states[field]["old"] = change['added']
-                elif start_date <= change_time < end_date:
-                    if bug_states[field]["old"] is None:
-                        bug_states[field]["old"] = change['removed']
-                    bug_states[field]["new"] = change['added']
-                if change_time > end_date:
-                    if bug_states[field]["old"] is None:
-                        bug_states[field]["old"] = change['removed']
-                    if bug_states[field]["new"] is None:
-                        bug_states[field]["new"] = change['removed']
-    for field in fields:
-        if bug_states[field]["old"] is None:
-            bug_states[field]["old"] = bug_data[field]
-        if bug_states[field]["new"] is None:
-            bug_states[field]["new"] = bug_data[field]
-    return bug_states
-
 def get_bugs(time_intervals):
 
     def bug_handler(bug_data):
-        creation_time = datetime.datetime.strptime(bug_data['creation_time'], '%Y-%m-%dT%H:%M:%SZ')
-        creation_time = pytz.utc.localize(creation_time).date()
-        for time_interval in time_intervals:
+        creation_time = parse_bugzilla_date(bug_data['creation_time'])
+        bug_timeline = BugTimeline(bug_data)
+        # Time intervals ending after the bug got created
+        time_intervals_created = [time_interval for time_interval in time_intervals if creation_time < time_interval['to']]
+        bug_states_by_time_interval = bug_timeline.get_relevant_bug_changes_for_time_intervals(["product", "severity", "status", "whiteboard"], time_intervals_created)
+        for time_interval, bug_states in zip(time_intervals_created, bug_states_by_time_interval):
             date_label = time_interval['label']
             start_date = time_interval['from']
             end_date = time_interval['to']
-            if creation_time >= end_date:
-                continue
             # [severity_start, last_resolved] = get_severity_start_and_resolved(bug_data)
-            bug_states = get_relevant_bug_changes(bug_data, ["product", "severity", "status", "whiteboard"], start_date, end_date)
             if bug_states["product"]["new"] not in PRODUCTS_TO_CHECK:
                 continue
             if bug_states["status"]["new"] not in STATUS_OPEN:
@@ -111,6 +81,8 @@ def get_bugs(time_intervals):
               'history',
              ]
 
+    bugzilla_searches = CachedBugzillaSearches(timeout=960)
+
     params = {
         'include_fields': fields,
         # 'bug_status': STATUS_OPEN,
@@ -119,9 +91,7 @@ def get_bugs(time_intervals):
         'status_whiteboard_type':  'allwordssubstr'
     }
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
 
     params = {
         'include_fields': fields,
@@ -134,9 +104,7 @@ def get_bugs(time_intervals):
 
     params['v2'] = start_date
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
 
     params = {
         'include_fields': fields,
@@ -147,9 +115,9 @@ def get_bugs(time_intervals):
 
     params['v1'] = start_date
 
-    Bugzilla(params,
-             bughandler=bug_handler,
-             timeout=960).get_data().wait()
+    bugzilla_searches.add(params, bughandler=bug_handler)
+
+    bugzilla_searches.wait()
 
     open_bug_count_by_day = []
     bugs_by_date_list = sorted([{key: value} for key, value in bugs_by_date.items()], key = lambda item: list(item.keys())[0])
@@ -186,7 +154,9 @@ parser.add_argument('--start-date', type=str,
 parser.add_argument('--debug',
                     action='store_true',
                     help='Show debug information')
+add_bzdata_arguments(parser)
 args = parser.parse_args()
+init_bzdata(args, 'data/severity_access_bugzilla_data.json')
 debug = args.debug
 
 # Close to date when 'S<number>' severities replaced 'major', 'minor' etc.
@@ -197,7 +167,7 @@ start_day = datetime.datetime.strptime(start_date, '%Y-%m-%d')
 time_intervals = []
 # First Sunday of the year
 from_day = start_day - datetime.timedelta(7)
-day_max = min(datetime.datetime(2022, 7, 1), datetime.datetime.now())
+day_max = min(datetime.datetime(2022, 7, 1), recorded_value('now', datetime.datetime.now))
 while from_day < day_max:
     to_day = from_day + datetime.timedelta(7)
     time_intervals.append({
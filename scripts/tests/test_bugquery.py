@@ -0,0 +1,40 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Run from the 'scripts' folder: python -m unittest discover tests
+
+import unittest
+
+from utils.bugquery import matches_query, may_match_query, parse_query
+
+
+class ParseQueryTest(unittest.TestCase):
+
+    def test_bug_type_filters_types(self):
+        query = parse_query({'bug_type': 'defect', 'product': ['Core']})
+        self.assertTrue(matches_query(query, {'type': 'defect', 'product': 'Core'}))
+        self.assertFalse(matches_query(query, {'type': 'enhancement', 'product': 'Core'}))
+        self.assertFalse(matches_query(query, {'type': 'task', 'product': 'Core'}))
+
+    def test_operator_param_is_not_a_field(self):
+        query = parse_query({'keywords': 'regression', 'keywords_type': 'nowords'})
+        self.assertEqual(len(query['children']), 1)
+        self.assertTrue(matches_query(query, {'keywords': ['perf']}))
+        self.assertFalse(matches_query(query, {'keywords': ['regression']}))
+
+    def test_missing_fields_may_match(self):
+        # Exclusion of intermittent failures like bug_release.py searches
+        query = parse_query({'product': 'Core',
+                             'f1': 'OP', 'n1': '1',
+                             'f2': 'keywords', 'o2': 'allwords', 'v2': 'intermittent-failure',
+                             'f3': 'priority', 'o3': 'equals', 'v3': 'P5',
+                             'f4': 'CP'})
+        self.assertTrue(may_match_query(query, {'product': 'Core'}))
+        self.assertFalse(may_match_query(query, {'product': 'Toolkit'}))
+        self.assertTrue(may_match_query(query, {'product': 'Core', 'priority': 'P1'}))
+        self.assertFalse(may_match_query(query, {'product': 'Core', 'priority': 'P5', 'keywords': ['intermittent-failure']}))
+
+
+if __name__ == '__main__':
+    unittest.main()
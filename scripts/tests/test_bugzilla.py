@@ -0,0 +1,129 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Run from the 'scripts' folder: python -m unittest discover tests
+
+import datetime
+import unittest
+
+from utils.bugzilla import BugTimeline, get_flag_events, pair_needinfo_requests, parse_bugzilla_time, parse_flags
+
+
+def get_flag_change(when, who, removed, added):
+    return {
+        'when': when,
+        'who': who,
+        'changes': [{'field_name': 'flagtypes.name', 'removed': removed, 'added': added}],
+    }
+
+
+class NeedinfoTest(unittest.TestCase):
+
+    def test_parse_flags(self):
+        self.assertEqual(parse_flags('review+, needinfo?(a@x), needinfo?(b@x)'),
+                         (('review', '+', None), ('needinfo', '?', 'a@x'), ('needinfo', '?', 'b@x')))
+        self.assertEqual(parse_flags(''), ())
+
+    def test_all_requestees_of_a_change(self):
+        bug_data = {'history': [
+            get_flag_change('2022-01-01T10:00:00Z', 'r@x', '', 'review+, needinfo?(a@x), needinfo?(b@x)'),
+            get_flag_change('2022-01-02T10:00:00Z', 'a@x', 'needinfo?(a@x)', ''),
+        ]}
+        histories = pair_needinfo_requests(get_flag_events(bug_data, 'needinfo'))
+        self.assertEqual(histories, {
+            'a@x': [{'start': parse_bugzilla_time('2022-01-01T10:00:00Z'),
+                     'end': parse_bugzilla_time('2022-01-02T10:00:00Z'),
+                     'requester': 'r@x',
+                     'requestee': 'a@x'}],
+            'b@x': [{'start': parse_bugzilla_time('2022-01-01T10:00:00Z'),
+                     'end': None,
+                     'requester': 'r@x',
+                     'requestee': 'b@x'}],
+        })
+
+    def test_request_again_in_one_change(self):
+        bug_data = {'history': [
+            get_flag_change('2022-01-01T10:00:00Z', 'r@x', '', 'needinfo?(a@x)'),
+            # Cleared and requested again at once, e.g. by another user.
+            get_flag_change('2022-01-03T10:00:00Z', 'c@x', 'needinfo?(a@x)', 'review?(d@x), needinfo?(a@x)'),
+        ]}
+        flag_events = get_flag_events(bug_data, 'needinfo')
+        self.assertEqual([flag_event['action'] for flag_event in flag_events], ['set', 'clear', 'set'])
+        histories = pair_needinfo_requests(flag_events)
+        self.assertEqual([(needinfo['start'].day, needinfo['end'].day if needinfo['end'] else None, needinfo['requester'])
+                          for needinfo in histories['a@x']],
+                         [(1, 3, 'r@x'), (3, None, 'c@x')])
+
+    def test_accept_request(self):
+        bug_data = {'history': [
+            get_flag_change('2022-01-01T10:00:00Z', 'bot@x', '', 'needinfo?(a@x), needinfo?(b@x)'),
+            get_flag_change('2022-01-02T10:00:00Z', 'r@x', '', 'needinfo?(b@x)'),
+            get_flag_change('2022-01-04T10:00:00Z', 'a@x', 'needinfo?(a@x)', ''),
+        ]}
+        histories = pair_needinfo_requests(get_flag_events(bug_data, 'needinfo'),
+                                           accept_request=lambda flag_event: flag_event['who'] != 'bot@x')
+        self.assertNotIn('a@x', histories)
+        self.assertEqual([(needinfo['start'].day, needinfo['end'], needinfo['requester']) for needinfo in histories['b@x']],
+                         [(2, None, 'r@x')])
+
+
+def get_change(when, field, removed, added):
+    return {
+        'when': when,
+        'who': 'a@x',
+        'changes': [{'field_name': field, 'removed': removed, 'added': added}],
+    }
+
+
+TIME_INTERVALS = [
+    {'from': datetime.date(2022, 1, 1), 'to': datetime.date(2022, 1, 8)},
+    {'from': datetime.date(2022, 1, 8), 'to': datetime.date(2022, 1, 15)},
+    {'from': datetime.date(2022, 1, 15), 'to': datetime.date(2022, 1, 22)},
+]
+
+
+class BugTimelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bug_data = {
+            'id': 1,
+            'severity': 'S2',
+            'keywords': ['crash', 'regression'],
+            'priority': 'P1',
+            'history': [
+                get_change('2022-01-03T10:00:00Z', 'severity', '--', 'S3'),
+                get_change('2022-01-03T10:00:00Z', 'keywords', '', 'crash'),
+                # On the end date of the first interval, belongs to the second one
+                get_change('2022-01-08T00:00:00Z', 'severity', 'S3', 'S2'),
+                get_change('2022-01-08T00:00:00Z', 'keywords', 'crash', 'regression'),
+                get_change('2022-01-16T10:00:00Z', 'keywords', '', 'crash'),
+            ],
+        }
+
+    def get_states(self, field):
+        bug_states_by_time_interval = BugTimeline(self.bug_data).get_relevant_bug_changes_for_time_intervals([field], TIME_INTERVALS)
+        return [(bug_states[field]['old'], bug_states[field]['new']) for bug_states in bug_states_by_time_interval]
+
+    def test_str_field(self):
+        self.assertEqual(self.get_states('severity'), [('--', 'S3'), ('S3', 'S2'), ('S2', 'S2')])
+
+    def test_list_field(self):
+        self.assertEqual(self.get_states('keywords'), [
+            (set(), {'crash'}),
+            ({'crash'}, {'regression'}),
+            ({'regression'}, {'crash', 'regression'}),
+        ])
+
+    def test_unchanged_field(self):
+        self.assertEqual(self.get_states('priority'), [('P1', 'P1')] * 3)
+
+    def test_single_time_interval(self):
+        bug_timeline = BugTimeline(self.bug_data)
+        for time_interval, bug_states in zip(TIME_INTERVALS, bug_timeline.get_relevant_bug_changes_for_time_intervals(['severity', 'keywords'], TIME_INTERVALS)):
+            self.assertEqual(bug_timeline.get_relevant_bug_changes(['severity', 'keywords'], time_interval['from'], time_interval['to']),
+                             bug_states)
+
+
+if __name__ == '__main__':
+    unittest.main()
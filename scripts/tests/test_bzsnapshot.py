@@ -0,0 +1,89 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Run from the 'scripts' folder: python -m unittest discover tests
+
+import datetime
+import os
+import tempfile
+import unittest
+
+from utils.bzsnapshot import get_snapshot_bug, get_snapshot_search_ids, open_snapshot, write_snapshot
+
+BUGS = {
+    '1': {
+        'id': 1,
+        'summary': 'Crash in nsFoo::Bar() – ünïcode',
+        'creation_time': '2022-01-03T10:00:00Z',
+        'last_change_time': '2022-02-01T08:30:15Z',
+        'cf_last_resolved': None,
+        'is_open': True,
+        'votes': 0,
+        'keywords': [],
+        'cc': ['a@x', 'b@x'],
+        'blocks': [5, 7],
+        'history': [
+            {'when': '2022-01-03T10:00:00Z', 'who': 'a@x', 'changes': [
+                {'field_name': 'status', 'removed': 'NEW', 'added': 'ASSIGNED'},
+                {'field_name': 'cf_last_resolved', 'removed': '', 'added': '2022-01-03T10:00:00Z'},
+            ]},
+            {'when': '2022-02-01T08:30:15Z', 'who': 'b@x', 'changes': []},
+        ],
+    },
+    '2': {
+        'id': 2,
+        # Not valid timestamps, kept as strings
+        'whiteboard': '2022-02-31T00:00:00Z',
+        'mixed': ['2022-01-03T10:00:00Z', 'text', 3, -4, 2 ** 40, 1.5, None, False, {'a': 1}, {'b': [[], [1]]}],
+        'nested': [[], ['x'], [{'a': 1}, {'a': 2}]],
+        'rows': [{'a': 'x', 'b': 1}, {'b': 2, 'a': 'y'}],
+        'empty_rows': [{}, {}],
+    },
+}
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test.bzsnapshot')
+        values = {'now': datetime.datetime(2022, 3, 1, 12, 0)}
+        searches = {'{"product": "Core"}': [1, 2], '{"product": "Firefox"}': []}
+        write_snapshot(self.path, values, searches, BUGS.items())
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check_snapshot(self):
+        snapshot = open_snapshot(self.path)
+        try:
+            self.assertEqual(snapshot['values'], {'now': datetime.datetime(2022, 3, 1, 12, 0)})
+            self.assertEqual(get_snapshot_search_ids(snapshot, '{"product": "Core"}'), [1, 2])
+            self.assertEqual(get_snapshot_search_ids(snapshot, '{"product": "Firefox"}'), [])
+            self.assertIsNone(get_snapshot_search_ids(snapshot, '{}'))
+            for bug_id, bug_data in BUGS.items():
+                snapshot_bug_data = get_snapshot_bug(snapshot, bug_id)
+                self.assertEqual(snapshot_bug_data, bug_data)
+                # Same order of the keys
+                self.assertEqual(repr(snapshot_bug_data), repr(bug_data))
+        finally:
+            snapshot['reader'].close()
+
+    def test_round_trip(self):
+        self.check_snapshot()
+
+    def test_without_index(self):
+        os.remove(self.path + '.index')
+        self.check_snapshot()
+
+    def test_other_version(self):
+        with open(self.path, 'rb') as snapshot_reader:
+            data = snapshot_reader.read()
+        with open(self.path, 'wb') as snapshot_writer:
+            snapshot_writer.write(data.replace(b'"version": 3', b'"version": 2', 1))
+        self.assertIsNone(open_snapshot(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
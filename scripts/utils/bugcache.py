@@ -0,0 +1,428 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Local on-disk cache of Bugzilla bug records (including their history).
+#
+# A search first only asks Bugzilla for the 'id' and 'last_change_time' of the
+# matching bugs. Bugs which are unknown to the cache, have changed since they
+# got stored or lack some of the requested fields are downloaded in batches;
+# everything else is served from the SQLite database in the 'data' folder.
+# Searches run together with CachedBugzillaSearches download each bug only
+# once.
+#
+# Bugs whose history is in the history store opened by the report (see
+# utils/historystore.py) and didn't change since then are downloaded and loaded
+# without their history, BugTimeline reads the changes from the store. Reports
+# recording or replaying Bugzilla data always get the whole history.
+#
+# Replays of recorded Bugzilla data ('--bzdata-load') use an empty cache in
+# memory instead, all bugs come from the recording.
+#
+# With '--search-cache', the searches get evaluated against the cached bugs by
+# utils/bugquery.py without contacting Bugzilla. With '--verify-searches', the
+# bugs Bugzilla found get checked against the search params.
+
+import json
+import logging
+import sqlite3
+import threading
+
+from .bugquery import QueryDataError, QueryError, matches_query, parse_query
+from .bzdata import BZDATA, BZDATA_MODE_REPLAY, Bugzilla, record_bug, recorded_search
+from .historystore import get_history_store
+from .querywindows import search_in_windows
+from .workeraccumulator import WorkerAccumulator
+
+BUG_CACHE_PATH = 'data/bug_cache.sqlite'
+
+# Number of bugs requested at once when downloading full bug records.
+BUG_CACHE_FETCH_BATCH_SIZE = 500
+
+# Maximum number of Bugzilla requests running at the same time.
+BUG_CACHE_FETCH_CONCURRENCY = 4
+
+BUG_CACHE = None
+
+
+class BugCache(object):
+
+    def __init__(self, path=BUG_CACHE_PATH):
+        # libmozdata calls the bug handlers from its worker threads.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # The history is the largest part of a bug, it's stored apart and only
+        # parsed if requested.
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS bugs ('
+            '  id INTEGER PRIMARY KEY,'
+            '  last_change_time TEXT NOT NULL,'
+            '  fields TEXT NOT NULL,'
+            '  data TEXT NOT NULL,'
+            '  history TEXT'
+            ')'
+        )
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(bugs)')]
+        if 'history' not in columns:
+            # Cache written before the history got its own column, the
+            # histories stored so far stay in 'data'.
+            self.connection.execute('ALTER TABLE bugs ADD COLUMN history TEXT')
+        self.connection.commit()
+
+    def get(self, bug_id):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT last_change_time, fields, data, history FROM bugs WHERE id = ?',
+                (bug_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'last_change_time': row[0],
+            'fields': set(json.loads(row[1])),
+            'data': row[2],
+            'history': row[3],
+        }
+
+    def is_current(self, bug_id, last_change_time, fields):
+        entry = self.get(bug_id)
+        if entry is None:
+            return False
+        if entry['last_change_time'] != last_change_time:
+            return False
+        return set(fields) <= entry['fields']
+
+    def load(self, bug_id, fields):
+        entry = self.get(bug_id)
+        if entry is None:
+            return None
+        bug_data = json.loads(entry['data'])
+        if any(field.startswith('_') for field in fields):
+            # Field groups like '_custom' can't be mapped to the field names.
+            if entry['history'] is not None:
+                bug_data['history'] = json.loads(entry['history'])
+            return bug_data
+        if 'history' in fields and entry['history'] is not None:
+            bug_data['history'] = json.loads(entry['history'])
+        # Only return the fields requested, like Bugzilla would.
+        return {field: value for field, value in bug_data.items() if field in fields}
+
+    def store(self, bug_data, fields):
+        fields = set(fields)
+        bug_data = dict(bug_data)
+        history = json.dumps(bug_data.pop('history')) if 'history' in bug_data else None
+        entry = self.get(bug_data['id'])
+        if entry is not None and entry['last_change_time'] == bug_data['last_change_time']:
+            # Same state of the bug, keep the fields downloaded for other
+            # reports.
+            stored_data = json.loads(entry['data'])
+            if 'history' in stored_data and history is None:
+                history = json.dumps(stored_data.pop('history'))
+            stored_data.pop('history', None)
+            stored_data.update(bug_data)
+            bug_data = stored_data
+            fields |= entry['fields']
+            if history is None:
+                history = entry['history']
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO bugs (id, last_change_time, fields, data, history) VALUES (?, ?, ?, ?, ?)',
+                (bug_data['id'], bug_data['last_change_time'], json.dumps(sorted(fields)), json.dumps(bug_data), history)
+            )
+
+    def get_histories(self):
+        """
+        Yields the id, last change time and history of the stored bugs whose
+        history got downloaded, ordered by id
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT id, last_change_time, fields FROM bugs ORDER BY id').fetchall()
+        for bug_id, last_change_time, fields in rows:
+            if 'history' not in json.loads(fields):
+                continue
+            entry = self.get(bug_id)
+            if entry is None:
+                continue
+            if entry['history'] is not None:
+                history = json.loads(entry['history'])
+            else:
+                history = json.loads(entry['data'])['history']
+            yield {
+                'id': bug_id,
+                'last_change_time': entry['last_change_time'],
+                'history': history,
+            }
+
+    def search(self, query):
+        """
+        Ids and last change times of the cached bugs matching the tree returned
+        by parse_query(), ordered by id. Bugs lacking a field the query checks
+        don't match.
+        """
+        bugs_found = []
+        bugs_incomplete = 0
+        with self.lock:
+            rows = self.connection.execute('SELECT id, last_change_time, data, history FROM bugs ORDER BY id')
+            for bug_id, last_change_time, data, history in rows:
+                bug_data = json.loads(data)
+                if history is not None:
+                    bug_data['history'] = json.loads(history)
+                try:
+                    if matches_query(query, bug_data):
+                        bugs_found.append({
+                            'id': bug_id,
+                            'last_change_time': last_change_time,
+                        })
+                except QueryDataError:
+                    bugs_incomplete += 1
+        if bugs_incomplete:
+            logging.getLogger().warning('Bug cache: {} bugs lack fields the search checks'.format(bugs_incomplete))
+        return bugs_found
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+
+def get_bug_cache():
+    global BUG_CACHE
+    if BUG_CACHE is None:
+        if BZDATA['mode'] == BZDATA_MODE_REPLAY:
+            # Replays get every bug from the recording and leave the local
+            # cache as it is.
+            BUG_CACHE = BugCache(':memory:')
+        else:
+            BUG_CACHE = BugCache()
+    return BUG_CACHE
+
+
+def get_fields_needed(fields, bug_id, last_change_time):
+    """Fields to load of the bug, without the history if it's in the history store"""
+    history_store = get_history_store()
+    if 'history' not in fields or history_store is None:
+        return fields
+    if BZDATA['mode'] is not None:
+        # Recordings hold the whole bugs, their replays mustn't depend on the
+        # store of this machine.
+        return fields
+    if history_store.get_bug_pos(bug_id, last_change_time) is None:
+        return fields
+    fields_needed = [field for field in fields if field != 'history']
+    if 'last_change_time' not in fields_needed:
+        # BugTimeline needs the last change time to use the store.
+        fields_needed.append('last_change_time')
+    return fields_needed
+
+
+def wait_bounded(connections, concurrency):
+    """Run the Bugzilla connections with at most 'concurrency' of them at once"""
+    running = []
+    for connection in connections:
+        if len(running) >= concurrency:
+            running.pop(0).wait()
+        running.append(connection.get_data())
+    for connection in running:
+        connection.wait()
+
+
+class CachedBugzillaSearches(object):
+    """
+    Runs multiple Bugzilla searches together. All searches first only look up
+    the ids of the matching bugs. Each bug missing in the local cache or changed
+    since it got stored is then downloaded once, even if several searches found
+    it. Afterwards the bughandler of each search gets called for its bugs, like
+    separate searches would have done.
+    """
+
+    def __init__(self, timeout=960, concurrency=BUG_CACHE_FETCH_CONCURRENCY):
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.searches = []
+
+    def add(self, params, bughandler, bugdata=None):
+        self.searches.append({
+            'params': params,
+            'bughandler': bughandler,
+            'bugdata': bugdata,
+            'results': WorkerAccumulator(),
+            'window': None,
+        })
+        return self
+
+    def add_windowed(self, params, date_keys, start_date, end_date, name, bughandler, bugdata=None):
+        """
+        Adds a search for start_date <= date < end_date which gets split into
+        windows of adaptive size, see utils/querywindows.py. 'date_keys' are the
+        keys of the params for the start and end of the window, 'name' the key
+        under which the window size gets remembered.
+        """
+        self.add(params, bughandler, bugdata)
+        self.searches[-1]['window'] = {
+            'date_keys': date_keys,
+            'start_date': start_date,
+            'end_date': end_date,
+            'name': name,
+        }
+        return self
+
+    def search_ids(self, params):
+        results = WorkerAccumulator()
+        Bugzilla(params,
+                 bughandler=results.add_bug,
+                 timeout=self.timeout).get_data().wait()
+        return results.get_items(unique=True)
+
+    def get_search_params(self, search):
+        """Params of the search, for the whole date range of windowed searches"""
+        search_params = dict(search['params'])
+        if search['window'] is not None:
+            window = search['window']
+            search_params[window['date_keys'][0]] = window['start_date']
+            search_params[window['date_keys'][1]] = window['end_date']
+        return search_params
+
+    def search_bug_cache(self, bug_cache):
+        """Finds the bugs of the searches in the bug cache only"""
+        for search in self.searches:
+            search['results'] = bug_cache.search(parse_query(self.get_search_params(search)))
+
+    def verify_results(self, search, bug_cache):
+        """Logs the bugs found by Bugzilla which don't match the params of the search"""
+        search_params = self.get_search_params(search)
+        try:
+            query = parse_query(search_params)
+        except QueryError as error:
+            logging.getLogger().warning('Bug cache: Search can\'t be verified: {}'.format(error))
+            return
+        bug_ids_mismatched = []
+        bugs_incomplete = 0
+        for bug_data in search['results']:
+            cached_bug_data = bug_cache.load(bug_data['id'], ['_all'])
+            if cached_bug_data is None:
+                continue
+            try:
+                if not matches_query(query, cached_bug_data):
+                    bug_ids_mismatched.append(bug_data['id'])
+            except QueryDataError:
+                bugs_incomplete += 1
+        if bug_ids_mismatched:
+            logging.getLogger().warning('Bug cache: {} bugs found don\'t match the search {}: {}'.format(
+                len(bug_ids_mismatched), search_params, bug_ids_mismatched))
+        if bugs_incomplete:
+            logging.getLogger().warning('Bug cache: {} bugs found lack fields to verify the search {}'.format(
+                bugs_incomplete, search_params))
+
+    def search_bugzilla(self, bug_cache):
+        """Finds the bugs of the searches and downloads the ones not cached"""
+        # Only look up which bugs match and when they changed last.
+        connections = []
+        for search in self.searches:
+            if search['window'] is not None:
+                continue
+            search_params = dict(search['params'])
+            search_params['include_fields'] = ['id', 'last_change_time']
+            connections.append(Bugzilla(search_params,
+                                        bughandler=search['results'].add_bug,
+                                        timeout=self.timeout))
+        wait_bounded(connections, self.concurrency)
+        for search in self.searches:
+            if search['window'] is None:
+                # Same order of the results, whichever worker thread received
+                # them.
+                search['results'] = search['results'].get_items(unique=True)
+            else:
+                # The size of each window depends on how the previous one went.
+                window = search['window']
+                search_params = dict(search['params'])
+                search_params['include_fields'] = ['id', 'last_change_time']
+                # Recorded for the whole date range, a replay might use other
+                # windows.
+                range_params = self.get_search_params(search)
+                range_params['include_fields'] = ['id', 'last_change_time']
+                search['results'] = recorded_search(range_params,
+                                                    lambda: search_in_windows(self.search_ids,
+                                                                              search_params,
+                                                                              window['date_keys'],
+                                                                              window['start_date'],
+                                                                              window['end_date'],
+                                                                              window['name']))
+
+        fields = []
+        for search in self.searches:
+            for field in list(search['params'].get('include_fields', [])) + ['last_change_time']:
+                if field not in fields:
+                    fields.append(field)
+
+        last_change_times = {}
+        for search in self.searches:
+            for bug_data in search['results']:
+                last_change_times[bug_data['id']] = bug_data['last_change_time']
+        # Bugs to download by the fields they need
+        bug_ids_outdated = {}
+        for bug_id, last_change_time in last_change_times.items():
+            fields_needed = get_fields_needed(fields, bug_id, last_change_time)
+            if not bug_cache.is_current(bug_id, last_change_time, fields_needed):
+                bug_ids_outdated.setdefault(tuple(fields_needed), []).append(bug_id)
+
+        connections = []
+        for fields_needed, bug_ids_fields in bug_ids_outdated.items():
+
+            def store_handler(bug_data, fields_needed=fields_needed):
+                bug_cache.store(bug_data, fields_needed)
+
+            for range_start in range(0, len(bug_ids_fields), BUG_CACHE_FETCH_BATCH_SIZE):
+                bug_ids = bug_ids_fields[range_start:range_start + BUG_CACHE_FETCH_BATCH_SIZE]
+                connections.append(Bugzilla({
+                                                'include_fields': list(fields_needed),
+                                                'id': ','.join([str(bug_id) for bug_id in bug_ids]),
+                                            },
+                                            bughandler=store_handler,
+                                            timeout=self.timeout))
+        wait_bounded(connections, self.concurrency)
+        bug_cache.commit()
+
+    def wait(self):
+        bug_cache = get_bug_cache()
+        if BZDATA['search_cache']:
+            self.search_bug_cache(bug_cache)
+        else:
+            self.search_bugzilla(bug_cache)
+
+        for search in self.searches:
+            if BZDATA['verify_searches'] and not BZDATA['search_cache']:
+                self.verify_results(search, bug_cache)
+            fields_requested = list(search['params'].get('include_fields', []))
+            for bug_data in search['results']:
+                cached_bug_data = bug_cache.load(bug_data['id'], get_fields_needed(fields_requested, bug_data['id'], bug_data['last_change_time']))
+                if cached_bug_data is None:
+                    # Bug became inaccessible between search and download.
+                    continue
+                # A replay of the report may not find the bug in its cache.
+                record_bug(cached_bug_data)
+                if search['bugdata'] is None:
+                    search['bughandler'](cached_bug_data)
+                else:
+                    search['bughandler'](cached_bug_data, search['bugdata'])
+        return self
+
+
+class CachedBugzilla(object):
+    """
+    Drop-in replacement for libmozdata's Bugzilla class for searches which
+    serves bug records from the local cache if they didn't change since they got
+    downloaded. The bughandler gets called with the same bug data as it would
+    receive from Bugzilla, in the order of the search results.
+    """
+
+    def __init__(self, params, bughandler, bugdata=None, timeout=960):
+        self.params = params
+        self.bughandler = bughandler
+        self.bugdata = bugdata
+        self.timeout = timeout
+
+    def get_data(self):
+        return self
+
+    def wait(self):
+        CachedBugzillaSearches(timeout=self.timeout).add(self.params, self.bughandler, self.bugdata).wait()
+        return self
@@ -0,0 +1,60 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+class BugCollector(object):
+    """
+    Bugs found for reports, grouped by the label of the time interval and the
+    category (e.g. 'fixed'). Each bug gets added at most once per time interval
+    and category, in the order it was found.
+
+    If a table (list) is passed, a pivot table row
+    [id, product, component, label, category] gets appended to it for every
+    bug added.
+    """
+
+    def __init__(self, table=None):
+        self.buckets = {}
+        self.table = table
+
+    def get_bucket(self, label, category):
+        if label not in self.buckets:
+            self.buckets[label] = {}
+        if category not in self.buckets[label]:
+            self.buckets[label][category] = {}
+        return self.buckets[label][category]
+
+    def has(self, label, category, bug_id):
+        return bug_id in self.get_bucket(label, category)
+
+    def add(self, label, category, bug_data, entry=None):
+        """
+        Adds the bug unless it is already known for the time interval and
+        category. 'entry' is the data kept for the bug, by default its id.
+        Returns whether the bug got added.
+        """
+        bucket = self.get_bucket(label, category)
+        if bug_data['id'] in bucket:
+            return False
+        if entry is None:
+            entry = {
+              'id': bug_data['id'],
+            }
+        bucket[bug_data['id']] = entry
+        if self.table is not None:
+            self.table.append([
+                bug_data['id'],
+                # COMPONENT_TO_TEAM[f"{bug_data['product']} :: {bug_data['component']}"],
+                bug_data['product'],
+                bug_data['component'],
+                label,
+                category,
+            ])
+        return True
+
+    def get_ids(self, label, category):
+        return list(self.get_bucket(label, category).keys())
+
+    def get_entries(self, label, category):
+        return list(self.get_bucket(label, category).values())
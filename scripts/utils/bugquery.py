@@ -0,0 +1,425 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Evaluation of Bugzilla search params against bug data with history, e.g.
+#   {'bug_type': 'defect', 'f1': 'OP', 'j1': 'AND_G', 'f2': 'bug_severity',
+#    'o2': 'changedfrom', 'v2': 'S2', 'f3': 'bug_severity', 'o3': 'changedafter',
+#    'v3': '2022-01-01', 'f4': 'CP'}
+# parse_query() turns the params into a tree of groups and conditions:
+#   {'join': 'AND', 'negate': False, 'children': [{'field': 'type',
+#    'operator': 'anyexact', 'value': 'defect', 'negate': False},
+#    {'join': 'AND_G', 'negate': False, 'children': [...]}]}
+# and matches_query() checks if a bug matches it like Bugzilla's search would.
+# Bugs from the bug cache (utils/bugcache.py) can be searched this way without
+# contacting Bugzilla, and the bugs Bugzilla returned can be checked against
+# the params.
+
+import re
+
+# Params which don't filter the bugs.
+QUERY_CONTROL_PARAMS = {
+    'count_only',
+    'include_fields',
+    'j_top',
+    'limit',
+    'offset',
+    'order',
+    'query_format',
+}
+
+# Search field names which have another name in the bug data and history.
+QUERY_FIELD_NAMES = {
+    'bug_group': 'groups',
+    'bug_id': 'id',
+    'bug_severity': 'severity',
+    'bug_status': 'status',
+    'bug_type': 'type',
+    'creation_ts': 'creation_time',
+    'delta_ts': 'last_change_time',
+    'rep_platform': 'platform',
+    'reporter': 'creator',
+    'short_desc': 'summary',
+    'status_whiteboard': 'whiteboard',
+}
+
+# Fields holding timestamps, compared as times by 'greaterthan' etc.
+QUERY_TIME_FIELDS = {
+    'cf_last_resolved',
+    'creation_time',
+    'last_change_time',
+}
+
+# Operators checking the changes of the field in the history of the bug.
+QUERY_CHANGE_OPERATORS = {
+    'changedafter',
+    'changedbefore',
+    'changedby',
+    'changedfrom',
+    'changedto',
+}
+
+# Operators checking the current value of the field.
+QUERY_VALUE_OPERATORS = {
+    'allwords',
+    'allwordssubstr',
+    'anyexact',
+    'anywords',
+    'anywordssubstr',
+    'casesubstring',
+    'equals',
+    'greaterthan',
+    'greaterthaneq',
+    'isempty',
+    'isnotempty',
+    'lessthan',
+    'lessthaneq',
+    'notequals',
+    'notregexp',
+    'notsubstring',
+    'nowords',
+    'nowordssubstr',
+    'regexp',
+    'substring',
+}
+
+QUERY_OPERATORS = QUERY_CHANGE_OPERATORS | QUERY_VALUE_OPERATORS
+
+QUERY_JOINS = ['AND', 'AND_G', 'OR']
+
+
+class QueryError(Exception):
+    """Params which can't be evaluated, e.g. an unknown operator"""
+    pass
+
+
+class QueryDataError(QueryError):
+    """The bug data lacks a field the params check, e.g. 'history'"""
+    pass
+
+
+def get_field_name(field):
+    return QUERY_FIELD_NAMES.get(field, field)
+
+
+def get_values(value):
+    """Values of a param, Bugzilla accepts lists and comma separated strings"""
+    if isinstance(value, (list, tuple)):
+        values = []
+        for item in value:
+            values.extend(get_values(item))
+        return values
+    return [item.strip() for item in str(value).split(',') if item.strip() != '']
+
+
+def get_words(value):
+    if isinstance(value, (list, tuple)):
+        value = ' '.join([str(item) for item in value])
+    return [word.lower() for word in re.split(r'[\s,]+', str(value)) if word != '']
+
+
+def get_query_time(value):
+    """Time of a param like '2022-01-01' or '2022-01-01 12:00:00' in Bugzilla's format"""
+    value = str(value).strip()
+    if not re.match(r'^\d{4}-\d{2}-\d{2}', value):
+        raise QueryError(f"Unsupported date '{value}'")
+    time_part = value[11:19] if len(value) >= 19 else '00:00:00'
+    return f"{value[:10]}T{time_part}Z"
+
+
+def get_param(params, key, default=None):
+    """Param with a single value, e.g. the operator. Lists with one item are accepted like by Bugzilla."""
+    value = params.get(key, default)
+    if isinstance(value, (list, tuple)) and len(value) == 1:
+        return value[0]
+    return value
+
+
+def is_negated(value):
+    return str(value) not in ['', '0']
+
+
+def get_chart_indexes(params):
+    indexes = set()
+    for key in params:
+        match = re.match(r'^[fojnv](\d+)$', key)
+        if match:
+            indexes.add(int(match.group(1)))
+    return sorted(indexes)
+
+
+def parse_group(join, negate=False):
+    if join not in QUERY_JOINS:
+        raise QueryError(f"Unsupported join '{join}'")
+    return {
+        'join': join,
+        'negate': negate,
+        'children': [],
+    }
+
+
+def parse_query(params):
+    """Tree of the groups and conditions of the search params"""
+    root = parse_group(get_param(params, 'j_top', 'AND'))
+    for key, value in params.items():
+        if key in QUERY_CONTROL_PARAMS or re.match(r'^[fojnv]\d+$', key):
+            continue
+        if key.endswith('_type') and key[:-len('_type')] in params:
+            # Operator of another param, e.g. 'keywords_type'. Fields like
+            # 'bug_type' are searched.
+            continue
+        field = get_field_name(key)
+        if field in ['keywords', 'whiteboard', 'summary']:
+            # Text fields match words, e.g. 'keywords_type': 'anywords'
+            operator = get_param(params, key + '_type', 'allwords' if field == 'keywords' else 'substring')
+        else:
+            operator = 'anyexact'
+        root['children'].append(parse_condition(field, operator, value))
+
+    groups = [root]
+    for index in get_chart_indexes(params):
+        field = get_param(params, f'f{index}')
+        if field is None:
+            continue
+        negate = is_negated(get_param(params, f'n{index}', ''))
+        if field == 'OP':
+            group = parse_group(get_param(params, f'j{index}', 'AND'), negate)
+            groups[-1]['children'].append(group)
+            groups.append(group)
+        elif field == 'CP':
+            if len(groups) == 1:
+                raise QueryError(f"'CP' in f{index} without 'OP'")
+            groups.pop()
+        else:
+            groups[-1]['children'].append(parse_condition(get_field_name(field),
+                                                          get_param(params, f'o{index}', 'equals'),
+                                                          get_param(params, f'v{index}', ''),
+                                                          negate))
+    return root
+
+
+def parse_condition(field, operator, value, negate=False):
+    if operator not in QUERY_OPERATORS:
+        raise QueryError(f"Unsupported operator '{operator}' for field '{field}'")
+    if operator in ['regexp', 'notregexp']:
+        try:
+            re.compile(str(value))
+        except re.error as error:
+            raise QueryError(f"Invalid regular expression '{value}' for field '{field}': {error}")
+    return {
+        'field': field,
+        'operator': operator,
+        'value': value,
+        'negate': negate,
+    }
+
+
+def get_fields(node):
+    """Bug data fields the tree checks, 'history' for conditions on changes"""
+    if 'field' in node:
+        if node['field'] == 'longdesc':
+            return {'comments'}
+        if node['operator'] in QUERY_CHANGE_OPERATORS:
+            return {'history'}
+        if node['field'] == 'flagtypes.name':
+            return {'flags'}
+        return {node['field']}
+    fields = set()
+    for child in node['children']:
+        fields |= get_fields(child)
+    return fields
+
+
+def get_bug_value(bug_data, field):
+    if field == 'longdesc':
+        if 'comments' not in bug_data:
+            raise QueryDataError("Field 'comments' is not in the bug data")
+        return [comment['text'] for comment in bug_data['comments']]
+    if field == 'flagtypes.name':
+        # Searched like the history shows the flags, e.g. 'needinfo?(user)'
+        if 'flags' not in bug_data:
+            raise QueryDataError("Field 'flags' is not in the bug data")
+        return [flag['name'] + flag['status'] + (f"({flag['requestee']})" if flag.get('requestee') else '')
+                for flag in bug_data['flags']]
+    if field not in bug_data:
+        raise QueryDataError(f"Field '{field}' is not in the bug data")
+    return bug_data[field]
+
+
+def get_bug_changes(bug_data, field):
+    """Changes of the field as (time, user, removed, added)"""
+    if field == 'longdesc':
+        # Comments count as changes adding the text.
+        if 'comments' not in bug_data:
+            raise QueryDataError("Conditions on comments need the 'comments' of the bug")
+        return [(comment['creation_time'], comment['creator'], '', comment['text']) for comment in bug_data['comments']]
+    if 'history' not in bug_data:
+        raise QueryDataError("Conditions on changes need the 'history' of the bug")
+    changes = []
+    for historyItem in bug_data['history']:
+        for change in historyItem['changes']:
+            if change['field_name'] == field:
+                changes.append((historyItem['when'], historyItem.get('who'), change['removed'], change['added']))
+    return changes
+
+
+def matches_change(condition, change):
+    change_time, user, removed, added = change
+    operator = condition['operator']
+    if operator == 'changedafter':
+        return change_time >= get_query_time(condition['value'])
+    if operator == 'changedbefore':
+        return change_time <= get_query_time(condition['value'])
+    if operator == 'changedby':
+        return user == str(condition['value'])
+    if operator == 'changedfrom':
+        return str(condition['value']) in [removed] + get_values(removed)
+    if operator == 'changedto':
+        return str(condition['value']) in [added] + get_values(added)
+    raise QueryError(f"Operator '{operator}' doesn't check changes")
+
+
+def compare_values(field, bug_value, query_value):
+    """-1, 0 or 1 as the value of the bug compares to the one of the query"""
+    if field in QUERY_TIME_FIELDS:
+        if bug_value is None:
+            return None
+        query_value = get_query_time(query_value)
+    else:
+        try:
+            bug_value = float(bug_value)
+            query_value = float(query_value)
+        except (TypeError, ValueError):
+            bug_value = str(bug_value)
+            query_value = str(query_value)
+    return (bug_value > query_value) - (bug_value < query_value)
+
+
+def matches_value(condition, bug_data):
+    field = condition['field']
+    value = get_bug_value(bug_data, field)
+    operator = condition['operator']
+    if operator in ['isempty', 'isnotempty']:
+        is_empty = value is None or value == '' or value == [] or value == '---'
+        return is_empty == (operator == 'isempty')
+    if operator in ['greaterthan', 'greaterthaneq', 'lessthan', 'lessthaneq']:
+        comparison = compare_values(field, value, condition['value'])
+        if comparison is None:
+            return False
+        return {
+            'greaterthan': comparison > 0,
+            'greaterthaneq': comparison >= 0,
+            'lessthan': comparison < 0,
+            'lessthaneq': comparison <= 0,
+        }[operator]
+
+    bug_values = [str(item) for item in value] if isinstance(value, list) else ['' if value is None else str(value)]
+    bug_text = ' '.join(bug_values)
+    if operator == 'equals':
+        return str(condition['value']) in bug_values
+    if operator == 'notequals':
+        return str(condition['value']) not in bug_values
+    if operator == 'anyexact':
+        return any(item in bug_values for item in get_values(condition['value']))
+    if operator == 'substring':
+        return str(condition['value']).lower() in bug_text.lower()
+    if operator == 'casesubstring':
+        return str(condition['value']) in bug_text
+    if operator == 'notsubstring':
+        return str(condition['value']).lower() not in bug_text.lower()
+    if operator == 'regexp':
+        return any(re.search(str(condition['value']), item, re.IGNORECASE) for item in bug_values)
+    if operator == 'notregexp':
+        return not any(re.search(str(condition['value']), item, re.IGNORECASE) for item in bug_values)
+    if operator in ['allwordssubstr', 'anywordssubstr', 'nowordssubstr']:
+        found = [word in bug_text.lower() for word in get_words(condition['value'])]
+        return {
+            'allwordssubstr': all(found),
+            'anywordssubstr': any(found),
+            'nowordssubstr': not any(found),
+        }[operator]
+    bug_words = set(get_words(bug_values))
+    if operator == 'allwords':
+        return all(word in bug_words for word in get_words(condition['value']))
+    if operator == 'anywords':
+        return any(word in bug_words for word in get_words(condition['value']))
+    if operator == 'nowords':
+        return not any(word in bug_words for word in get_words(condition['value']))
+    raise QueryError(f"Operator '{operator}' doesn't check values")
+
+
+def matches_condition(condition, bug_data):
+    if condition['operator'] in QUERY_CHANGE_OPERATORS:
+        return any(matches_change(condition, change) for change in get_bug_changes(bug_data, condition['field']))
+    return matches_value(condition, bug_data)
+
+
+def matches_same_change(conditions, bug_data):
+    """AND_G: the conditions on changes of a field have to match the same change"""
+    conditions_by_field = {}
+    for condition in conditions:
+        conditions_by_field.setdefault(condition['field'], []).append(condition)
+    for field, field_conditions in conditions_by_field.items():
+        if not any(all(matches_change(condition, change) for condition in field_conditions)
+                   for change in get_bug_changes(bug_data, field)):
+            return False
+    return True
+
+
+def is_change_condition(node):
+    return 'field' in node and node['operator'] in QUERY_CHANGE_OPERATORS and not node['negate']
+
+
+def matches_group(group, bug_data):
+    children = group['children']
+    if group['join'] == 'AND_G':
+        change_conditions = [child for child in children if is_change_condition(child)]
+        other_nodes = [child for child in children if not is_change_condition(child)]
+        return matches_same_change(change_conditions, bug_data) and all(matches_node(child, bug_data) for child in other_nodes)
+    if group['join'] == 'OR':
+        return any(matches_node(child, bug_data) for child in children)
+    return all(matches_node(child, bug_data) for child in children)
+
+
+def matches_node(node, bug_data):
+    if 'field' in node:
+        matches = matches_condition(node, bug_data)
+    else:
+        matches = matches_group(node, bug_data)
+    return matches != node['negate']
+
+
+def matches_query(query, bug_data):
+    """If the bug matches the tree returned by parse_query()"""
+    return matches_node(query, bug_data)
+
+
+def evaluate_node(node, bug_data):
+    """Like matches_node(), None if the bug data lacks fields to decide"""
+    if 'field' in node:
+        try:
+            matches = matches_condition(node, bug_data)
+        except QueryDataError:
+            return None
+    elif node['join'] == 'AND_G':
+        try:
+            matches = matches_group(node, bug_data)
+        except QueryDataError:
+            return None
+    else:
+        results = [evaluate_node(child, bug_data) for child in node['children']]
+        if node['join'] == 'OR':
+            matches = True if True in results else (None if None in results else False)
+        else:
+            matches = False if False in results else (None if None in results else True)
+        if matches is None:
+            return None
+    return matches != node['negate']
+
+
+def may_match_query(query, bug_data):
+    """
+    If the bug matches the tree or only fields missing in the bug data could
+    exclude it, e.g. for bugs recorded with a few fields as search results
+    """
+    return evaluate_node(query, bug_data) is not False
@@ -2,158 +2,432 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import bisect
 import datetime
+import functools
+import gzip
 import json
+import os
 import pytz
 import re
+import time
+import urllib.error
 import urllib.request
 import sys
 
+from .historystore import get_history_store
+
 BUGZILLA_CONFIG_URL = 'https://bugzilla.mozilla.org/rest/configuration'
 BUGZILLA_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 BUG_LIST_WEB_URL = 'https://bugzilla.mozilla.org/buglist.cgi?bug_id_type=anyexact&query_format=advanced&bug_id='
 
-COMPONENT_TO_TEAM_MAP = None
-FIELDS_TYPES_MAP = None
+# Flag in the value of a 'flagtypes.name' change, e.g. 'review+',
+# 'approval-mozilla-beta?' or 'needinfo?(someone@example.com)'.
+FLAG_PATTERN = re.compile(r'(.+?)([?+-])(?:\((.*)\))?')
+
+# Number of parsed timestamps to remember. Bugs get processed for many time
+# intervals and their history items often share the same timestamp.
+BUGZILLA_TIME_CACHE_SIZE = 1 << 16
+
+# Teams of the components, derived from BUGZILLA_CONFIG_URL. The configuration
+# is several megabytes large, only the teams get stored, together with the
+# ETag and Last-Modified of the response to check later if it changed.
+COMPONENT_TEAMS_PATH = 'data/component_teams.json'
+
+# Seconds the stored teams get used before Bugzilla gets asked for changes.
+COMPONENT_TEAMS_MAX_AGE = 24 * 60 * 60
+
+COMPONENT_TEAMS = None
+
+
+def download_component_teams(component_teams_stored):
+    """
+    Teams of the components from the Bugzilla configuration, or the stored
+    ones if the configuration didn't change since they got stored.
+    """
+    request = urllib.request.Request(BUGZILLA_CONFIG_URL, headers={'Accept-Encoding': 'gzip'})
+    if component_teams_stored is not None:
+        if component_teams_stored['etag']:
+            request.add_header('If-None-Match', component_teams_stored['etag'])
+        if component_teams_stored['last_modified']:
+            request.add_header('If-Modified-Since', component_teams_stored['last_modified'])
+    try:
+        with urllib.request.urlopen(request) as request_handle:
+            body = request_handle.read()
+            if request_handle.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            data = json.loads(body)
+            etag = request_handle.headers.get('ETag')
+            last_modified = request_handle.headers.get('Last-Modified')
+    except urllib.error.HTTPError as error:
+        if error.code != 304 or component_teams_stored is None:
+            raise
+        component_teams_stored['checked'] = time.time()
+        return component_teams_stored
+
+    products = {}
+    for product_data in data['field']['product']['values']:
+        products[product_data['id']] = product_data
+    components = {}
+    for component_data in data['field']['component']['values']:
+        if component_data['product_id'] not in products:
+            continue
+        product_data = products[component_data['product_id']]
+        components[f"{product_data['name']} :: {component_data['name']}"] = {
+            'team': component_data['team_name'],
+            'active': bool(product_data['isactive']) and bool(component_data['isactive']),
+        }
+    return {
+        'url': BUGZILLA_CONFIG_URL,
+        'etag': etag,
+        'last_modified': last_modified,
+        'checked': time.time(),
+        'components': components,
+    }
+
+
+def load_component_teams():
+    component_teams_stored = None
+    if os.path.exists(COMPONENT_TEAMS_PATH):
+        with open(COMPONENT_TEAMS_PATH, 'r') as component_teams_reader:
+            component_teams_stored = json.load(component_teams_reader)
+        if component_teams_stored['url'] != BUGZILLA_CONFIG_URL:
+            component_teams_stored = None
+    if component_teams_stored is None or time.time() - component_teams_stored['checked'] > COMPONENT_TEAMS_MAX_AGE:
+        component_teams_stored = download_component_teams(component_teams_stored)
+        # Replace the file at once, other reports might read it.
+        with open(COMPONENT_TEAMS_PATH + '.new', 'w') as component_teams_writer:
+            json.dump(component_teams_stored, component_teams_writer)
+        os.replace(COMPONENT_TEAMS_PATH + '.new', COMPONENT_TEAMS_PATH)
+    return component_teams_stored['components']
+
+
+def get_component_teams():
+    """
+    Team and if it's active for all components, including inactive ones:
+    {"product :: component": {'team': team_name, 'active': bool}}
+    """
+    global COMPONENT_TEAMS
+    if COMPONENT_TEAMS is None:
+        # Imported here, utils/bzdata.py imports this module.
+        from .bzdata import recorded_value
+        # Replays use the teams of the recorded run, without asking Bugzilla.
+        COMPONENT_TEAMS = recorded_value('component_teams', load_component_teams)
+    return COMPONENT_TEAMS
+
 
 def get_component_to_team(product, component):
-    global COMPONENT_TO_TEAM_MAP
-    if COMPONENT_TO_TEAM_MAP is None:
-        with urllib.request.urlopen(BUGZILLA_CONFIG_URL) as request_handle:
-            data = json.loads(request_handle.read())
-
-            ID_TO_PRODUCT = {}
-            products_data = data['field']['product']['values']
-            for pos in range(len(products_data)):
-                product_name = products_data[pos]['name']
-                ID_TO_PRODUCT[products_data[pos]['id']] = product_name
-
-            COMPONENT_TO_TEAM_MAP = {}
-            components_data = data['field']['component']['values']
-            for component_data in components_data:
-                if component_data['product_id'] not in ID_TO_PRODUCT.keys():
-                    continue
-
-                product_name = ID_TO_PRODUCT[component_data['product_id']]
-                COMPONENT_TO_TEAM_MAP[f"{product_name} :: {component_data['name']}"] = component_data['team_name']
-    product_component_requested = f"{product} :: {component}"
-    if product_component_requested in COMPONENT_TO_TEAM_MAP:
-        return COMPONENT_TO_TEAM_MAP[product_component_requested]
-    return None
-
-
-def get_field_type(field_name, field_value):
-    global FIELDS_TYPES_MAP
-    if FIELDS_TYPES_MAP is None:
-        FIELDS_TYPES_MAP = {}
-    if field_name in FIELDS_TYPES_MAP:
-        return FIELDS_TYPES_MAP[field_name]
-    field_type = type(field_value)
-    if field_type not in [list, str]:
-        sys.exit(f"Unsupported field type '{field_type}'")
-    FIELDS_TYPES_MAP[field_name] = field_type
+    component_team = get_component_teams().get(f"{product} :: {component}")
+    if component_team is None:
+        return None
+    return component_team['team']
 
 
-def get_needinfo_histories(bug_data):
-    needinfo_histories = {}
+@functools.lru_cache(maxsize=BUGZILLA_TIME_CACHE_SIZE)
+def parse_flags(value):
+    """
+    Flags in a value of a 'flagtypes.name' change like
+    'review+, needinfo?(someone@example.com)' as tuple of
+    (name, status, requestee), requestee is None if nobody got asked.
+    """
+    flags = []
+    for flag in value.split(', '):
+        match = FLAG_PATTERN.fullmatch(flag)
+        if match:
+            flags.append(match.groups())
+    return tuple(flags)
+
+
+def get_flag_events(bug_data, flag_name):
+    """
+    Changes of the flag in the history of the bug, in the order they happened.
+    Each event is a dict with 'action' ('set' or 'clear'), 'status', 'requestee',
+    'who' (the user who changed the flag, for a request the requester) and
+    'time'. Clears of a change come before its sets.
+    """
+    flag_events = []
     for historyItem in bug_data['history']:
+        change_time = None
         for change in historyItem['changes']:
-            field = change['field_name']
-            if field != 'flagtypes.name':
+            if change['field_name'] != 'flagtypes.name':
                 continue
-            if not change['added'].startswith('needinfo?') and not change['removed'].startswith('needinfo?'):
+            if flag_name not in change['removed'] and flag_name not in change['added']:
                 continue
-            if change['removed'].startswith('needinfo?'):
-                users_needinfoed = re.findall('(?<=needinfo\?\()[^)]*(?=\))', change['removed'])
-                for user_needinfoed in users_needinfoed:
-                    needinfo_end = parse_time(historyItem['when'], BUGZILLA_DATETIME_FORMAT)
-                    if user_needinfoed in needinfo_histories.keys():
-                        # Even when a bug gets created and the needinfo flag used
-                        # during the creation, it will be recorded as change after
-                        # the bug got created.
-                        if needinfo_histories[user_needinfoed][-1]['end'] is None:
-                            needinfo_histories[user_needinfoed][-1]['end'] = needinfo_end
-            if change['added'].startswith('needinfo?'):
-                users_needinfoed = re.findall('(?<=needinfo\?\()[^)]*(?=\))', change['added'])
-                for user_needinfoed in users_needinfoed:
-                    needinfo_start = parse_time(historyItem['when'], BUGZILLA_DATETIME_FORMAT)
-                    if user_needinfoed not in needinfo_histories.keys():
-                        needinfo_histories[user_needinfoed] = []
-                    if len(needinfo_histories[user_needinfoed]) == 0 or needinfo_histories[user_needinfoed][-1]['end']:
-                        needinfo_histories[user_needinfoed].append({
-                            'start': needinfo_start,
-                            'end': None,
-                            'requester': historyItem['who'],
-                            'requestee': user_needinfoed,
-                        })
+            if change_time is None:
+                change_time = parse_bugzilla_time(historyItem['when'])
+            for action, value in [('clear', change['removed']), ('set', change['added'])]:
+                for name, status, requestee in parse_flags(value):
+                    if name != flag_name:
+                        continue
+                    flag_events.append({
+                        'action': action,
+                        'status': status,
+                        'requestee': requestee,
+                        'who': historyItem['who'],
+                        'time': change_time,
+                    })
+    return flag_events
+
+
+def pair_needinfo_requests(flag_events, accept_request=None):
+    """
+    Needinfo requests of the 'needinfo' flag events by user asked:
+    {requestee: [{'start', 'end', 'requester', 'requestee'}]}, 'end' is None for
+    open requests. Requests for which accept_request(flag_event) returns False
+    get ignored.
+    """
+    needinfo_histories = {}
+    for flag_event in flag_events:
+        user_needinfoed = flag_event['requestee']
+        if user_needinfoed is None or flag_event['status'] != '?':
+            continue
+        needinfos = needinfo_histories.get(user_needinfoed)
+        if flag_event['action'] == 'clear':
+            # Even when a bug gets created and the needinfo flag used
+            # during the creation, it will be recorded as change after
+            # the bug got created.
+            if needinfos and needinfos[-1]['end'] is None:
+                needinfos[-1]['end'] = flag_event['time']
+            continue
+        if accept_request is not None and not accept_request(flag_event):
+            continue
+        if needinfos is None:
+            needinfos = needinfo_histories[user_needinfoed] = []
+        # Under rare circumstances, it's possible the same person gets needinfo
+        # twice (e.g. with the API)
+        if len(needinfos) == 0 or needinfos[-1]['end']:
+            needinfos.append({
+                'start': flag_event['time'],
+                'end': None,
+                'requester': flag_event['who'],
+                'requestee': user_needinfoed,
+            })
     return needinfo_histories
 
 
-def get_relevant_bug_changes(bug_data, fields, start_date, end_date):
-    bug_states = {}
-    for field in fields:
-        bug_states[field] = {
-            "old": None,
-            "new": None,
+def get_needinfo_histories(bug_data):
+    return pair_needinfo_requests(get_flag_events(bug_data, 'needinfo'))
+
+
+def get_comments_by_creator(bug_data):
+    """
+    Comments of the bug by creator: {creator: {'times': [creation times],
+    'comments': [comments]}}, sorted by creation time to look up the comments
+    of a time range with bisection.
+    """
+    comment_times_by_creator = {}
+    for comment in bug_data['comments']:
+        if comment['creator'] not in comment_times_by_creator:
+            comment_times_by_creator[comment['creator']] = []
+        comment_times_by_creator[comment['creator']].append((parse_bugzilla_time(comment['creation_time']), comment))
+    comments_by_creator = {}
+    for creator, comment_times in comment_times_by_creator.items():
+        # Comments are ordered by creation time, this only protects the
+        # bisection.
+        comment_times.sort(key=lambda comment_time: comment_time[0])
+        comments_by_creator[creator] = {
+            'times': [comment_time[0] for comment_time in comment_times],
+            'comments': [comment_time[1] for comment_time in comment_times],
         }
+    return comments_by_creator
+
+
+def get_field_change_times(bug_data):
+    """
+    Times of the changes in the history of the bug by field, sorted, to look up
+    with bisection if a field changed within a time range.
+    """
+    field_change_times = {}
     for historyItem in bug_data['history']:
+        change_time = parse_bugzilla_time(historyItem['when'])
         for change in historyItem['changes']:
             field = change['field_name']
-            current_value = bug_data[field] if field in bug_data else None
-            if field in fields and get_field_type(field, current_value) == str:
-                change_time_str = historyItem['when']
-                change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                change_time = pytz.utc.localize(change_time).date()
-                if change_time < start_date:
-                    bug_states[field]["old"] = change['added']
-                elif start_date <= change_time < end_date:
-                    if bug_states[field]["old"] is None:
-                        bug_states[field]["old"] = change['removed']
-                    bug_states[field]["new"] = change['added']
-                if change_time > end_date:
-                    if bug_states[field]["old"] is None:
-                        bug_states[field]["old"] = change['removed']
-                    if bug_states[field]["new"] is None:
-                        bug_states[field]["new"] = change['removed']
-
-    for historyItem in reversed(bug_data['history']):
-        change_time_str = historyItem['when']
-        change_time = datetime.datetime.strptime(change_time_str, '%Y-%m-%dT%H:%M:%SZ')
-        change_time = pytz.utc.localize(change_time).date()
-        for change in historyItem['changes']:
-            field = change['field_name']
-            current_value = bug_data[field] if field in bug_data else None
-            if field in fields and get_field_type(field, current_value) == list:
-                if bug_states[field]["new"] is None:
-                    # state value is an Array/List, but changes are a singe string
-                    bug_states[field]["new"] = set(bug_data[field])
-                removed_items = set(items_str_to_list(change['removed']))
-                added_items = set(items_str_to_list(change['added']))
-                if change_time > end_date:
-                    bug_states[field]["new"] = (bug_states[field]["new"] | removed_items) - added_items
-                elif start_date <= change_time < end_date:
-                    if bug_states[field]["old"] is None:
-                        bug_states[field]["old"] = bug_states[field]["new"]
-                    bug_states[field]["old"] = (bug_states[field]["old"] | removed_items) - added_items
-                if change_time < start_date:
-                    if bug_states[field]["old"] is None:
-                        bug_states[field]["old"] = bug_states[field]["new"]
-                    break
-
-    for field in fields:
-        current_value = bug_data[field] if field in bug_data else None
-        if bug_states[field]["old"] is None:
-            bug_states[field]["old"] = current_value
-        if bug_states[field]["new"] is None:
-            bug_states[field]["new"] = current_value
-    return bug_states
+            if field not in field_change_times:
+                field_change_times[field] = []
+            field_change_times[field].append(change_time)
+    for change_times in field_change_times.values():
+        # The history is ordered by time, this only protects the bisection.
+        change_times.sort()
+    return field_change_times
+
+
+class BugTimeline(object):
+    """
+    Changes of the fields of a bug, sorted by the date of the change. The
+    history of the bug gets walked only once, the state of fields at the start
+    and end of time intervals gets looked up with bisection.
+    """
+
+    def __init__(self, bug_data, missing_value=None):
+        self.bug_data = bug_data
+        # Value used for fields which are not set for the bug.
+        self.missing_value = missing_value
+        self.history_store = get_history_store()
+        self.history_store_pos = None
+        self.changes = {}
+        # States of list fields before each of their changes, see
+        # get_list_field_states().
+        self.list_states = {}
+        if 'history' not in bug_data:
+            if self.history_store is not None and 'last_change_time' in bug_data:
+                self.history_store_pos = self.history_store.get_bug_pos(bug_data['id'], bug_data['last_change_time'])
+            if self.history_store_pos is None:
+                sys.exit(f"Bug {bug_data.get('id')} has no 'history' and isn't in the history store, request the field 'history'")
+            # The changes of a field get read from the store when needed.
+            return
+        for historyItem in bug_data['history']:
+            change_time = parse_bugzilla_date(historyItem['when'])
+            for change in historyItem['changes']:
+                field = change['field_name']
+                if field not in self.changes:
+                    self.changes[field] = {
+                        'times': [],
+                        'removed': [],
+                        'added': [],
+                    }
+                self.changes[field]['times'].append(change_time)
+                self.changes[field]['removed'].append(change['removed'])
+                self.changes[field]['added'].append(change['added'])
+
+    def get_changes(self, field):
+        """Changes of the field as dict of lists 'times', 'removed' and 'added', None if it never changed"""
+        if self.history_store_pos is not None and field not in self.changes:
+            self.changes[field] = self.history_store.get_field_changes(self.history_store_pos, field)
+        return self.changes.get(field)
+
+    def get_field_changes(self, field):
+        """Dates, removed and added values of the changes of the field"""
+        changes = self.get_changes(field)
+        if changes is None:
+            return [], [], []
+        return changes['times'], changes['removed'], changes['added']
+
+    def get_current_value(self, field):
+        if field in self.bug_data:
+            return self.bug_data[field]
+        return self.missing_value
+
+    def get_relevant_bug_changes(self, fields, start_date, end_date):
+        return self.get_relevant_bug_changes_for_time_intervals(fields, [{
+            'from': start_date,
+            'to': end_date,
+        }])[0]
+
+    def get_relevant_bug_changes_for_time_intervals(self, fields, time_intervals):
+        """
+        Returns the old (at start) and new (at end) value of the fields for each
+        time interval. Changes on the end date belong to the next interval.
+        """
+        bug_states_by_time_interval = [{} for time_interval in time_intervals]
+        for field in fields:
+            current_value = self.get_current_value(field)
+            if isinstance(current_value, list):
+                self.add_list_field_states(field, current_value, time_intervals, bug_states_by_time_interval)
+            elif self.get_changes(field) is None:
+                for bug_states in bug_states_by_time_interval:
+                    bug_states[field] = {
+                        "old": current_value,
+                        "new": current_value,
+                    }
+            else:
+                self.add_str_field_states(field, current_value, time_intervals, bug_states_by_time_interval)
+        return bug_states_by_time_interval
+
+    def add_str_field_states(self, field, current_value, time_intervals, bug_states_by_time_interval):
+        times, removed, added = self.get_field_changes(field)
+        for time_interval, bug_states in zip(time_intervals, bug_states_by_time_interval):
+            # Changes before the interval: [:pos_start], during it: [pos_start:pos_end]
+            pos_start = bisect.bisect_left(times, time_interval['from'])
+            pos_end = bisect.bisect_left(times, time_interval['to'])
+            if pos_start > 0:
+                old = added[pos_start - 1]
+            else:
+                old = removed[0]
+            if pos_end > pos_start:
+                new = added[pos_end - 1]
+            elif pos_end < len(times):
+                new = removed[pos_end]
+            else:
+                new = current_value
+            bug_states[field] = {
+                "old": old,
+                "new": new,
+            }
+
+    def get_list_field_states(self, field, current_value):
+        """
+        Values of the list field as sets: before the first change, ..., before
+        the last change and the current one. Walked once backwards from the
+        current value.
+        """
+        if field not in self.list_states:
+            times, removed, added = self.get_field_changes(field)
+            states = [set(current_value)]
+            for pos in range(len(times) - 1, -1, -1):
+                # state value is an Array/List, but changes are a singe string
+                states.append((states[-1] | set(items_str_to_list(removed[pos]))) - set(items_str_to_list(added[pos])))
+            states.reverse()
+            self.list_states[field] = states
+        return self.list_states[field]
+
+    def add_list_field_states(self, field, current_value, time_intervals, bug_states_by_time_interval):
+        times, removed, added = self.get_field_changes(field)
+        states = self.get_list_field_states(field, current_value)
+        for time_interval, bug_states in zip(time_intervals, bug_states_by_time_interval):
+            # The state before the first change on or after the date
+            bug_states[field] = {
+                "old": states[bisect.bisect_left(times, time_interval['from'])],
+                "new": states[bisect.bisect_left(times, time_interval['to'])],
+            }
+
+
+def get_relevant_bug_changes(bug_data, fields, start_date, end_date):
+    return BugTimeline(bug_data).get_relevant_bug_changes(fields, start_date, end_date)
+
+
+def get_relevant_bug_changes_for_bugs_found(bugs_found, fields, time_intervals):
+    """
+    Old and new values of the fields for the bugs found by the searches of the
+    time intervals, a list of (time interval position, bug data). Returns the
+    bug states in the same order, the history of each bug gets walked once for
+    all time intervals it got found for.
+    """
+    bugs_data = {}
+    time_interval_positions_by_bug = {}
+    for time_interval_pos, bug_data in bugs_found:
+        bugs_data.setdefault(bug_data['id'], bug_data)
+        time_interval_positions = time_interval_positions_by_bug.setdefault(bug_data['id'], [])
+        if time_interval_pos not in time_interval_positions:
+            time_interval_positions.append(time_interval_pos)
+    bug_states_by_bug = {}
+    for bug_id, time_interval_positions in time_interval_positions_by_bug.items():
+        bug_states_by_time_interval = BugTimeline(bugs_data[bug_id]).get_relevant_bug_changes_for_time_intervals(
+            fields, [time_intervals[time_interval_pos] for time_interval_pos in time_interval_positions])
+        bug_states_by_bug[bug_id] = dict(zip(time_interval_positions, bug_states_by_time_interval))
+    return [bug_states_by_bug[bug_data['id']][time_interval_pos] for time_interval_pos, bug_data in bugs_found]
 
 
 def parse_time(string, format_string):
+    if format_string == BUGZILLA_DATETIME_FORMAT:
+        return parse_bugzilla_time(string)
     change_time = datetime.datetime.strptime(string, format_string)
     return pytz.utc.localize(change_time)
 
 
+@functools.lru_cache(maxsize=BUGZILLA_TIME_CACHE_SIZE)
+def parse_bugzilla_time(string):
+    """Parse a Bugzilla timestamp like '2023-01-31T12:34:56Z' as UTC datetime"""
+    # Fixed format, the trailing 'Z' is the only part fromisoformat can't read
+    # before Python 3.11.
+    return datetime.datetime.fromisoformat(string[:19]).replace(tzinfo=pytz.utc)
+
+
+@functools.lru_cache(maxsize=BUGZILLA_TIME_CACHE_SIZE)
+def parse_bugzilla_date(string):
+    """Parse the UTC date of a Bugzilla timestamp like '2023-01-31T12:34:56Z'"""
+    return datetime.date.fromisoformat(string[:10])
+
+
 def items_str_to_list(items_str):
     if not isinstance(items_str, str):
         sys.exit(f"items provided should be string but got {type(items_str)} for {str(items_str)}")
@@ -0,0 +1,498 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Record and replay of Bugzilla data for the reports.
+#
+# Reports request bugs with the Bugzilla class of this module instead of the one
+# of libmozdata. Started with '--bzdata-save', the params and results of every
+# request get appended to a file as they arrive. Started with '--bzdata-load',
+# the requests get answered from such a file without contacting Bugzilla, so
+# changes to the report logic can be checked quickly.
+#
+# Values the requests depend on (e.g. the current date for '--weeks') have to
+# be passed through recorded_value() so the replay sends the same requests.
+#
+# File format: one JSON object per line, the first line is BZDATA_HEADER.
+#   {"value": name, "data": value}
+#   {"search": params as JSON, "ids": [bug ids in result order]}
+#   {"bug": bug data}
+# A bug can be on several lines, each with the fields requested at that time.
+# Once the recording is complete, '<file>.index' gets written with the byte
+# offsets of the lines for each node path:
+#   {"values": {name: offset}, "searches": {params: offset}, "bugs": {id: [offsets]}}
+#
+# A replay only keeps the index in memory and reads the lines of a search or bug
+# when they get requested. Without the index file (e.g. the recording got
+# interrupted), the index gets built by reading the file once.
+#
+# Recordings can be converted to compact snapshots (see utils/bzsnapshot.py and
+# bzdata_snapshot.py) which '--bzdata-load' detects by their first bytes.
+#
+# Recordings of older versions of the reports are one JSON object with the bugs
+# and values by node path, e.g. bug_release.py wrote
+#   {"opened": {"nightly": {"data": [bugs]}, "beta": {"data": [bugs]}}}
+# They hold neither the params of the searches nor the values the requests
+# depend on. Searches get answered with the recorded bugs which can match the
+# params (see may_match_query() in utils/bugquery.py), missing values get looked
+# up like the reports did then.
+
+import argparse
+import atexit
+import datetime
+import json
+import os
+import sys
+import threading
+
+from libmozdata.bugzilla import Bugzilla as LibmozdataBugzilla, BugzillaUser
+
+from . import bugzilla as bugzilla_utils
+
+from .bugquery import QueryError, may_match_query, parse_query
+from .bzsnapshot import get_snapshot_bug, get_snapshot_search_ids, is_snapshot, open_snapshot, write_snapshot
+from .checkpoint import CheckpointEncoder, decode_checkpoint_value
+from .workeraccumulator import WorkerAccumulator
+
+BZDATA_MODE_RECORD = 'record'
+BZDATA_MODE_REPLAY = 'replay'
+
+BZDATA_HEADER = {'format': 'bzdata', 'version': 2}
+
+# Format of the times in legacy recordings, e.g. 'date_start' of
+# sec_bug_by_week.py
+BZDATA_LEGACY_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Legacy recordings only requested the fields the reports needed. Searches get
+# answered with 'last_change_time' which no bug can have, so the bug cache
+# replaces the bugs once the reports run against Bugzilla.
+BZDATA_LEGACY_LAST_CHANGE_TIME = '1970-01-01T00:00:00Z'
+
+BZDATA = {
+    'mode': None,
+    'path': None,
+    # Offsets of the lines for each node path.
+    'index': None,
+    # Recording: file the lines get appended to and the fields already written
+    # for each bug.
+    'writer': None,
+    'fields_written': {},
+    # Replay: file the lines get read from or the loaded snapshot, and the
+    # recorded values.
+    'reader': None,
+    'snapshot': None,
+    'values': {},
+    # Legacy recordings and their snapshots: the searches get evaluated
+    # against the bugs, which are in memory for legacy recordings.
+    'legacy': False,
+    'legacy_bugs': None,
+    # Searches of the bug cache: answered from the cached bugs only, and
+    # checking the bugs returned by Bugzilla against the params.
+    'search_cache': False,
+    'verify_searches': False,
+}
+
+# Requests of the bug cache finish on different threads.
+BZDATA_LOCK = threading.Lock()
+
+
+def add_bzdata_arguments(parser):
+    parser.add_argument('--bzdata-load',
+                        nargs='?',
+                        default=argparse.SUPPRESS,
+                        help='Load the Bugzilla data from a local file. If no path is provided '
+                             'the default file of the report in the "data" folder gets loaded.')
+    parser.add_argument('--bzdata-save',
+                        nargs='?',
+                        default=argparse.SUPPRESS,
+                        help='Save the Bugzilla data to a local file. If no path is provided '
+                             'the default file of the report in the "data" folder gets written.')
+    parser.add_argument('--bugzilla-url',
+                        help='Send the requests to another Bugzilla instance, e.g. '
+                             'http://localhost:8080 for bugzilla_server.py')
+    parser.add_argument('--search-cache',
+                        action='store_true',
+                        help='Answer the searches from the bugs in the local bug cache without '
+                             'contacting Bugzilla. Bugs never downloaded are missing.')
+    parser.add_argument('--verify-searches',
+                        action='store_true',
+                        help='Check the bugs found by Bugzilla against the search params and '
+                             'log the bugs which don\'t match.')
+
+
+def init_bzdata(args, default_path):
+    """Sets up recording or replay as requested by the command line arguments"""
+    if args.bugzilla_url:
+        set_bugzilla_url(args.bugzilla_url)
+    # Replays answer the searches from the recording.
+    BZDATA['search_cache'] = args.search_cache and 'bzdata_load' not in args
+    BZDATA['verify_searches'] = args.verify_searches
+    if 'bzdata_load' in args:
+        load_bzdata(args.bzdata_load if args.bzdata_load else default_path)
+        print(f"Loaded Bugzilla data from {BZDATA['path']}")
+    elif 'bzdata_save' in args:
+        BZDATA['mode'] = BZDATA_MODE_RECORD
+        BZDATA['path'] = args.bzdata_save if args.bzdata_save else default_path
+        BZDATA['writer'] = open(BZDATA['path'], 'wb')
+        # The index of an earlier recording doesn't match the new file.
+        if os.path.exists(BZDATA['path'] + '.index'):
+            os.remove(BZDATA['path'] + '.index')
+        BZDATA['index'] = {
+            'values': {},
+            'searches': {},
+            'bugs': {},
+        }
+        BZDATA['writer'].write(encode_line(BZDATA_HEADER))
+        atexit.register(finish_bzdata)
+
+
+def set_bugzilla_url(url):
+    """Sends the requests of libmozdata and utils/bugzilla.py to the instance at the url"""
+    url = url.rstrip('/')
+    LibmozdataBugzilla.URL = url
+    LibmozdataBugzilla.API_URL = url + '/rest/bug'
+    LibmozdataBugzilla.ATTACHMENT_API_URL = LibmozdataBugzilla.API_URL + '/attachment'
+    BugzillaUser.URL = url
+    BugzillaUser.API_URL = url + '/rest/user'
+    bugzilla_utils.BUGZILLA_CONFIG_URL = url + '/rest/configuration'
+
+
+def load_bzdata(path):
+    """Replays the requests from the recording or snapshot at the path"""
+    BZDATA['mode'] = BZDATA_MODE_REPLAY
+    BZDATA['path'] = path
+    if is_snapshot(BZDATA['path']):
+        BZDATA['snapshot'] = open_snapshot(BZDATA['path'])
+        if BZDATA['snapshot'] is None:
+            sys.exit(f"{BZDATA['path']} is not in the current snapshot format, convert the recording again")
+        BZDATA['values'] = BZDATA['snapshot']['values']
+        BZDATA['legacy'] = BZDATA['snapshot']['legacy']
+        return
+    BZDATA['reader'] = open(BZDATA['path'], 'rb')
+    header = json.loads(BZDATA['reader'].readline())
+    if header != BZDATA_HEADER:
+        if not is_legacy_recording(header):
+            sys.exit(f"{BZDATA['path']} is not in a known Bugzilla data format, record it again with --bzdata-save")
+        # Legacy recordings are written on one line.
+        legacy = read_legacy_recording(header)
+        BZDATA['values'] = legacy['values']
+        BZDATA['legacy'] = True
+        BZDATA['legacy_bugs'] = legacy['bugs']
+        return
+    if os.path.exists(BZDATA['path'] + '.index'):
+        with open(BZDATA['path'] + '.index', 'r') as index_reader:
+            BZDATA['index'] = json.load(index_reader)
+    else:
+        BZDATA['index'] = build_index(BZDATA['reader'])
+    for name, offset in BZDATA['index']['values'].items():
+        BZDATA['values'][name] = read_line(offset)['data']
+
+
+def is_legacy_recording(data):
+    return isinstance(data, dict) and 'format' not in data and all(isinstance(node, dict) for node in data.values())
+
+
+def decode_legacy_value(value):
+    try:
+        return datetime.datetime.strptime(value, BZDATA_LEGACY_TIME_FORMAT).replace(tzinfo=datetime.timezone.utc)
+    except (TypeError, ValueError):
+        return value
+
+
+def read_legacy_recording(data):
+    """
+    Bugs and values of a legacy recording. The nodes hold the data as list,
+    bugs of all nodes get collected and the other data is a value named after
+    its node, e.g. {"date_start": {"data": ["2022-01-01T00:00:00Z"]}}.
+    """
+    legacy = {
+        'values': {},
+        'bugs': {},
+    }
+    nodes = [([name], node) for name, node in data.items()]
+    while nodes:
+        node_path, node = nodes.pop()
+        for name, child in node.items():
+            if name != 'data':
+                nodes.append((node_path + [name], child))
+                continue
+            for item in child:
+                if isinstance(item, dict) and 'id' in item:
+                    bug_data = legacy['bugs'].setdefault(str(item['id']), {})
+                    bug_data.update(item)
+                    bug_data.setdefault('last_change_time', BZDATA_LEGACY_LAST_CHANGE_TIME)
+                else:
+                    legacy['values']['.'.join(node_path)] = decode_legacy_value(item)
+    return legacy
+
+
+def get_legacy_search_ids(params):
+    """Ids of the bugs in the legacy recording which can match the params"""
+    try:
+        query = parse_query(params)
+    except QueryError as error:
+        sys.exit(f"Search {get_search_key(params)} can't be answered from the legacy Bugzilla data in {BZDATA['path']}: {error}")
+    return [bug_id for bug_id in get_recorded_bug_ids() if may_match_query(query, get_recorded_bug(bug_id))]
+
+
+def build_index(reader):
+    index = {
+        'values': {},
+        'searches': {},
+        'bugs': {},
+    }
+    while True:
+        offset = reader.tell()
+        line = reader.readline()
+        if not line:
+            break
+        if not line.endswith(b'\n'):
+            # Last line of an interrupted recording.
+            break
+        record = json.loads(line)
+        if 'value' in record:
+            index['values'][record['value']] = offset
+        elif 'search' in record:
+            index['searches'][record['search']] = offset
+        elif 'bug' in record:
+            index['bugs'].setdefault(str(record['bug']['id']), []).append(offset)
+    return index
+
+
+def read_line(offset):
+    with BZDATA_LOCK:
+        BZDATA['reader'].seek(offset)
+        line = BZDATA['reader'].readline()
+    return json.loads(line, object_hook=decode_checkpoint_value)
+
+
+def has_recorded_bug(bug_id):
+    if BZDATA['snapshot'] is not None:
+        return bug_id in BZDATA['snapshot']['index']['bugs']
+    if BZDATA['legacy_bugs'] is not None:
+        return bug_id in BZDATA['legacy_bugs']
+    return bug_id in BZDATA['index']['bugs']
+
+
+def get_recorded_bug(bug_id):
+    """Bug data with the fields of all lines recorded for the bug"""
+    if BZDATA['snapshot'] is not None:
+        return get_snapshot_bug(BZDATA['snapshot'], bug_id)
+    if BZDATA['legacy_bugs'] is not None:
+        return dict(BZDATA['legacy_bugs'][bug_id])
+    bug_data = {}
+    for offset in BZDATA['index']['bugs'][bug_id]:
+        bug_data.update(read_line(offset)['bug'])
+    return bug_data
+
+
+def encode_line(record):
+    return (json.dumps(record, cls=CheckpointEncoder) + '\n').encode('utf-8')
+
+
+def write_line(line):
+    """Appends the encoded line, returns its offset. Has to be called with the lock held."""
+    offset = BZDATA['writer'].tell()
+    BZDATA['writer'].write(line)
+    return offset
+
+
+def finish_bzdata():
+    with BZDATA_LOCK:
+        BZDATA['writer'].close()
+        with open(BZDATA['path'] + '.index', 'w') as index_writer:
+            json.dump(BZDATA['index'], index_writer)
+    print(f"Saved Bugzilla data to {BZDATA['path']}")
+
+
+def recorded_value(name, get_value):
+    """
+    Returns get_value(), or the value recorded with this name when replaying
+    (get_value doesn't get called then, e.g. to not look up release dates).
+    """
+    if BZDATA['mode'] == BZDATA_MODE_REPLAY:
+        if name not in BZDATA['values'] and BZDATA['legacy']:
+            # E.g. the release dates, looked up again by older reports.
+            return get_value()
+        if name not in BZDATA['values']:
+            sys.exit(f"No value '{name}' in the Bugzilla data loaded from {BZDATA['path']}")
+        return BZDATA['values'][name]
+    value = get_value()
+    if BZDATA['mode'] == BZDATA_MODE_RECORD:
+        line = encode_line({'value': name, 'data': value})
+        with BZDATA_LOCK:
+            BZDATA['index']['values'][name] = write_line(line)
+    return value
+
+
+def record_bug(bug_data):
+    """Records bug data which a report got, e.g. from the bug cache"""
+    if BZDATA['mode'] != BZDATA_MODE_RECORD:
+        return
+    bug_id = str(bug_data['id'])
+    with BZDATA_LOCK:
+        # Bugs get served for many searches, only write fields not written yet.
+        fields_written = BZDATA['fields_written'].setdefault(bug_id, set())
+        if set(bug_data.keys()) <= fields_written:
+            return
+        fields_written |= set(bug_data.keys())
+    # Encoding the bug with its history takes longer than writing it.
+    line = encode_line({'bug': bug_data})
+    with BZDATA_LOCK:
+        BZDATA['index']['bugs'].setdefault(bug_id, []).append(write_line(line))
+
+
+def get_search_key(params):
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def get_requested_ids(params):
+    bug_ids = params['id']
+    if isinstance(bug_ids, str):
+        bug_ids = bug_ids.split(',')
+    return [str(bug_id).strip() for bug_id in bug_ids]
+
+
+def filter_fields(bug_data, fields):
+    if isinstance(fields, str):
+        fields = [fields]
+    if any(field.startswith('_') for field in fields):
+        # Field groups like '_custom' can't be mapped to the field names.
+        return bug_data
+    return {field: value for field, value in bug_data.items() if field in fields}
+
+
+class Bugzilla(object):
+    """
+    Replacement for libmozdata's Bugzilla class which records the bugs
+    returned or replays them, see the top of this file. Without '--bzdata-save'
+    and '--bzdata-load' the request is passed on to libmozdata.
+    """
+
+    def __init__(self, params, bughandler, bugdata=None, timeout=960):
+        self.params = params
+        self.bughandler = bughandler
+        self.bugdata = bugdata
+        self.timeout = timeout
+        self.connection = None
+        self.results = None
+
+    def call_bughandler(self, bug_data):
+        if self.bugdata is None:
+            self.bughandler(bug_data)
+        else:
+            self.bughandler(bug_data, self.bugdata)
+
+    def record_bughandler(self, bug_data, *bugdata):
+        # Written before the handler can modify the bug data, only the ids are
+        # kept until the request finished.
+        record_bug(bug_data)
+        self.results.add(bug_data['id'], bug_data['id'])
+        self.bughandler(bug_data, *bugdata)
+
+    def get_data(self):
+        if BZDATA['mode'] == BZDATA_MODE_REPLAY:
+            return self
+        bughandler = self.bughandler
+        if BZDATA['mode'] == BZDATA_MODE_RECORD:
+            self.results = WorkerAccumulator()
+            bughandler = self.record_bughandler
+        self.connection = LibmozdataBugzilla(self.params,
+                                             bughandler=bughandler,
+                                             bugdata=self.bugdata,
+                                             timeout=self.timeout).get_data()
+        return self
+
+    def wait(self):
+        if BZDATA['mode'] == BZDATA_MODE_REPLAY:
+            self.replay()
+            return self
+        if self.connection is None:
+            self.get_data()
+        self.connection.wait()
+        if BZDATA['mode'] == BZDATA_MODE_RECORD:
+            self.record()
+        return self
+
+    def record(self):
+        if 'id' not in self.params:
+            record_search(self.params, self.results.get_items(unique=True))
+
+    def replay(self):
+        for bug_data in get_recorded_results(self.params):
+            self.call_bughandler(bug_data)
+
+
+def record_search(params, bug_ids):
+    search_key = get_search_key(params)
+    line = encode_line({'search': search_key, 'ids': bug_ids})
+    with BZDATA_LOCK:
+        BZDATA['index']['searches'][search_key] = write_line(line)
+
+
+def get_recorded_search_ids(search_key):
+    if BZDATA['snapshot'] is not None:
+        return get_snapshot_search_ids(BZDATA['snapshot'], search_key)
+    if search_key not in BZDATA['index']['searches']:
+        return None
+    return read_line(BZDATA['index']['searches'][search_key])['ids']
+
+
+def get_recorded_results(params):
+    """Yields the bugs recorded for the request, read from the file one by one"""
+    if 'id' in params:
+        # Requests by bug id can be answered with the bugs recorded for any
+        # request, the batches of the bug cache can differ between runs.
+        bug_ids = [bug_id for bug_id in get_requested_ids(params) if has_recorded_bug(bug_id)]
+    elif BZDATA['legacy']:
+        bug_ids = get_legacy_search_ids(params)
+    else:
+        search_key = get_search_key(params)
+        search_ids = get_recorded_search_ids(search_key)
+        if search_ids is None:
+            sys.exit(f"No recorded Bugzilla data for search {search_key}")
+        bug_ids = [str(bug_id) for bug_id in search_ids]
+    fields = params.get('include_fields', '_default')
+    for bug_id in bug_ids:
+        yield filter_fields(get_recorded_bug(bug_id), fields)
+
+
+def recorded_search(params, search):
+    """
+    Returns the bugs found by search(), recorded under the params. For searches
+    split into several requests whose params can differ between runs, e.g.
+    windows of adaptive size.
+    """
+    if BZDATA['mode'] == BZDATA_MODE_REPLAY:
+        return list(get_recorded_results(params))
+    bugs_data = search()
+    if BZDATA['mode'] == BZDATA_MODE_RECORD:
+        for bug_data in bugs_data:
+            record_bug(bug_data)
+        record_search(params, [bug_data['id'] for bug_data in bugs_data])
+    return bugs_data
+
+
+def get_recorded_bug_ids():
+    """Ids of all loaded bugs, ordered"""
+    if BZDATA['snapshot'] is not None:
+        bug_ids = BZDATA['snapshot']['index']['bugs']
+    elif BZDATA['legacy_bugs'] is not None:
+        bug_ids = BZDATA['legacy_bugs']
+    else:
+        bug_ids = BZDATA['index']['bugs']
+    return sorted(bug_ids, key=int)
+
+
+def save_bzdata_snapshot(path):
+    """Writes the loaded Bugzilla data as a snapshot, see utils/bzsnapshot.py"""
+    if BZDATA['legacy']:
+        searches = {}
+    elif BZDATA['snapshot'] is not None:
+        searches = {search_key: get_snapshot_search_ids(BZDATA['snapshot'], search_key)
+                    for search_key in BZDATA['snapshot']['index']['searches']}
+    else:
+        searches = {search_key: read_line(offset)['ids'] for search_key, offset in BZDATA['index']['searches'].items()}
+    # Read one bug at a time while writing.
+    bugs = ((bug_id, get_recorded_bug(bug_id)) for bug_id in get_recorded_bug_ids())
+    write_snapshot(path, BZDATA['values'], searches, bugs, legacy=BZDATA['legacy'])
@@ -0,0 +1,422 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Compact snapshots of recorded Bugzilla data (see utils/bzdata.py) for keeping
+# many of them. The JSON lines of a recording repeat field names like
+# 'field_name', 'added', 'removed' and 'when', user names, field values and
+# timestamps for every history change.
+#
+# File format: SNAPSHOT_MAGIC, the JSON line SNAPSHOT_HEADER and then records of
+# a JSON line and the data it announces:
+#   {"value": name, "size": bytes}               data: value as JSON
+#   {"search": params as JSON, "size": bytes}    data: tokens of [bug ids]
+#   {"bug": id, "size": bytes}                   data: tokens of bug data
+#   {"strings": count, "size": bytes}            data: string table
+#   {"keys": count, "size": bytes}               data: key table
+# The bugs and search results are stored as zlib compressed little-endian
+# unsigned 32-bit tokens, see encode_value(). Each string, e.g. a user name or a
+# field value, is stored once in the string table of the snapshot and the
+# tokens refer to its position. The same is done for the keys of dicts, e.g.
+# ('when', 'who', 'changes'). Timestamps like '2023-01-31T12:34:56Z' are stored
+# as seconds since 1970. The tables are written last (strings get added while
+# the bugs get written) and are read when the snapshot gets opened:
+#   strings: count + 1 token offsets of the strings in the UTF-8 text, the text
+#   keys: for each dict keys, the count and the string positions of the keys
+# Like for recordings, '<file>.index' holds the byte offsets of the records:
+#   {"values": {name: offset}, "searches": {params: offset},
+#    "bugs": {id: offset}, "strings": offset, "keys": offset}
+# and gets built by reading the file once if it's missing. A replay keeps the
+# index, the values and the tables in memory and reads a bug when it gets
+# requested.
+#
+# Snapshots of legacy recordings (see read_legacy_recording() in
+# utils/bzdata.py) have no searches and "legacy": true in the header.
+
+import array
+import calendar
+import itertools
+import json
+import re
+import sys
+import threading
+import time
+import zlib
+
+from .checkpoint import CheckpointEncoder, decode_checkpoint_value
+
+SNAPSHOT_MAGIC = b'BZSNAPSHOT\n'
+SNAPSHOT_FORMAT = 'bzsnapshot'
+SNAPSHOT_VERSION = 3
+
+SNAPSHOT_COMPRESSION_LEVEL = 6
+
+# Tokens: the lowest TOKEN_TAG_BITS are the type, the others the payload.
+TOKEN_TAG_BITS = 4
+TOKEN_TAG_MASK = (1 << TOKEN_TAG_BITS) - 1
+TOKEN_PAYLOAD_MAX = (1 << (32 - TOKEN_TAG_BITS)) - 1
+# payload: position in the string table
+TAG_STRING = 0
+# payload: the integer
+TAG_INT = 1
+# payload: position in the key table, followed by the tokens of the values
+TAG_DICT = 2
+# payload: item count, followed by the tokens of the items
+TAG_LIST = 3
+# payload: position in CONSTANTS
+TAG_CONSTANT = 4
+# followed by a token with the seconds since 1970
+TAG_TIMESTAMP = 5
+# payload: position in the string table of the value as JSON, e.g. for floats
+TAG_JSON = 6
+# Lists of values of one type, they get decoded without looking at each item:
+# payload: item count, followed by the string positions
+TAG_STRINGS = 7
+# payload: item count, followed by the seconds since 1970
+TAG_TIMESTAMPS = 8
+# payload: item count, followed by the integers
+TAG_INTS = 9
+# Lists of dicts with the same keys, e.g. the history of a bug:
+# payload: item count, followed by a token with the position in the key table
+# and for each key the list of its values
+TAG_ROWS = 10
+# Lists of lists, e.g. the changes of the history items:
+# payload: item count, followed by the lengths of the lists and the list of
+# all their items
+TAG_LISTS = 11
+
+CONSTANTS = (None, False, True)
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+TIMESTAMP_PATTERN = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)Z')
+
+INDEX_KINDS = {
+    'value': 'values',
+    'search': 'searches',
+    'bug': 'bugs',
+}
+
+
+def is_snapshot(path):
+    with open(path, 'rb') as snapshot_reader:
+        return snapshot_reader.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+def format_timestamp(seconds):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds))
+
+
+def get_timestamp_seconds(string):
+    """Seconds since 1970 of a Bugzilla timestamp, None for other strings"""
+    match = TIMESTAMP_PATTERN.fullmatch(string)
+    if not match:
+        return None
+    seconds = calendar.timegm([int(part) for part in match.groups()])
+    # Skip invalid dates like '2023-02-31T00:00:00Z' which don't round-trip.
+    if not 0 <= seconds <= 0xFFFFFFFF or format_timestamp(seconds) != string:
+        return None
+    return seconds
+
+
+def pack_tokens(tokens):
+    token_array = array.array('I', tokens)
+    if sys.byteorder == 'big':
+        token_array.byteswap()
+    return token_array.tobytes()
+
+
+def unpack_tokens(data):
+    token_array = array.array('I')
+    token_array.frombytes(data)
+    if sys.byteorder == 'big':
+        token_array.byteswap()
+    return token_array
+
+
+class TimestampStrings(dict):
+    """Timestamp strings by seconds since 1970, formatted when first used"""
+
+    def __missing__(self, seconds):
+        string = format_timestamp(seconds)
+        self[seconds] = string
+        return string
+
+
+def get_table_pos(table, key):
+    if key not in table:
+        table[key] = len(table)
+    return table[key]
+
+
+def encode_value(value, tables, tokens):
+    """
+    Appends the tokens of the value to the list, new strings and dict keys get
+    added to the tables
+    """
+    if isinstance(value, str):
+        seconds = get_timestamp_seconds(value)
+        if seconds is None:
+            tokens.append(get_table_pos(tables['strings'], value) << TOKEN_TAG_BITS | TAG_STRING)
+        else:
+            tokens.append(TAG_TIMESTAMP)
+            tokens.append(seconds)
+    elif value is None or isinstance(value, bool):
+        tokens.append(CONSTANTS.index(value) << TOKEN_TAG_BITS | TAG_CONSTANT)
+    elif isinstance(value, int) and 0 <= value <= TOKEN_PAYLOAD_MAX:
+        tokens.append(value << TOKEN_TAG_BITS | TAG_INT)
+    elif isinstance(value, dict) and all(isinstance(key, str) for key in value):
+        keys = tuple(get_table_pos(tables['strings'], key) for key in value)
+        tokens.append(get_table_pos(tables['keys'], keys) << TOKEN_TAG_BITS | TAG_DICT)
+        for item in value.values():
+            encode_value(item, tables, tokens)
+    elif isinstance(value, list) and len(value) <= TOKEN_PAYLOAD_MAX:
+        encode_list(value, tables, tokens)
+    else:
+        text = json.dumps(value, cls=CheckpointEncoder, separators=(',', ':'))
+        tokens.append(get_table_pos(tables['strings'], text) << TOKEN_TAG_BITS | TAG_JSON)
+
+
+def encode_list(items, tables, tokens):
+    count = len(items)
+    if count and all(isinstance(item, str) for item in items):
+        timestamps = [get_timestamp_seconds(item) for item in items]
+        if None not in timestamps:
+            tokens.append(count << TOKEN_TAG_BITS | TAG_TIMESTAMPS)
+            tokens.extend(timestamps)
+        else:
+            tokens.append(count << TOKEN_TAG_BITS | TAG_STRINGS)
+            tokens.extend(get_table_pos(tables['strings'], item) for item in items)
+    elif count and all(type(item) is int and 0 <= item <= 0xFFFFFFFF for item in items):
+        tokens.append(count << TOKEN_TAG_BITS | TAG_INTS)
+        tokens.extend(items)
+    elif count > 1 and isinstance(items[0], dict) and items[0] and all(isinstance(key, str) for key in items[0]) and \
+            all(isinstance(item, dict) and list(item) == list(items[0]) for item in items):
+        keys = tuple(get_table_pos(tables['strings'], key) for key in items[0])
+        tokens.append(count << TOKEN_TAG_BITS | TAG_ROWS)
+        tokens.append(get_table_pos(tables['keys'], keys))
+        for key in items[0]:
+            encode_list([item[key] for item in items], tables, tokens)
+    elif count > 1 and all(isinstance(item, list) for item in items) and sum(len(item) for item in items) <= TOKEN_PAYLOAD_MAX:
+        tokens.append(count << TOKEN_TAG_BITS | TAG_LISTS)
+        tokens.extend(len(item) for item in items)
+        encode_list([subitem for item in items for subitem in item], tables, tokens)
+    else:
+        tokens.append(count << TOKEN_TAG_BITS | TAG_LIST)
+        for item in items:
+            encode_value(item, tables, tokens)
+
+
+def encode_data(data, tables):
+    tokens = []
+    encode_value(data, tables, tokens)
+    return zlib.compress(pack_tokens(tokens), SNAPSHOT_COMPRESSION_LEVEL)
+
+
+def build_rows(keys, columns):
+    """Dicts of the keys and the values in the columns, one for each row"""
+    # Dict displays are faster than dict(zip()), e.g. the history items and
+    # their changes have 3 keys.
+    if len(keys) == 3:
+        key_0, key_1, key_2 = keys
+        return [{key_0: value_0, key_1: value_1, key_2: value_2} for value_0, value_1, value_2 in zip(*columns)]
+    if len(keys) == 2:
+        key_0, key_1 = keys
+        return [{key_0: value_0, key_1: value_1} for value_0, value_1 in zip(*columns)]
+    return list(map(dict, map(zip, itertools.repeat(keys), zip(*columns))))
+
+
+def decode_data(snapshot, compressed):
+    strings = snapshot['strings']
+    keys_table = snapshot['keys']
+    timestamps = snapshot['timestamps']
+    tokens = iter(unpack_tokens(zlib.decompress(compressed)))
+    next_token = tokens.__next__
+
+    def decode_value():
+        token = next_token()
+        tag = token & TOKEN_TAG_MASK
+        if tag == TAG_STRING:
+            return strings[token >> TOKEN_TAG_BITS]
+        if tag == TAG_STRINGS:
+            return list(map(strings.__getitem__, itertools.islice(tokens, token >> TOKEN_TAG_BITS)))
+        if tag == TAG_ROWS:
+            keys = keys_table[next_token()]
+            return build_rows(keys, [decode_value() for key in keys])
+        if tag == TAG_LISTS:
+            ends = list(itertools.accumulate(itertools.islice(tokens, token >> TOKEN_TAG_BITS)))
+            items = decode_value()
+            return [items[start:end] for start, end in zip([0] + ends, ends)]
+        if tag == TAG_TIMESTAMPS:
+            return list(map(timestamps.__getitem__, itertools.islice(tokens, token >> TOKEN_TAG_BITS)))
+        if tag == TAG_DICT:
+            return {key: decode_value() for key in keys_table[token >> TOKEN_TAG_BITS]}
+        if tag == TAG_TIMESTAMP:
+            return timestamps[next_token()]
+        if tag == TAG_INTS:
+            return list(itertools.islice(tokens, token >> TOKEN_TAG_BITS))
+        if tag == TAG_LIST:
+            return [decode_value() for pos in range(token >> TOKEN_TAG_BITS)]
+        if tag == TAG_INT:
+            return token >> TOKEN_TAG_BITS
+        if tag == TAG_CONSTANT:
+            return CONSTANTS[token >> TOKEN_TAG_BITS]
+        return json.loads(strings[token >> TOKEN_TAG_BITS], object_hook=decode_checkpoint_value)
+
+    return decode_value()
+
+
+def encode_strings(strings):
+    offsets = [0]
+    for string in strings:
+        offsets.append(offsets[-1] + len(string))
+    return zlib.compress(pack_tokens(offsets) + ''.join(strings).encode('utf-8'), SNAPSHOT_COMPRESSION_LEVEL)
+
+
+def decode_strings(count, compressed):
+    data = zlib.decompress(compressed)
+    offsets = unpack_tokens(data[:(count + 1) * 4])
+    text = data[(count + 1) * 4:].decode('utf-8')
+    return [text[offsets[pos]:offsets[pos + 1]] for pos in range(count)]
+
+
+def encode_keys(keys_table):
+    tokens = []
+    for keys in keys_table:
+        tokens.append(len(keys))
+        tokens.extend(keys)
+    return zlib.compress(pack_tokens(tokens), SNAPSHOT_COMPRESSION_LEVEL)
+
+
+def decode_keys(count, compressed, strings):
+    tokens = unpack_tokens(zlib.decompress(compressed))
+    keys_table = []
+    pos = 0
+    for keys_pos in range(count):
+        keys_table.append(tuple(strings[string_pos] for string_pos in tokens[pos + 1:pos + 1 + tokens[pos]]))
+        pos += 1 + tokens[pos]
+    return keys_table
+
+
+def write_snapshot(path, values, searches, bugs, legacy=False):
+    """
+    Writes the recorded values, search results (bug ids by params as JSON) and
+    bugs, an iterable of (id, bug data) which gets written as it's read
+    """
+    index = {
+        'values': {},
+        'searches': {},
+        'bugs': {},
+    }
+    tables = {
+        'strings': {},
+        'keys': {},
+    }
+
+    def write_record(record, data):
+        snapshot_writer.write((json.dumps(dict(record, size=len(data))) + '\n').encode('utf-8'))
+        snapshot_writer.write(data)
+
+    with open(path, 'wb') as snapshot_writer:
+        snapshot_writer.write(SNAPSHOT_MAGIC)
+        snapshot_writer.write((json.dumps({
+            'format': SNAPSHOT_FORMAT,
+            'version': SNAPSHOT_VERSION,
+            'legacy': legacy,
+        }) + '\n').encode('utf-8'))
+        for name, value in values.items():
+            index['values'][name] = snapshot_writer.tell()
+            write_record({'value': name}, json.dumps(value, cls=CheckpointEncoder).encode('utf-8'))
+        for search_key, bug_ids in searches.items():
+            index['searches'][search_key] = snapshot_writer.tell()
+            write_record({'search': search_key}, encode_data(bug_ids, tables))
+        for bug_id, bug_data in bugs:
+            index['bugs'][str(bug_id)] = snapshot_writer.tell()
+            write_record({'bug': str(bug_id)}, encode_data(bug_data, tables))
+        index['strings'] = snapshot_writer.tell()
+        write_record({'strings': len(tables['strings'])}, encode_strings(list(tables['strings'])))
+        index['keys'] = snapshot_writer.tell()
+        write_record({'keys': len(tables['keys'])}, encode_keys(list(tables['keys'])))
+    with open(path + '.index', 'w') as index_writer:
+        json.dump(index, index_writer)
+
+
+def build_snapshot_index(reader):
+    index = {
+        'values': {},
+        'searches': {},
+        'bugs': {},
+    }
+    while True:
+        offset = reader.tell()
+        line = reader.readline()
+        if not line:
+            break
+        record = json.loads(line)
+        for kind, index_name in INDEX_KINDS.items():
+            if kind in record:
+                index[index_name][record[kind]] = offset
+        for table_name in ['strings', 'keys']:
+            if table_name in record:
+                index[table_name] = offset
+        reader.seek(record['size'], 1)
+    return index
+
+
+def read_record_data(snapshot, offset):
+    """Returns the record line and its data"""
+    with snapshot['lock']:
+        snapshot['reader'].seek(offset)
+        record = json.loads(snapshot['reader'].readline())
+        data = snapshot['reader'].read(record['size'])
+    return record, data
+
+
+def open_snapshot(path):
+    """
+    Returns the snapshot with its index, values and tables, None if it isn't in
+    the current format. Read the bugs and searches with get_snapshot_bug() and
+    get_snapshot_search_ids().
+    """
+    reader = open(path, 'rb')
+    reader.read(len(SNAPSHOT_MAGIC))
+    try:
+        header = json.loads(reader.readline())
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('format') != SNAPSHOT_FORMAT or header.get('version') != SNAPSHOT_VERSION:
+        reader.close()
+        return None
+    snapshot = {
+        'reader': reader,
+        'lock': threading.Lock(),
+        'legacy': header['legacy'],
+        'values': {},
+        # Shared by the bugs read
+        'timestamps': TimestampStrings(),
+    }
+    try:
+        with open(path + '.index', 'r') as index_reader:
+            snapshot['index'] = json.load(index_reader)
+    except FileNotFoundError:
+        snapshot['index'] = build_snapshot_index(reader)
+    for name, offset in snapshot['index']['values'].items():
+        record, data = read_record_data(snapshot, offset)
+        snapshot['values'][name] = json.loads(data, object_hook=decode_checkpoint_value)
+    record, data = read_record_data(snapshot, snapshot['index']['strings'])
+    snapshot['strings'] = decode_strings(record['strings'], data)
+    record, data = read_record_data(snapshot, snapshot['index']['keys'])
+    snapshot['keys'] = decode_keys(record['keys'], data, snapshot['strings'])
+    return snapshot
+
+
+def get_snapshot_bug(snapshot, bug_id):
+    """Bug data as returned by Bugzilla, a new copy on every call"""
+    record, data = read_record_data(snapshot, snapshot['index']['bugs'][bug_id])
+    return decode_data(snapshot, data)
+
+
+def get_snapshot_search_ids(snapshot, search_key):
+    if search_key not in snapshot['index']['searches']:
+        return None
+    record, data = read_record_data(snapshot, snapshot['index']['searches'][search_key])
+    return decode_data(snapshot, data)
@@ -0,0 +1,96 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Results of long running reports get stored in the 'data' folder after each
+# completed step (e.g. a time interval). A run started with '--resume' skips
+# the steps stored by an earlier run with the same arguments. The downloaded
+# bug records are kept by the bug cache (utils/bugcache.py), so repeating the
+# searches of the unfinished steps only downloads bugs which changed.
+
+import copy
+import datetime
+import json
+import os
+
+CHECKPOINT_PATH = 'data/{}_checkpoint.json'
+
+
+class CheckpointEncoder(json.JSONEncoder):
+
+    def default(self, value):
+        if isinstance(value, datetime.datetime):
+            return {'__datetime__': value.isoformat()}
+        if isinstance(value, datetime.date):
+            return {'__date__': value.isoformat()}
+        return super().default(value)
+
+
+def decode_checkpoint_value(value):
+    if '__datetime__' in value:
+        return datetime.datetime.fromisoformat(value['__datetime__'])
+    if '__date__' in value:
+        return datetime.date.fromisoformat(value['__date__'])
+    return value
+
+
+class Checkpoint(object):
+    """
+    Completed steps of a report run. 'run' describes the arguments of the run
+    (e.g. the time intervals); steps stored for other arguments get discarded.
+    Without 'resume', all steps run again.
+    """
+
+    def __init__(self, name, run, resume=False):
+        self.path = CHECKPOINT_PATH.format(name)
+        # Compare the arguments in their stored form.
+        self.run = json.loads(json.dumps(run, cls=CheckpointEncoder))
+        self.steps = {}
+        if resume and os.path.exists(self.path):
+            with open(self.path, 'r') as checkpoint_reader:
+                checkpoint_text = checkpoint_reader.read()
+            if json.loads(checkpoint_text)['run'] == self.run:
+                self.steps = json.loads(checkpoint_text, object_hook=decode_checkpoint_value)['steps']
+            else:
+                print(f"Ignoring {self.path}, it got created for other arguments")
+
+    def has(self, step):
+        return step in self.steps
+
+    def get(self, step):
+        return copy.deepcopy(self.steps[step])
+
+    def set(self, step, value):
+        # Later changes of the report data must not alter the stored step.
+        self.steps[step] = copy.deepcopy(value)
+        # Replace the file at once, an interrupted write must not lose the
+        # steps stored before.
+        path_new = self.path + '.new'
+        with open(path_new, 'w') as checkpoint_writer:
+            json.dump({'run': self.run, 'steps': self.steps}, checkpoint_writer, cls=CheckpointEncoder)
+        os.replace(path_new, self.path)
+
+    def run_step(self, step, function, *args, table=None):
+        """
+        Returns the stored result of the step or calls function(*args) and
+        stores its result. Rows the function appends to 'table' (e.g. the pivot
+        table of BugCollector) get stored with the result and appended again
+        when the step gets skipped.
+        """
+        if self.has(step):
+            result = self.get(step)
+            if table is not None:
+                table.extend(result['table'])
+            return result['data']
+        table_length = len(table) if table is not None else 0
+        data = function(*args)
+        self.set(step, {
+            'data': data,
+            'table': table[table_length:] if table is not None else None,
+        })
+        return data
+
+    def remove(self):
+        """Called once the report got written, the next run starts anew."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
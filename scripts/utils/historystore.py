@@ -0,0 +1,200 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Columnar store of the bug histories in the bug cache (see utils/bugcache.py)
+# for analyses over many releases. The changes of a bug are grouped by field,
+# the changes of one field of one bug are consecutive rows ordered by time:
+#   change_days         day of the change, days since the epoch (int32)
+#   change_removed      string id of the removed value (int32)
+#   change_added        string id of the added value (int32)
+# A run is the rows of one field of one bug, the runs of a bug are ordered by
+# field id:
+#   run_fields          field id (int32)
+#   run_row_starts      first row of the run, one more entry for the end (int64)
+# and per bug, ordered by bug id:
+#   bug_ids             bug id (int64)
+#   bug_last_changes    last_change_time of the stored state (int64)
+#   bug_run_starts      first run of the bug, one more entry for the end (int64)
+# Each column is a file of native machine integers which gets memory mapped,
+# only the pages read stay in memory. The field names, the values and the
+# layout are in 'meta.json'.
+#
+# The store gets written by history_store.py. For reports opened with
+# open_history_store(), bug searches don't download and load the history of
+# bugs which didn't change since then (see utils/bugcache.py), BugTimeline
+# (utils/bugzilla.py) reads the changes of the fields it needs as slices of
+# the columns.
+
+import array
+import bisect
+import calendar
+import datetime
+import functools
+import json
+import mmap
+import os
+import sys
+import time
+
+HISTORY_STORE_PATH = 'data/history_store'
+HISTORY_STORE_VERSION = 2
+
+HISTORY_STORE_COLUMNS = {
+    'change_days': 'i',
+    'change_removed': 'i',
+    'change_added': 'i',
+    'run_fields': 'i',
+    'run_row_starts': 'q',
+    'bug_ids': 'q',
+    'bug_last_changes': 'q',
+    'bug_run_starts': 'q',
+}
+
+# Format of Bugzilla's timestamps, see utils/bugzilla.py
+HISTORY_STORE_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+HISTORY_STORE = None
+
+
+def get_timestamp(bugzilla_time):
+    return calendar.timegm(time.strptime(bugzilla_time, HISTORY_STORE_TIME_FORMAT))
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def get_date(day):
+    """Date of the day since the epoch, like parse_bugzilla_date() in utils/bugzilla.py"""
+    return datetime.date(1970, 1, 1) + datetime.timedelta(days=day)
+
+
+def write_history_store(bugs, path=HISTORY_STORE_PATH):
+    """
+    Writes the histories of the bugs, an iterable of dicts with 'id',
+    'last_change_time' and 'history' ordered by id
+    """
+    columns = {name: array.array(typecode) for name, typecode in HISTORY_STORE_COLUMNS.items()}
+    field_names = []
+    field_ids = {}
+    strings = []
+    string_ids = {}
+
+    def get_string_id(string):
+        if string not in string_ids:
+            string_ids[string] = len(strings)
+            strings.append(string)
+        return string_ids[string]
+
+    for bug_data in bugs:
+        changes_by_field = {}
+        for historyItem in bug_data['history']:
+            change_day = get_timestamp(historyItem['when']) // 86400
+            for change in historyItem['changes']:
+                field = change['field_name']
+                if field not in field_ids:
+                    field_ids[field] = len(field_names)
+                    field_names.append(field)
+                if field_ids[field] not in changes_by_field:
+                    changes_by_field[field_ids[field]] = []
+                changes_by_field[field_ids[field]].append((change_day, get_string_id(change['removed']), get_string_id(change['added'])))
+        columns['bug_ids'].append(bug_data['id'])
+        columns['bug_last_changes'].append(get_timestamp(bug_data['last_change_time']))
+        columns['bug_run_starts'].append(len(columns['run_fields']))
+        for field_id in sorted(changes_by_field):
+            columns['run_fields'].append(field_id)
+            columns['run_row_starts'].append(len(columns['change_days']))
+            for change_day, removed_id, added_id in changes_by_field[field_id]:
+                columns['change_days'].append(change_day)
+                columns['change_removed'].append(removed_id)
+                columns['change_added'].append(added_id)
+    columns['bug_run_starts'].append(len(columns['run_fields']))
+    columns['run_row_starts'].append(len(columns['change_days']))
+
+    os.makedirs(path, exist_ok=True)
+    # Removed first and written last, a store without it is incomplete.
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        os.remove(os.path.join(path, 'meta.json'))
+    for name, column in columns.items():
+        with open(os.path.join(path, name + '.bin'), 'wb') as column_writer:
+            column.tofile(column_writer)
+    with open(os.path.join(path, 'meta.json'), 'w') as meta_writer:
+        json.dump({
+            'version': HISTORY_STORE_VERSION,
+            'byteorder': sys.byteorder,
+            'itemsizes': {name: array.array(typecode).itemsize for name, typecode in HISTORY_STORE_COLUMNS.items()},
+            'bug_count': len(columns['bug_ids']),
+            'change_count': len(columns['change_days']),
+            'field_names': field_names,
+            'strings': strings,
+        }, meta_writer)
+    return len(columns['bug_ids']), len(columns['change_days'])
+
+
+class HistoryStore(object):
+
+    def __init__(self, path=HISTORY_STORE_PATH):
+        with open(os.path.join(path, 'meta.json'), 'r') as meta_reader:
+            meta = json.load(meta_reader)
+        itemsizes = {name: array.array(typecode).itemsize for name, typecode in HISTORY_STORE_COLUMNS.items()}
+        if meta['version'] != HISTORY_STORE_VERSION or meta['byteorder'] != sys.byteorder or meta['itemsizes'] != itemsizes:
+            sys.exit(f"{path} got written by another version or on another machine, write it again with history_store.py")
+        self.field_ids = {field: field_id for field_id, field in enumerate(meta['field_names'])}
+        self.strings = meta['strings']
+        self.maps = []
+        self.columns = {}
+        for name, typecode in HISTORY_STORE_COLUMNS.items():
+            with open(os.path.join(path, name + '.bin'), 'rb') as column_reader:
+                if os.fstat(column_reader.fileno()).st_size == 0:
+                    # Empty files can't be mapped.
+                    self.columns[name] = array.array(typecode)
+                    continue
+                column_map = mmap.mmap(column_reader.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps.append(column_map)
+            self.columns[name] = memoryview(column_map).cast(typecode)
+
+    def get_bug_pos(self, bug_id, last_change_time):
+        """
+        Position of the bug in the store, None if the bug isn't stored or
+        changed after the store got written.
+        """
+        bug_ids = self.columns['bug_ids']
+        pos = bisect.bisect_left(bug_ids, bug_id)
+        if pos == len(bug_ids) or bug_ids[pos] != bug_id:
+            return None
+        if self.columns['bug_last_changes'][pos] != get_timestamp(last_change_time):
+            return None
+        return pos
+
+    def get_field_changes(self, bug_pos, field):
+        """
+        Changes of the field of the bug at the position as dict of the lists
+        'times' (dates), 'removed' and 'added', None if the field never
+        changed.
+        """
+        field_id = self.field_ids.get(field)
+        if field_id is None:
+            return None
+        run_fields = self.columns['run_fields']
+        run_start = self.columns['bug_run_starts'][bug_pos]
+        run_end = self.columns['bug_run_starts'][bug_pos + 1]
+        run_pos = bisect.bisect_left(run_fields, field_id, run_start, run_end)
+        if run_pos == run_end or run_fields[run_pos] != field_id:
+            return None
+        row_start = self.columns['run_row_starts'][run_pos]
+        row_end = self.columns['run_row_starts'][run_pos + 1]
+        return {
+            'times': list(map(get_date, self.columns['change_days'][row_start:row_end].tolist())),
+            'removed': list(map(self.strings.__getitem__, self.columns['change_removed'][row_start:row_end].tolist())),
+            'added': list(map(self.strings.__getitem__, self.columns['change_added'][row_start:row_end].tolist())),
+        }
+
+
+def open_history_store(path=HISTORY_STORE_PATH):
+    """Reads the histories of unchanged bugs from the store from now on"""
+    global HISTORY_STORE
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        sys.exit(f"No history store in {path}, write it with history_store.py")
+    HISTORY_STORE = HistoryStore(path)
+
+
+def get_history_store():
+    return HISTORY_STORE
@@ -0,0 +1,130 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Shared client for the release data of product-details and Buildhub. Reports
+# look up the same data several times (e.g. firefox.json for each release
+# date), it gets downloaded once per process and stored in the 'data' folder
+# for reports run afterwards. The requests use one pooled session, so lookups
+# can run concurrently (see productdates.get_product_dates).
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+import requests.adapters
+
+# Provides the date and time a build was _started_. Publication on the server
+# is done after the build is complete, shipping to the users happens at the
+# same time like publication for Nightly, is one day after the build for beta
+# (after QA has checked the build) and up to a week for release (if the first
+# release candidate has no issues which require a new one).
+BUILDHUB_URL = 'https://buildhub.moz.tools/api/search'
+
+# Currently (2019-09), there is no public API which provides information about
+# the time when a build got shipped, the product details API provides the date.
+PRODUCT_DETAILS_URL = 'https://product-details.mozilla.org/1.0/firefox.json'
+
+PRODUCT_DATA_CACHE_PATH = 'data/product_data'
+
+# Seconds a stored response gets used. New releases get added at most a few
+# times per day.
+PRODUCT_DATA_MAX_AGE = 6 * 60 * 60
+
+PRODUCT_DATA_POOL_SIZE = 4
+
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+# Responses of this process by request key, and a lock per key so concurrent
+# lookups of the same data wait for one download.
+PRODUCT_DATA = {}
+PRODUCT_DATA_LOCKS = {}
+PRODUCT_DATA_LOCK = threading.Lock()
+
+
+class ProductDataError(Exception):
+    """The service kept asking to back off"""
+    pass
+
+
+def get_session():
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is None:
+            SESSION = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=PRODUCT_DATA_POOL_SIZE,
+                                                    pool_maxsize=PRODUCT_DATA_POOL_SIZE)
+            SESSION.mount('https://', adapter)
+            SESSION.mount('http://', adapter)
+    return SESSION
+
+
+def get_request_key(url, body):
+    return hashlib.sha1(json.dumps([url, body], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_stored_response(request_key):
+    path = os.path.join(PRODUCT_DATA_CACHE_PATH, request_key + '.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as response_reader:
+        stored = json.load(response_reader)
+    if time.time() - stored['fetched'] > PRODUCT_DATA_MAX_AGE:
+        return None
+    return stored['data']
+
+
+def store_response(request_key, data):
+    os.makedirs(PRODUCT_DATA_CACHE_PATH, exist_ok=True)
+    path = os.path.join(PRODUCT_DATA_CACHE_PATH, request_key + '.json')
+    # Replace the file at once, other reports might read it.
+    with open(path + '.new', 'w') as response_writer:
+        json.dump({'fetched': time.time(), 'data': data}, response_writer)
+    os.replace(path + '.new', path)
+
+
+def download(url, body, sleep, retry):
+    for _ in range(retry):
+        if body is None:
+            r = get_session().get(url)
+        else:
+            r = get_session().post(url, data=json.dumps(body))
+        if 'Backoff' in r.headers:
+            time.sleep(sleep)
+        else:
+            return r.json()
+    raise ProductDataError(f"Too many attempts to get {url} (retry={retry})")
+
+
+def get_product_data(url, body=None, sleep=1, retry=100):
+    """JSON response of a GET (without body) or POST request"""
+    request_key = get_request_key(url, body)
+    with PRODUCT_DATA_LOCK:
+        if request_key in PRODUCT_DATA:
+            return PRODUCT_DATA[request_key]
+        request_lock = PRODUCT_DATA_LOCKS.setdefault(request_key, threading.Lock())
+    with request_lock:
+        with PRODUCT_DATA_LOCK:
+            if request_key in PRODUCT_DATA:
+                return PRODUCT_DATA[request_key]
+        data = load_stored_response(request_key)
+        if data is None:
+            data = download(url, body, sleep, retry)
+            store_response(request_key, data)
+        with PRODUCT_DATA_LOCK:
+            PRODUCT_DATA[request_key] = data
+    return data
+
+
+def get_product_details(sleep=1, retry=100):
+    """Data of firefox.json from product-details"""
+    return get_product_data(PRODUCT_DETAILS_URL, sleep=sleep, retry=retry)
+
+
+def search_buildhub(query, sleep=1, retry=100):
+    """Response of Buildhub to the Elasticsearch query"""
+    return get_product_data(BUILDHUB_URL, body=query, sleep=sleep, retry=retry)
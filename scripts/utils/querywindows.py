@@ -0,0 +1,95 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Searches over long date ranges get split into windows of a date field (e.g.
+# creation_ts). Busy periods need short windows to not run into the timeout or
+# the result limit of Bugzilla, quiet ones get merged into longer windows to
+# save requests. The window size which worked last gets stored per name (e.g.
+# the release phase) and is used as the initial size by the next run.
+
+import datetime
+import json
+import logging
+import os
+import time
+
+import requests
+
+QUERY_WINDOW_SIZES_PATH = 'data/query_window_sizes.json'
+
+QUERY_WINDOW_DAYS_DEFAULT = 30
+QUERY_WINDOW_DAYS_MIN = 1
+QUERY_WINDOW_DAYS_MAX = 240
+
+# A window with more results might have hit the result limit of Bugzilla and
+# gets searched again as two halves.
+QUERY_WINDOW_RESULTS_MAX = 5000
+
+# Windows whose search took longer (in seconds) are followed by shorter ones.
+QUERY_WINDOW_DURATION_MAX = 240
+
+
+def load_window_sizes():
+    if not os.path.exists(QUERY_WINDOW_SIZES_PATH):
+        return {}
+    with open(QUERY_WINDOW_SIZES_PATH, 'r') as window_sizes_reader:
+        return json.load(window_sizes_reader)
+
+
+def save_window_sizes(window_sizes):
+    with open(QUERY_WINDOW_SIZES_PATH, 'w') as window_sizes_writer:
+        json.dump(window_sizes, window_sizes_writer, indent=2, sort_keys=True)
+
+
+def search_in_windows(search, params, date_keys, start_date, end_date, name):
+    """
+    Runs search(params) for consecutive windows with
+    start_date <= date < end_date. 'date_keys' are the keys of the params which
+    get set to the start and end of the window. A window gets bisected if the
+    search fails (e.g. timeout) or returns too many bugs. Returns the bugs found,
+    each only once.
+    """
+    window_sizes = load_window_sizes()
+    window_days = window_sizes.get(name, QUERY_WINDOW_DAYS_DEFAULT)
+    window_days_good = window_days
+    bugs = {}
+    window_start = start_date
+    while window_start < end_date:
+        window_end = min(window_start + datetime.timedelta(days=window_days), end_date)
+        window_params = dict(params)
+        window_params[date_keys[0]] = window_start
+        window_params[date_keys[1]] = window_end
+        logging.getLogger().info('Bugzilla: From {} To {}'.format(window_start, window_end))
+
+        search_start = time.monotonic()
+        try:
+            results = search(window_params)
+        except requests.exceptions.RequestException:
+            if window_days <= QUERY_WINDOW_DAYS_MIN:
+                raise
+            window_days = max(window_days // 2, QUERY_WINDOW_DAYS_MIN)
+            logging.getLogger().info('Bugzilla: Search failed, retrying with {} days'.format(window_days))
+            continue
+        duration = time.monotonic() - search_start
+
+        if len(results) > QUERY_WINDOW_RESULTS_MAX and window_days > QUERY_WINDOW_DAYS_MIN:
+            window_days = max(window_days // 2, QUERY_WINDOW_DAYS_MIN)
+            logging.getLogger().info('Bugzilla: {} bugs found, retrying with {} days'.format(len(results), window_days))
+            continue
+
+        for bug_data in results:
+            bugs[bug_data['id']] = bug_data
+        window_start = window_end
+        window_days_good = window_days
+
+        if duration > QUERY_WINDOW_DURATION_MAX:
+            window_days = max(window_days // 2, QUERY_WINDOW_DAYS_MIN)
+        elif len(results) < QUERY_WINDOW_RESULTS_MAX // 4 and duration < QUERY_WINDOW_DURATION_MAX / 4:
+            window_days = min(window_days * 2, QUERY_WINDOW_DAYS_MAX)
+
+    window_sizes = load_window_sizes()
+    window_sizes[name] = window_days_good
+    save_window_sizes(window_sizes)
+
+    return [bugs[bug_id] for bug_id in sorted(bugs)]
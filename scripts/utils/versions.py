@@ -2,22 +2,88 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import bisect
 import datetime
-import json
 
-import urllib.request
+from .productdata import get_product_details
+
+RELEASE_TIMELINE = None
+
+
+class ReleaseTimeline(object):
+    """
+    Major versions shipped on the release, beta and Nightly channels by date.
+    Built from a list of the major releases like
+    productdates.get_latest_released_versions_by_min_version() returns:
+    [{'version': '96.0', 'date': datetime.date}]. The development of a version
+    on Nightly starts the day before the release of the version two lower, on
+    beta with the release of the previous version.
+    """
+
+    def __init__(self, releases):
+        releases = sorted(releases, key=lambda release: release['date'])
+        self.release_dates = [release['date'] for release in releases]
+        self.release_versions = [int(release['version'].split('.')[0]) for release in releases]
+        self.nightly_dates = [release_date - datetime.timedelta(1) for release_date in self.release_dates]
+
+    def get_release_version(self, date):
+        """Major version on the release channel on the date, None before the first release"""
+        pos = bisect.bisect_right(self.release_dates, date)
+        if pos == 0:
+            return None
+        return self.release_versions[pos - 1]
+
+    def get_beta_version(self, date):
+        release_version = self.get_release_version(date)
+        return release_version + 1 if release_version is not None else None
+
+    def get_nightly_version(self, date):
+        pos = bisect.bisect_right(self.nightly_dates, date)
+        if pos == 0:
+            return None
+        return self.release_versions[pos - 1] + 2
+
+    def get_release_dates(self, version):
+        """
+        First and last day the version was the release, None if it didn't ship.
+        The last day is None for the current release.
+        """
+        pos = bisect.bisect_left(self.release_versions, version)
+        if pos == len(self.release_versions) or self.release_versions[pos] != version:
+            return None
+        end_pos = bisect.bisect_right(self.release_versions, version)
+        if end_pos == len(self.release_dates):
+            return self.release_dates[pos], None
+        return self.release_dates[pos], self.release_dates[end_pos] - datetime.timedelta(1)
+
+    def get_nightly_dates(self, version):
+        """First and last day the version was on Nightly, like get_release_dates()"""
+        pos = bisect.bisect_left(self.release_versions, version - 2)
+        if pos == len(self.release_versions) or self.release_versions[pos] != version - 2:
+            return None
+        end_pos = bisect.bisect_right(self.release_versions, version - 2)
+        if end_pos == len(self.nightly_dates):
+            return self.nightly_dates[pos], None
+        return self.nightly_dates[pos], self.nightly_dates[end_pos] - datetime.timedelta(1)
+
+
+def get_release_timeline():
+    """ReleaseTimeline of all major Firefox releases in the product details"""
+    global RELEASE_TIMELINE
+    if RELEASE_TIMELINE is None:
+        data = get_product_details()
+        RELEASE_TIMELINE = ReleaseTimeline([{
+            'version': release_data['version'],
+            'date': datetime.date.fromisoformat(release_data['date']),
+        } for release_data in data['releases'].values() if release_data['category'] == 'major'])
+    return RELEASE_TIMELINE
 
-VERSION_INFO_URL = "https://product-details.mozilla.org/1.0/firefox.json"
 
 def get_release_versions_for_weeks(time_intervals):
-    with urllib.request.urlopen(VERSION_INFO_URL) as request_handle:
-        data = json.loads(request_handle.read())
-    major_releases_data = [release_data for release_data in data["releases"].values() if release_data["category"] == "major"]
-    major_releases_data = sorted(major_releases_data, key=lambda data: data["date"])
+    release_timeline = get_release_timeline()
     release_version_by_week = {}
     for time_interval in time_intervals:
         # day is defined as start of day
-        end_day_str = (time_interval["to"] - datetime.timedelta(1)).isoformat()
-        release_version_by_week[end_day_str] = [release_data for release_data in major_releases_data if release_data["date"] <= end_day_str][-1]["version"].split(".")[0]
+        end_day = time_interval["to"] - datetime.timedelta(1)
+        release_version_by_week[end_day.isoformat()] = str(release_timeline.get_release_version(end_day))
     return release_version_by_week
-
@@ -0,0 +1,54 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+
+
+class WorkerAccumulator(object):
+    """
+    Collects data from bug handlers which libmozdata calls on its worker
+    threads. Each thread adds to its own list, so the handlers neither have to
+    share a lock nor mutate a shared dict or list. get_items() merges the lists
+    sorted by the key passed with each item, so the result doesn't depend on
+    which thread received which bug first.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        # Registering a new thread's list is the only step needing the lock.
+        self.lock = threading.Lock()
+        self.worker_items = []
+
+    def get_worker_items(self):
+        items = getattr(self.local, 'items', None)
+        if items is None:
+            items = []
+            self.local.items = items
+            with self.lock:
+                self.worker_items.append(items)
+        return items
+
+    def add(self, key, item):
+        self.get_worker_items().append((key, item))
+
+    def add_bug(self, bug_data):
+        """Bug handler keeping the bug data, keyed by the bug id"""
+        self.add(bug_data['id'], bug_data)
+
+    def get_items(self, unique=False):
+        """
+        Returns the items sorted by their key. The keys should be unique, or
+        the items sharing a key identical and 'unique' passed to keep only one
+        of them (e.g. the same bug returned by overlapping requests).
+        """
+        with self.lock:
+            entries = [entry for items in self.worker_items for entry in items]
+        # Stable sort: items with the same key keep the order of their thread.
+        entries.sort(key=lambda entry: entry[0])
+        merged = []
+        for pos, (key, item) in enumerate(entries):
+            if unique and pos > 0 and entries[pos - 1][0] == key:
+                continue
+            merged.append(item)
+        return merged